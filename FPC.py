@@ -1,17 +1,32 @@
 from __future__ import annotations
+import time
+# Отсчёт для --profile-startup: до импорта остальных модулей
+_STARTUP_T0 = time.perf_counter()
 import tkinter as tk
 from tkinter import ttk, font, filedialog, messagebox, simpledialog
 import os
 import json
-import keyword
 import re
 import sys
-import ast
-import html
 import traceback
-
-# Спрячем консоль на Windows при запуске через python.exe
-if sys.platform == "win32":
+import queue
+import struct
+import zlib
+# ast, tempfile, multiprocessing и concurrent.futures нужны не при запуске — импортируются там, где используются
+from bisect import bisect_left, bisect_right
+# Логика без Tk — в fpc_core (её используют и процессы поиска в файлах, и бенчмарки)
+from fpc_core import (
+    THEMES, LARGE_FILE_SIZE, LOAD_SNIFF_BYTES, FIND_FILES_EXCLUDE, MOD_BITS,
+    HIGHLIGHT_TAGS, HIGHLIGHT_MARGIN, HIGHLIGHT_SYNC_LINES, HIGHLIGHT_APPLY_BUDGET_MS, HIGHLIGHT_POLL_MS,
+    LineStateCache, HighlightWorker, parse_import_text, library_from_fields, dl_filename, smart_save_dl,
+    NEWLINE_NAMES, detect_encoding, fallback_encoding, decode_lossless, detect_newline, newline_of, LineIndex,
+    compile_search, line_local, search_text, FileSearch, plan_replacements, PieceTable, SaveJob, DocSaveJob,
+    parse_chord, dl_themes, DataLibrary, dl_index_entry, scan_libs, read_libs_index, write_libs_index,
+    DlPack, DlPackError, plan_dlpack_install, install_dlpack, export_main, pack_main,
+)
+
+# Спрячем консоль на Windows при запуске через python.exe (кроме --profile-startup, export и pack: они пишут в консоль)
+if sys.platform == "win32" and "--profile-startup" not in sys.argv and sys.argv[1:2] not in (["export"], ["pack"]):
     try:
         import ctypes
         hwnd = ctypes.windll.kernel32.GetConsoleWindow()
@@ -26,144 +41,306 @@ if sys.platform == "win32":
 
 APP_NAME = "Fly Create Pro"
 
-# Базовые темы (можно расширять/замещать библиотеками .dl)
-THEMES = {
-    "Светлая": {
-        "background": "#ffffff",
-        "foreground": "#000000",
-        "cursor": "#000000",
-        "selectbackground": "#2f2f2f",
-        "selectforeground": "#ffffff",
-        "linenumber_bg": "#f0f0f0",
-        "tab_bg": "#f5f5f5",
-        "tag": {
-            "keyword": {"foreground": "#0000ff"},
-            "string": {"foreground": "#a31515"},
-            "comment": {"foreground": "#008000"},
-            "number": {"foreground": "#098658"},
-            "builtin": {"foreground": "#795e26"},
-        },
-    },
-    "Тёмная": {
-        "background": "#1e1e1e",
-        "foreground": "#d4d4d4",
-        "cursor": "#ffffff",
-        "selectbackground": "#dbeeff",
-        "selectforeground": "#000000",
-        "linenumber_bg": "#2b2b2b",
-        "tab_bg": "#2a2a2a",
-        "tag": {
-            "keyword": {"foreground": "#569cd6"},
-            "string": {"foreground": "#ce9178"},
-            "comment": {"foreground": "#6a9955"},
-            "number": {"foreground": "#b5cea8"},
-            "builtin": {"foreground": "#dcdcaa"},
-        },
-    },
-}
-
-PY_KEYWORDS = set(keyword.kwlist)
-PY_BUILTINS = set(dir(__builtins__))
-
-# Регэкспы для подсветки
-RE_COMMENT = re.compile(r"#.*")
-RE_STRING = re.compile(r"('''.*?'''|\"\"\".*?\"\"\"|'(?:\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\")", re.DOTALL)
-RE_NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
-RE_WORD = re.compile(r"\b[A-Za-z_]\w*\b")
+
+def _tk_options(options: dict) -> tuple:
+    """{"background": "#fff"} -> ("-background", "#fff") для прямого вызова Tcl."""
+    return tuple(x for key, value in options.items() for x in ("-" + key, value))
+
+
+class CompiledTheme:
+    """
+    Тема из THEMES, разобранная один раз в готовые аргументы Tcl: применение к виджету —
+    один configure и по одному tag configure на тег, без повторного разбора словаря.
+    """
+    def __init__(self, theme: dict):
+        self.source = theme
+        self.background = theme["background"]
+        self.foreground = theme["foreground"]
+        self.tab_bg = theme.get("tab_bg", self.background)
+        self.status_bg = theme.get("linenumber_bg", self.background)
+        select = {"background": theme["selectbackground"], "foreground": theme.get("selectforeground", self.foreground)}
+        self.text_args = _tk_options({"background": self.background, "foreground": self.foreground,
+                                      "insertbackground": theme["cursor"], "selectbackground": select["background"],
+                                      "selectforeground": select["foreground"]})
+        self.tag_args = [(name, _tk_options(attrs)) for name, attrs in theme.get("tag", {}).items()]
+        self.tag_args.append(("sel", _tk_options(select)))
+
+    def apply(self, text_widget):
+        call, w = text_widget.tk.call, text_widget._w
+        call(w, "configure", *self.text_args)
+        for name, args in self.tag_args:
+            call(w, "tag", "configure", name, *args)
+
+
+_COMPILED_THEMES: dict[str, CompiledTheme] = {}
+
+
+def compiled_theme(name: str) -> CompiledTheme:
+    """Скомпилированная тема THEMES[name]; пересобирается, только если словарь темы заменили."""
+    theme = THEMES[name]
+    compiled = _COMPILED_THEMES.get(name)
+    if compiled is None or compiled.source is not theme:
+        compiled = _COMPILED_THEMES[name] = CompiledTheme(theme)
+    return compiled
+
+
+# Большие файлы: с LARGE_FILE_SIZE байт файл читается и вставляется порциями через after(),
+# выше лимитов отключаются подсветка и стек отмены
+LARGE_FILE_HIGHLIGHT_LIMIT = 16 * 1024 * 1024
+LARGE_FILE_UNDO_LIMIT = 32 * 1024 * 1024
+LOAD_CHUNK_CHARS = 256 * 1024
+# С HUGE_FILE_SIZE байт файл не грузится в виджет целиком: документ живёт в PieceTable,
+# а в tk.Text — окно из VIRTUAL_WINDOW_LINES строк, которое сдвигается при прокрутке
+HUGE_FILE_SIZE = 64 * 1024 * 1024
+VIRTUAL_WINDOW_LINES = 5000
+VIRTUAL_MARGIN = 200
+# Сохранение: снимок буфера кусками по SAVE_CHUNK_LINES строк пишется в отдельном потоке
+SAVE_CHUNK_LINES = 20000
+SAVE_POLL_MS = 50
+# Поиск по мере ввода: задержка пересборки индекса совпадений и запас строк вокруг видимой области
+FIND_DEBOUNCE_MS = 150
+FIND_MARGIN_LINES = 100
+# Спящие вкладки: сверх HIBERNATE_MAX_TABS живых вкладок или HIBERNATE_MAX_CHARS символов в них
+# давно не открывавшиеся вкладки выгружаются из виджетов; текст от HIBERNATE_COMPRESS_MIN байт сжимается
+HIBERNATE_MAX_TABS = 10
+HIBERNATE_MAX_CHARS = 32 * 1024 * 1024
+HIBERNATE_COMPRESS_MIN = 16 * 1024
+# Сеанс: открытые файлы, позиции, перенос, шрифты и тема сохраняются при выходе и восстанавливаются при запуске
+SESSION_FILE = os.path.join(os.path.expanduser("~"), ".fpc_session.json")
+SESSION_VERSION = 1
+
+# Запуск: цель — окно отрисовано и принимает ввод через STARTUP_TARGET_MS от старта процесса
+STARTUP_TARGET_MS = 500
+# Отложенная загрузка (библиотеки) — после первой отрисовки, но не позже STARTUP_DEFER_MAX_MS (окно свёрнуто и т.п.)
+STARTUP_DEFER_MAX_MS = 1500
 
 # Папка для библиотек (рядом с editor.py)
 LIBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "libs")
+# Слежение за libs/: период опроса без inotify и задержка, за которую собираются события одной записи
+PLUGIN_POLL_MS = 2000
+PLUGIN_SYNC_DELAY_MS = 300
 
-def find_brace_block(text: str, start_index: int) -> tuple[int, int]:
-    n = len(text)
-    i = start_index
-    if i >= n or text[i] != "{":
-        return -1, -1
-    depth = 0
-    in_single = False
-    in_double = False
-    escape = False
-    while i < n:
-        ch = text[i]
-        if escape:
-            escape = False
-        elif ch == "\\":
-            escape = True
-        elif in_single:
-            if ch == "'" and not escape:
-                in_single = False
-        elif in_double:
-            if ch == '"' and not escape:
-                in_double = False
-        else:
-            if ch == "'":
-                in_single = True
-            elif ch == '"':
-                in_double = True
-            elif ch == "{":
-                depth += 1
-            elif ch == "}":
-                depth -= 1
-                if depth == 0:
-                    return start_index, i + 1
-        i += 1
-    return -1, -1
-
-
-def extract_fields_from_text(raw: str) -> dict:
-    fields = {}
-    for key in ("name", "creator", "value", "code", "type"):
-        m = re.search(r"\b" + re.escape(key) + r"\s*:\s*\{", raw, flags=re.IGNORECASE)
-        if not m:
-            continue
-        brace_start = raw.find("{", m.start())
-        s, e = find_brace_block(raw, brace_start)
-        if s == -1:
-            continue
-        inner = raw[s + 1:e - 1].strip()
-        fields[key] = inner
-    if "code" in fields:
-        code_text = fields["code"]
+
+# -------------------------
+# PluginManager (интегрирован)
+# -------------------------
+# Сочетания клавиш: удар — "Control-Alt-Shift-Mod4-клавиша" (модификаторы в порядке MOD_BITS, клавиша
+# в нижнем регистре); аккорд — кортеж ударов (parse_chord в fpc_core).
+KEY_BINDTAG = "FPCKeys"
+CHORD_TIMEOUT_MS = 1500
+SNIPPET_CURSOR = "$0"
+_MODIFIER_KEYSYMS = {"control_l", "control_r", "shift_l", "shift_r", "alt_l", "alt_r", "super_l", "super_r",
+                     "meta_l", "meta_r", "caps_lock", "num_lock", "iso_level3_shift"}
+# Русская раскладка: keysym Cyrillic_* -> клавиша на том же месте в латинской, чтобы Ctrl+A срабатывал и как Ctrl+Ф
+_CYRILLIC_KEYSYMS = dict(zip(
+    ("cyrillic_shorti cyrillic_tse cyrillic_u cyrillic_ka cyrillic_ie cyrillic_en cyrillic_ghe cyrillic_sha "
+     "cyrillic_shcha cyrillic_ze cyrillic_ha cyrillic_hardsign cyrillic_ef cyrillic_yeru cyrillic_ve cyrillic_a "
+     "cyrillic_pe cyrillic_er cyrillic_o cyrillic_el cyrillic_de cyrillic_zhe cyrillic_e cyrillic_ya cyrillic_che "
+     "cyrillic_es cyrillic_em cyrillic_i cyrillic_te cyrillic_softsign cyrillic_be cyrillic_yu cyrillic_io").split(),
+    ("q w e r t y u i o p bracketleft bracketright a s d f g h j k l semicolon apostrophe z x c v b n m "
+     "comma period grave").split()))
+
+
+def insert_snippet(text_widget, snippet: str):
+    """Вставляет snippet одним insert; если в нём есть $0, курсор встаёт на это место."""
+    before, mark, after = snippet.partition(SNIPPET_CURSOR)
+    text_widget.insert(tk.INSERT, before + after)
+    if mark and after:
+        text_widget.mark_set(tk.INSERT, f"{tk.INSERT}-{len(after)}c")
+
+
+class KeyDispatcher:
+    """
+    Единый обработчик клавиш текстовых полей: bindtag KEY_BINDTAG стоит перед классом Text,
+    сочетания хранятся в префиксном дереве ударов. Аккорд (Ctrl+K Ctrl+C) ждёт следующий удар
+    CHORD_TIMEOUT_MS. Включение и отключение — флаг записи, таблица биндингов Tk не меняется.
+    """
+    _LEAF = ""
+
+    def __init__(self, widget):
+        self.widget = widget
+        self._root: dict = {}
+        # имя -> {"keys", "handler", "enabled"}; handler None — сочетание занято встроенной командой
+        self._entries: dict[str, dict] = {}
+        self._node = self._root
+        self._timeout_id = None
+        widget.bind_class(KEY_BINDTAG, "<KeyPress>", self._on_key)
+
+    @staticmethod
+    def stroke(event) -> str | None:
+        keysym = (event.keysym or "").lower()
+        if not keysym or keysym in _MODIFIER_KEYSYMS:
+            return None
+        keysym = _CYRILLIC_KEYSYMS.get(keysym, keysym)
+        return "-".join([m for m, bit in MOD_BITS if event.state & bit] + [keysym])
+
+    def conflict(self, keys) -> str | None:
+        """Имя сочетания, которое совпадает с keys, является его префиксом или начинается с него."""
+        node = self._root
+        for key in keys:
+            if self._LEAF in node:
+                return node[self._LEAF]
+            node = node.get(key)
+            if node is None:
+                return None
+        while self._LEAF not in node:
+            node = next(iter(node.values()))
+        return node[self._LEAF]
+
+    def register(self, name: str, keys, handler, enabled=True) -> str | None:
+        """Добавляет сочетание; при конфликте ничего не меняет и возвращает имя занявшего его."""
+        other = self.conflict(keys)
+        if other is not None:
+            return other
+        node = self._root
+        for key in keys:
+            node = node.setdefault(key, {})
+        node[self._LEAF] = name
+        self._entries[name] = {"keys": tuple(keys), "handler": handler, "enabled": enabled}
+        return None
+
+    def reserve(self, name: str, keys):
+        """Занимает сочетание встроенной команды (её обрабатывает bind_all), чтобы библиотеки его не перехватили."""
+        self.register(name, keys, None)
+
+    def unregister(self, name: str):
+        entry = self._entries.pop(name, None)
+        if not entry:
+            return
+        keys = entry["keys"]
+        path = [self._root]
+        for key in keys:
+            path.append(path[-1][key])
+        del path[-1][self._LEAF]
+        for i in range(len(keys) - 1, -1, -1):
+            if path[i + 1]:
+                break
+            del path[i][keys[i]]
+        self._reset()
+
+    def is_enabled(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return bool(entry and entry["enabled"])
+
+    def set_enabled(self, name: str, enabled: bool):
+        if name in self._entries:
+            self._entries[name]["enabled"] = enabled
+
+    def _active(self, node: dict) -> bool:
+        if self._LEAF in node:
+            entry = self._entries[node[self._LEAF]]
+            return entry["enabled"] and entry["handler"] is not None
+        return any(self._active(child) for child in node.values())
+
+    def _reset(self):
+        if self._timeout_id:
+            try: self.widget.after_cancel(self._timeout_id)
+            except Exception: pass
+            self._timeout_id = None
+        self._node = self._root
+
+    def _on_key(self, event):
+        stroke = self.stroke(event)
+        if stroke is None:
+            return None
+        in_chord = self._node is not self._root
+        node = self._node.get(stroke)
+        self._reset()
+        if node is None or not self._active(node):
+            # Начатый аккорд не совпал — клавиша поглощается, как в других редакторах
+            return "break" if in_chord else None
+        if self._LEAF not in node:
+            self._node = node
+            self._timeout_id = self.widget.after(CHORD_TIMEOUT_MS, self._reset)
+            return "break"
         try:
-            parsed = json.loads("{" + code_text + "}") if (code_text.strip().startswith('"') or ":" in code_text) else code_text
-            fields["code"] = parsed
+            self._entries[node[self._LEAF]]["handler"](event)
         except Exception:
-            try:
-                parsed = ast.literal_eval("{" + code_text + "}") if ":" in code_text else code_text
-                fields["code"] = parsed
-            except Exception:
-                fields["code"] = code_text
-    for k in ("name", "creator", "value", "type"):
-        if k in fields:
-            v = fields[k].strip()
-            if (v.startswith('"') and v.endswith('"')) or (v.startswith("'") and v.endswith("'")):
-                v = v[1:-1]
-            fields[k] = v
-    return fields
+            traceback.print_exc()
+        return "break"
 
 
-def smart_save_dl(obj: dict, dest_path: str) -> bool:
-    try:
-        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-        with open(dest_path, "w", encoding="utf-8") as f:
-            json.dump(obj, f, ensure_ascii=False, indent=2)
+class LibsWatcher:
+    """
+    Сообщает callback() об изменениях .dl в папке: на Linux — inotify (через ctypes) и
+    createfilehandler Tk, иначе — опрос mtime/размеров раз в PLUGIN_POLL_MS через after().
+    """
+    # IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    _INOTIFY_MASK = 0x002 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+
+    def __init__(self, widget, folder: str, callback):
+        self.widget = widget
+        self.folder = folder
+        self.callback = callback
+        self._fd = None
+        self._poll_id = None
+        self._snapshot = None
+
+    def start(self):
+        if sys.platform.startswith("linux") and self._start_inotify():
+            return
+        self._snapshot = self._scan()
+        self._poll_id = self.widget.after(PLUGIN_POLL_MS, self._poll)
+
+    def stop(self):
+        if self._fd is not None:
+            try: self.widget.tk.deletefilehandler(self._fd)
+            except Exception: pass
+            os.close(self._fd); self._fd = None
+        if self._poll_id:
+            try: self.widget.after_cancel(self._poll_id)
+            except Exception: pass
+            self._poll_id = None
+
+    def _start_inotify(self) -> bool:
+        try:
+            import ctypes, ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+            if fd < 0:
+                return False
+            if libc.inotify_add_watch(fd, os.fsencode(self.folder), self._INOTIFY_MASK) < 0:
+                os.close(fd); return False
+            self.widget.tk.createfilehandler(fd, tk.READABLE, lambda *_: self._on_inotify())
+        except Exception:
+            return False
+        self._fd = fd
         return True
-    except Exception:
-        return False
 
+    def _on_inotify(self):
+        # struct inotify_event: int wd; uint32 mask, cookie, len; char name[len]
+        relevant = False
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except (BlockingIOError, OSError):
+                break
+            if not buf:
+                break
+            pos = 0
+            while pos + 16 <= len(buf):
+                _, _, _, length = struct.unpack_from("iIII", buf, pos)
+                name = buf[pos + 16:pos + 16 + length].rstrip(b"\0")
+                relevant = relevant or name.lower().endswith(b".dl")
+                pos += 16 + length
+        if relevant:
+            self.callback()
+
+    def _scan(self) -> dict:
+        try:
+            return {e.name: (e.stat().st_mtime_ns, e.stat().st_size) for e in os.scandir(self.folder)
+                    if e.name.lower().endswith(".dl")}
+        except OSError:
+            return {}
 
-# -------------------------
-# PluginManager (интегрирован)
-# -------------------------
-class DataLibrary:
-    def __init__(self, path: str, raw: dict):
-        self.path = path
-        self.raw = raw
-        self.type = raw.get("type")
-        self.name = raw.get("name")
-        self.creator = raw.get("creator")
-        self.value = raw.get("value")
-        self.code = raw.get("code")
+    def _poll(self):
+        snapshot = self._scan()
+        if snapshot != self._snapshot:
+            self._snapshot = snapshot
+            self.callback()
+        self._poll_id = self.widget.after(PLUGIN_POLL_MS, self._poll)
 
 
 class PluginManager:
@@ -172,46 +349,175 @@ class PluginManager:
     Загружает библиотеки из папки libs/ (не создаёт и не записывает встроенные файлы).
     Позволяет применять тему, включать бинды (insert-only), открывать вкладки.
     """
+    # Пунктов меню перед списком библиотек: установка .dl, пакета, импорт, форма и разделитель
+    MENU_HEAD = 5
+
     def __init__(self, app, menu: tk.Menu, libs_dir: str = LIBS_DIR):
         self.app = app
         self.menu = menu
         self.libs_dir = libs_dir
         self.libs: list[DataLibrary] = []
         self.binds: dict[str, dict] = {}
+        # Имя темы -> библиотека, из которой её тело будет прочитано при первом применении
+        self.theme_owners: dict[str, DataLibrary] = {}
+        # Встроенные темы не удаляются при выгрузке библиотек с совпадающими именами
+        self._builtin_themes = set(THEMES)
+        self._sync_id = None
+        # Сочетания библиотек, не зарегистрированные из-за конфликта; показываются одним сообщением
+        self.conflicts: list[str] = []
+        # имя файла -> {"key": [mtime_ns, size], "header": {...} или None, "reg": {...}}
+        self._index: dict[str, dict] = {}
         # Создаём только папку, не записываем никаких примеров
         os.makedirs(self.libs_dir, exist_ok=True)
         self._load_all()
         self._build_menu()
+        self.watcher = LibsWatcher(app, self.libs_dir, self._schedule_sync)
+        self.watcher.start()
+        self._report_conflicts()
+
+    # --- Индекс библиотек ---
+    def _read_index(self) -> dict:
+        return read_libs_index(self.libs_dir)
+
+    def _write_index(self):
+        write_libs_index(self.libs_dir, self._index)
+
+    def _index_entry(self, fname: str, cached: dict | None = None) -> dict | None:
+        return dl_index_entry(os.path.join(self.libs_dir, fname), cached)
 
     def _load_all(self):
+        """Загружает libs/ по индексу: заново разбираются только новые и изменённые файлы."""
         self.libs.clear()
-        for fname in sorted(os.listdir(self.libs_dir)):
-            if not fname.lower().endswith(".dl"):
-                continue
-            path = os.path.join(self.libs_dir, fname)
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    raw = json.load(f)
-                if not all(k in raw for k in ("type", "name", "creator", "value", "code")):
-                    continue
-                dl = DataLibrary(path, raw)
-                self.libs.append(dl)
-                if dl.type == "theme":
-                    self._register_theme(dl)
-                elif dl.type == "bind":
-                    self._register_bind(dl)
-                elif dl.type == "tabs":
-                    self._register_tabs(dl)
-            except Exception:
-                traceback.print_exc()
+        cached = self._index or self._read_index()
+        self._index = scan_libs(self.libs_dir, cached)
+        for fname, entry in self._index.items():
+            if entry["header"] is not None:
+                self._register(DataLibrary(os.path.join(self.libs_dir, fname), entry["header"], entry["reg"]))
+        if self._index != cached:
+            self._write_index()
+
+    def _register(self, dl: DataLibrary):
+        try:
+            if dl.type == "theme":
+                self._register_theme(dl)
+            elif dl.type == "bind":
+                self._register_bind(dl)
+            elif dl.type == "tabs":
+                self._register_tabs(dl)
+        except Exception:
+            traceback.print_exc()
+        self.libs.append(dl)
+
+    def register_library(self, path: str):
+        """Добавляет одну библиотеку из libs/: запись индекса, регистрация и пункт меню без пересборки остальных."""
+        fname = os.path.basename(path)
+        # Файл заменён поверх уже загруженного — сначала убираем старую версию
+        self.unregister_library(fname)
+        entry = self._index_entry(fname)
+        if entry is None:
+            return
+        self._index[fname] = entry
+        self._write_index()
+        if entry["header"] is None:
+            return
+        dl = DataLibrary(os.path.join(self.libs_dir, fname), entry["header"], entry["reg"])
+        self._register(dl)
+        self.libs.sort(key=lambda d: os.path.basename(d.path))
+        if len(self.libs) == 1:
+            self._build_menu()
+        else:
+            # MENU_HEAD служебных пунктов в начале меню, дальше библиотеки в порядке имён файлов
+            self._add_menu_entry(dl, self.MENU_HEAD + self.libs.index(dl))
+        self._report_conflicts()
+
+    def register_libraries(self, paths: list[str], removed: list[str] = ()):
+        """
+        Пакетная установка файлов из libs/ (и выгрузка удалённых removed): все записи индекса и
+        регистрации, затем одна запись индекса и одна сборка меню.
+        """
+        for fname in list(removed) + [os.path.basename(path) for path in paths]:
+            self._index.pop(fname, None)
+            pos = next((i for i, dl in enumerate(self.libs) if os.path.basename(dl.path) == fname), None)
+            if pos is not None:
+                self._unregister(self.libs.pop(pos))
+        for path in paths:
+            fname = os.path.basename(path)
+            entry = self._index_entry(fname)
+            if entry is None:
                 continue
+            self._index[fname] = entry
+            if entry["header"] is not None:
+                self._register(DataLibrary(os.path.join(self.libs_dir, fname), entry["header"], entry["reg"]))
+        self.libs.sort(key=lambda d: os.path.basename(d.path))
+        self._write_index()
+        self._build_menu()
+        self._report_conflicts()
+
+    def unregister_library(self, fname: str):
+        """Убирает библиотеку-файл fname: темы, бинд, пункт меню и запись индекса."""
+        entry = self._index.pop(fname, None)
+        pos = next((i for i, dl in enumerate(self.libs) if os.path.basename(dl.path) == fname), None)
+        if pos is not None:
+            dl = self.libs.pop(pos)
+            self._unregister(dl)
+            if self.libs:
+                self._delete_menu_entries(self.MENU_HEAD + pos)
+            else:
+                self._build_menu()
+        if entry is not None:
+            self._write_index()
+
+    def _unregister(self, dl: DataLibrary):
+        if dl.type == "theme":
+            # Текущая тема остаётся в THEMES: на неё ссылаются новые вкладки
+            current = getattr(self.app, "current_theme", None)
+            for name in dl.reg.get("themes", []) + [dl.name]:
+                if self.theme_owners.get(name) is dl:
+                    del self.theme_owners[name]
+                if name != current and name not in self._builtin_themes:
+                    THEMES.pop(name, None)
+        info = self.binds.get(dl.name)
+        if info and info["dl"] is dl:
+            del self.binds[dl.name]
+            self.app.keys.unregister(dl.name)
+
+    def _schedule_sync(self):
+        if self._sync_id:
+            self.app.after_cancel(self._sync_id)
+        self._sync_id = self.app.after(PLUGIN_SYNC_DELAY_MS, self.sync_libs)
+
+    def sync_libs(self):
+        """Сверяет libs/ с индексом: новые и изменённые файлы регистрируются, удалённые — выгружаются, по одному."""
+        self._sync_id = None
+        try:
+            current = {e.name: [e.stat().st_mtime_ns, e.stat().st_size] for e in os.scandir(self.libs_dir)
+                       if e.name.lower().endswith(".dl") and e.is_file()}
+        except OSError:
+            return
+        for fname in [f for f in self._index if f not in current]:
+            self.unregister_library(fname)
+        for fname, key in sorted(current.items()):
+            entry = self._index.get(fname)
+            if not entry or entry["key"] != key:
+                self.register_library(os.path.join(self.libs_dir, fname))
+
+    def _delete_menu_entries(self, first, last=None):
+        """menu.delete вместе с подменю каскадов: сам delete убирает только пункты, tk.Menu подменю остаётся."""
+        start, end = self.menu.index(first), self.menu.index(first if last is None else last)
+        if start is None or end is None:
+            return
+        for i in range(start, end + 1):
+            if self.menu.type(i) == "cascade":
+                self.menu.nametowidget(self.menu.entrycget(i, "menu")).destroy()
+        self.menu.delete(start, end)
 
     def _build_menu(self):
         try:
-            self.menu.delete(0, "end")
+            self._delete_menu_entries(0, "end")
         except Exception:
             pass
         self.menu.add_command(label="Установить .dl из файла...", command=self.install_dl_from_file)
+        self.menu.add_command(label="Установить пакет .dlpack...", command=self.install_pack_from_file)
         self.menu.add_command(label="Импорт .dl из текста (.txt)...", command=self.import_dl_from_text_file)
         self.menu.add_command(label="Создать новую .dl (форма)...", command=self.create_dl_via_form)
         self.menu.add_separator()
@@ -221,25 +527,40 @@ class PluginManager:
             self.menu.add_command(label="Открыть папку с библиотеками...", command=lambda: self._open_libs_folder())
             return
         for dl in self.libs:
-            sub = tk.Menu(self.menu, tearoff=False)
-            self.menu.add_cascade(label=dl.name, menu=sub)
-            sub.add_command(label=f"Инфо (создатель: {dl.creator})", command=lambda d=dl: self._show_info(d))
-            if dl.type == "theme":
-                sub.add_command(label="Установить тему", command=lambda d=dl: self.apply_theme_from_dl(d))
-            if dl.type == "bind":
-                sub.add_command(label="Включить биндинг", command=lambda d=dl: self.enable_bind(d))
-                sub.add_command(label="Отключить биндинг", command=lambda d=dl: self.disable_bind(d))
-            if dl.type == "tabs":
-                tabs = dl.code.get("tabs") if isinstance(dl.code, dict) else None
-                if isinstance(tabs, list):
-                    for t in tabs:
-                        title = t.get("title", "Без названия")
-                        sub.add_command(label=f"Открыть вкладку: {title}", command=lambda t=t: self.app.new_tab(content=t.get("content", "")))
-            sub.add_separator()
-            sub.add_command(label="Показать raw .dl", command=lambda d=dl: self._show_raw(d))
+            self._add_menu_entry(dl)
         self.menu.add_separator()
         self.menu.add_command(label="Открыть папку с библиотеками...", command=lambda: self._open_libs_folder())
 
+    def _add_menu_entry(self, dl: DataLibrary, position: int | None = None):
+        sub = tk.Menu(self.menu, tearoff=False)
+        # Пункты подменю создаются при первом его открытии
+        sub.configure(postcommand=lambda d=dl, m=sub: self._fill_submenu(d, m))
+        if position is None:
+            self.menu.add_cascade(label=dl.name, menu=sub)
+        else:
+            self.menu.insert_cascade(position, label=dl.name, menu=sub)
+
+    def _fill_submenu(self, dl: DataLibrary, sub: tk.Menu):
+        if sub.index("end") is not None:
+            return
+        sub.add_command(label=f"Инфо (создатель: {dl.creator})", command=lambda d=dl: self._show_info(d))
+        if dl.type == "theme":
+            sub.add_command(label="Установить тему", command=lambda d=dl: self.apply_theme_from_dl(d))
+        if dl.type == "bind":
+            sub.add_command(label="Включить биндинг", command=lambda d=dl: self.enable_bind(d))
+            sub.add_command(label="Отключить биндинг", command=lambda d=dl: self.disable_bind(d))
+        if dl.type == "tabs":
+            for i, title in enumerate(dl.reg.get("titles", [])):
+                sub.add_command(label=f"Открыть вкладку: {title}", command=lambda d=dl, i=i: self._open_template(d, i))
+        sub.add_separator()
+        sub.add_command(label="Показать raw .dl", command=lambda d=dl: self._show_raw(d))
+
+    def _open_template(self, dl: DataLibrary, i: int):
+        code = dl.code
+        tabs = code.get("tabs") if isinstance(code, dict) else None
+        if isinstance(tabs, list) and i < len(tabs) and isinstance(tabs[i], dict):
+            self.app.new_tab(content=tabs[i].get("content", ""))
+
     def _show_info(self, dl: DataLibrary):
         txt = f"Имя: {dl.name}\nСоздатель: {dl.creator}\nТип: {dl.type}\nФайл: {dl.path}"
         messagebox.showinfo("Информация о библиотеке", txt)
@@ -276,91 +597,55 @@ class PluginManager:
                 pass
 
     def _register_theme(self, dl: DataLibrary):
+        for name in dl.reg.get("themes", []):
+            self.theme_owners[name] = dl
+
+    def load_theme(self, name: str) -> bool:
+        """Читает тело библиотеки, которой принадлежит тема name, и добавляет её темы в THEMES."""
+        dl = self.theme_owners.get(name)
+        if not dl:
+            return False
         try:
-            code = dl.code
-            if isinstance(code, dict):
-                simple_keys = {"background", "foreground", "cursor"}
-                if simple_keys.issubset(set(code.keys())):
-                    THEMES[dl.name] = code
-                else:
-                    for branch, val in code.items():
-                        THEMES[f"{dl.name} - {branch}"] = val
-            else:
-                THEMES[dl.name] = code
+            THEMES.update(dl_themes(dl.name, dl.code))
         except Exception:
-            pass
-
-    def _combo_to_tk(self, combo_str: str) -> str | None:
-        if not combo_str:
-            return None
-        parts = [p.strip() for p in combo_str.split("+") if p.strip()]
-        mods = []
-        key = None
-        for p in parts:
-            lp = p.lower()
-            if lp in ("ctrl", "control"):
-                mods.append("Control")
-            elif lp in ("alt",):
-                mods.append("Alt")
-            elif lp in ("shift",):
-                mods.append("Shift")
-            elif lp in ("win", "meta", "super"):
-                mods.append("Mod4")
-            else:
-                key = p
-        if not key:
-            return None
-        if len(key) == 1:
-            key = key.lower()
-        return "<" + "-".join(mods + [key]) + ">"
+            traceback.print_exc()
+        return name in THEMES
 
     def _register_bind(self, dl: DataLibrary):
-        try:
-            code = dl.code or {}
-            combo = code.get("combo")
-            action = code.get("action")
-            if not combo or not action:
-                return
-            tk_combo = self._combo_to_tk(combo)
-            if not tk_combo:
-                return
-            if action != "insert":
+        keys = dl.reg.get("keys")
+        if not keys:
+            return
+        # Текст вставки читается из файла при первом срабатывании
+        entry = {"dl": dl, "keys": keys, "text": None}
+        def handler(event, _entry=entry):
+            tab = self.app.current_editor_tab()
+            if not tab:
                 return
-            text = code.get("text", "")
-            def handler(event, _text=text):
-                try:
-                    tab = self.app.current_editor_tab()
-                    if not tab:
-                        return "break"
-                    tab.text.insert("insert", _text)
-                except Exception:
-                    pass
-                return "break"
-            entry = {"dl": dl, "tk": tk_combo, "handler": handler, "enabled": False}
-            self.binds[dl.name] = entry
-            self.enable_bind(dl)
-        except Exception:
-            pass
+            if _entry["text"] is None:
+                code = dl.code
+                _entry["text"] = code.get("text", "") if isinstance(code, dict) else ""
+            insert_snippet(tab.text, _entry["text"])
+        other = self.app.keys.register(dl.name, keys, handler)
+        if other is not None:
+            self.conflicts.append(f"{dl.name}: {dl.reg.get('combo')} уже занято ({other})")
+            return
+        self.binds[dl.name] = entry
+
+    def _report_conflicts(self):
+        if self.conflicts:
+            messagebox.showwarning("Конфликт сочетаний", "Биндинги не подключены:\n" + "\n".join(self.conflicts))
+            self.conflicts.clear()
 
     def enable_bind(self, dl: DataLibrary):
-        info = self.binds.get(dl.name)
-        if not info:
-            return
-        if info.get("enabled"):
+        if dl.name not in self.binds or self.app.keys.is_enabled(dl.name):
             return
-        self.app.bind_all(info["tk"], info["handler"])
-        info["enabled"] = True
-        messagebox.showinfo("Бинд включён", f"Бинд из '{dl.name}' включён (комбинация {dl.code.get('combo')}).")
+        self.app.keys.set_enabled(dl.name, True)
+        messagebox.showinfo("Бинд включён", f"Бинд из '{dl.name}' включён (комбинация {dl.reg.get('combo')}).")
 
     def disable_bind(self, dl: DataLibrary):
-        info = self.binds.get(dl.name)
-        if not info or not info.get("enabled"):
+        if dl.name not in self.binds or not self.app.keys.is_enabled(dl.name):
             return
-        try:
-            self.app.unbind_all(info["tk"])
-        except Exception:
-            pass
-        info["enabled"] = False
+        self.app.keys.set_enabled(dl.name, False)
         messagebox.showinfo("Бинд отключён", f"Бинд из '{dl.name}' отключён.")
 
     def _register_tabs(self, dl: DataLibrary):
@@ -379,12 +664,50 @@ class PluginManager:
             dest = os.path.join(self.libs_dir, os.path.basename(path))
             if os.path.abspath(path) != os.path.abspath(dest):
                 smart_save_dl(raw, dest)
-            self._load_all()
-            self._build_menu()
+            self.register_library(dest)
             messagebox.showinfo("Установлено", "Библиотека установлена.")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось установить .dl: {e}")
 
+    def install_pack_from_file(self):
+        """Пакет .dlpack: план по манифесту, одно подтверждение, установка целиком и одно обновление реестра."""
+        path = filedialog.askopenfilename(filetypes=[("Пакет библиотек", "*.dlpack"), ("Zip", "*.zip"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            with DlPack(path) as pack:
+                plan = plan_dlpack_install(pack, self.libs_dir)
+                changes = [step for step in plan if step["action"] != "same"]
+                # Библиотеки читаются прямо из архива: битый файл обнаружится до подтверждения, тип попадёт в план
+                for step in changes:
+                    if step["action"] in ("new", "update"):
+                        step["type"] = pack.library(step["file"])["type"]
+                title = f"{pack.name} {pack.version}".strip()
+                if not changes:
+                    messagebox.showinfo("Пакет библиотек", f"Пакет '{title}' уже установлен.")
+                    return
+                if not messagebox.askyesno("Пакет библиотек", f"Установить пакет '{title}'?\n\n" + self._format_plan(changes)):
+                    return
+                paths, removed = install_dlpack(pack, self.libs_dir, plan)
+        except (DlPackError, OSError) as e:
+            messagebox.showerror("Ошибка", f"Пакет не установлен: {e}")
+            return
+        self.register_libraries(paths, removed)
+        messagebox.showinfo("Пакет библиотек", f"Пакет '{title}': установлено и обновлено {len(paths)}, удалено {len(removed)}.")
+
+    @staticmethod
+    def _format_plan(steps: list[dict], limit: int = 20) -> str:
+        marks = {"new": "+", "update": "~", "remove": "-", "keep": "!"}
+        lines = []
+        for step in steps[:limit]:
+            versions = " -> ".join(v for v in (step["installed"], step["version"]) if v)
+            kind = f" [{step['type']}]" if step.get("type") else ""
+            note = " — изменён локально, останется" if step["action"] == "keep" else ""
+            lines.append(f"{marks[step['action']]} {step['name']}{kind} ({step['file']}) {versions}".rstrip() + note)
+        if len(steps) > limit:
+            lines.append(f"... и ещё {len(steps) - limit}")
+        return "\n".join(lines)
+
     def import_dl_from_text_file(self):
         path = filedialog.askopenfilename(filetypes=[("Text files", "*.txt;*.dl;*.json"), ("All files", "*.*")])
         if not path:
@@ -395,18 +718,56 @@ class PluginManager:
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось прочитать файл: {e}")
             return
-        fields = extract_fields_from_text(txt)
-        if not fields:
-            messagebox.showerror("Ошибка", "Не удалось распознать поля в тексте.")
+        records, errors = parse_import_text(txt)
+        if not records:
+            messagebox.showerror("Ошибка", "Не удалось распознать поля в тексте." + self._format_errors(errors))
             return
-        dl_obj = {}
-        ttype = fields.get("type") or fields.get("value") or "theme"
-        dl_obj["type"] = ttype
-        dl_obj["name"] = fields.get("name") or "ImportedLib"
-        dl_obj["creator"] = fields.get("creator") or "unknown"
-        dl_obj["value"] = fields.get("value") or ttype
-        dl_obj["code"] = fields.get("code") or {}
-        PreviewAndSaveDialog(self.app, json.dumps(dl_obj, ensure_ascii=False, indent=2), lambda dest: self._save_imported(dl_obj, dest))
+        objs = [library_from_fields(fields) for fields in records]
+        if len(objs) == 1:
+            if errors:
+                messagebox.showwarning("Импорт", "Текст разобран с ошибками:" + self._format_errors(errors))
+            dl_obj = objs[0]
+            PreviewAndSaveDialog(self.app, json.dumps(dl_obj, ensure_ascii=False, indent=2), lambda dest: self._save_imported(dl_obj, dest))
+            return
+        self._import_batch(objs, errors)
+
+    @staticmethod
+    def _format_errors(errors, limit: int = 10) -> str:
+        if not errors:
+            return ""
+        lines = [str(e) for e in errors[:limit]]
+        if len(errors) > limit:
+            lines.append(f"... и ещё {len(errors) - limit}")
+        return "\n\n" + "\n".join(lines)
+
+    def _import_batch(self, objs: list[dict], errors):
+        """Несколько библиотек из одного текста: подтверждение, запись файлов и одна регистрация всего пакета."""
+        try:
+            existing = {f.lower() for f in os.listdir(self.libs_dir)}
+        except OSError:
+            existing = set()
+        taken, plan = set(), []
+        for obj in objs:
+            fname = dl_filename(str(obj["name"]), taken)
+            taken.add(fname.lower())
+            plan.append((fname, obj))
+        replaced = [fname for fname, _ in plan if fname.lower() in existing]
+        summary = "\n".join(f"{obj['name']} ({obj['type']}) -> {fname}" for fname, obj in plan[:20])
+        if len(plan) > 20:
+            summary += f"\n... и ещё {len(plan) - 20}"
+        if replaced:
+            summary += "\n\nБудут заменены: " + ", ".join(replaced)
+        if not messagebox.askyesno("Импорт библиотек", f"Установить библиотеки ({len(plan)})?\n\n{summary}" + self._format_errors(errors)):
+            return
+        paths, failed = [], []
+        for fname, obj in plan:
+            dest = os.path.join(self.libs_dir, fname)
+            (paths if smart_save_dl(obj, dest) else failed).append(dest)
+        self.register_libraries(paths)
+        message = f"Установлено библиотек: {len(paths)}"
+        if failed:
+            message += "\nНе удалось сохранить:\n" + "\n".join(failed)
+        messagebox.showinfo("Импорт библиотек", message)
 
     def _save_imported(self, dl_obj: dict, dest_filename: str | None):
         if not dest_filename:
@@ -415,8 +776,7 @@ class PluginManager:
         ok = smart_save_dl(dl_obj, dest)
         if ok:
             messagebox.showinfo("Сохранено", f"Библиотека сохранена в {dest}")
-            self._load_all()
-            self._build_menu()
+            self.register_library(dest)
         else:
             messagebox.showerror("Ошибка", "Не удалось сохранить .dl")
 
@@ -519,6 +879,7 @@ class FormCreateDL(tk.Toplevel):
             try:
                 code_obj = json.loads(code_txt)
             except Exception:
+                import ast
                 code_obj = ast.literal_eval(code_txt)
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось разобрать код (code) как JSON/Python literal:\n{e}")
@@ -532,6 +893,159 @@ class FormCreateDL(tk.Toplevel):
 # -------------------------
 # Основной редактор (с уже встроенным плагином)
 # -------------------------
+class TextRedirector:
+    """
+    Перехватывает команды insert/delete/replace у tk.Text (как WidgetRedirector в IDLE)
+    и сообщает, какие строки изменились: on_edit(first, old_last, new_last) —
+    строки first..old_last заменены строками first..new_last.
+    Для undo/redo диапазон неизвестен, тогда вызывается on_edit(None, None, None).
+    """
+    def __init__(self, widget: tk.Text, on_edit):
+        self.widget = widget
+        self.on_edit = on_edit
+        self.orig = widget._w + "_orig"
+        widget.tk.call("rename", widget._w, self.orig)
+        widget.tk.createcommand(widget._w, self._dispatch)
+        # Misc.destroy удалит нашу команду вместе с виджетом
+        if widget._tclCommands is None:
+            widget._tclCommands = []
+        widget._tclCommands.append(widget._w)
+
+    def call(self, *args):
+        return self.widget.tk.call((self.orig,) + args)
+
+    def _line(self, index: str) -> int:
+        return int(str(self.call("index", index)).split(".")[0])
+
+    def _last_line(self) -> int:
+        return self._line("end-1c")
+
+    def _notify(self, first, old_last, new_last):
+        # Ошибка в обработчике не должна обрывать саму правку и mainloop
+        try:
+            self.on_edit(first, old_last, new_last)
+        except Exception:
+            traceback.print_exc()
+
+    def _dispatch(self, op, *args):
+        # Ошибки Tcl самой команды виджета не глотаются: на них полагаются catch в привязках Tk
+        # (tk_textCopy без выделения) и обработчики tk.TclError в редакторе
+        if op == "insert" and len(args) >= 2:
+            first = min(self._line(args[0]), self._last_line())
+            res = self.call(op, *args)
+            added = "".join(args[1::2]).count("\n")
+            self._notify(first, first, first + added)
+            return res
+        if op == "delete" and len(args) > 2:
+            res = self.call(op, *args)
+            self._notify(None, None, None)
+            return res
+        if op == "delete" and args:
+            first = min(self._line(args[0]), self._last_line())
+            last = min(self._line(args[1] if len(args) > 1 else args[0] + "+1c"), self._last_line())
+            res = self.call(op, *args)
+            if last >= first:
+                self._notify(first, last, first)
+            return res
+        if op == "replace" and len(args) >= 3:
+            first = min(self._line(args[0]), self._last_line())
+            last = max(first, min(self._line(args[1]), self._last_line()))
+            res = self.call(op, *args)
+            added = "".join(args[2::2]).count("\n")
+            self._notify(first, last, first + added)
+            return res
+        if op == "edit" and args and args[0] in ("undo", "redo"):
+            res = self.call(op, *args)
+            self._notify(None, None, None)
+            return res
+        return self.call(op, *args)
+
+
+class UiUpdates:
+    """
+    Отложенное обновление частей окна: mark() помечает часть грязной, а flush() один раз за тик
+    after_idle вызывает обработчики помеченных частей (в порядке handlers). Серия событий
+    автоповтора клавиш или вставки даёт одно обновление вместо обновления на каждое событие.
+    """
+    def __init__(self, widget, handlers: dict):
+        self.widget = widget
+        self.handlers = handlers
+        self._dirty: set[str] = set()
+        self._idle_id = None
+
+    def mark(self, *parts: str):
+        self._dirty.update(parts)
+        if self._idle_id is None:
+            self._idle_id = self.widget.after_idle(self.flush)
+
+    def flush(self):
+        self._idle_id = None
+        dirty, self._dirty = self._dirty, set()
+        for part, handler in self.handlers.items():
+            if part in dirty:
+                try:
+                    handler()
+                except Exception:
+                    traceback.print_exc()
+
+    def cancel(self):
+        if self._idle_id is not None:
+            try: self.widget.after_cancel(self._idle_id)
+            except Exception: pass
+            self._idle_id = None
+        self._dirty.clear()
+
+
+class StartupProfile:
+    """Время этапов запуска для --profile-startup; выключенный профиль ничего не делает."""
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.marks: list[tuple[str, float]] = []
+        self._last = _STARTUP_T0
+
+    def mark(self, phase: str):
+        if self.enabled:
+            now = time.perf_counter()
+            self.marks.append((phase, now - self._last))
+            self._last = now
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - _STARTUP_T0) * 1000
+
+    def report(self, ready_ms: float):
+        if not self.enabled:
+            return
+        for phase, seconds in self.marks:
+            print(f"{phase:<24}{seconds * 1000:9.1f} мс", file=sys.stderr)
+        verdict = "в пределах цели" if ready_ms <= STARTUP_TARGET_MS else "дольше цели"
+        print(f"{'готово к вводу':<24}{ready_ms:9.1f} мс ({verdict} {STARTUP_TARGET_MS} мс)", file=sys.stderr)
+        print(f"{'всего':<24}{self.elapsed_ms():9.1f} мс", file=sys.stderr)
+
+
+class FrozenTab:
+    """
+    Выгруженная вкладка: текст (UTF-8, крупный — сжатый zlib), позиция курсора и прокрутки.
+    content=None — заглушка вкладки из сеанса: текст ещё не читался с диска.
+    """
+    __slots__ = ("data", "compressed", "insert", "top", "xview")
+
+    def __init__(self, content: str | None, insert="1.0", top="1.0", xview=0.0):
+        raw = content.encode("utf-8", "surrogatepass") if content is not None else None
+        self.compressed = raw is not None and len(raw) >= HIBERNATE_COMPRESS_MIN
+        self.data = zlib.compress(raw, 1) if self.compressed else raw
+        self.insert = insert
+        self.top = top
+        self.xview = xview
+
+    @property
+    def placeholder(self) -> bool:
+        return self.data is None
+
+    def content(self) -> str:
+        raw = zlib.decompress(self.data) if self.compressed else self.data
+        return raw.decode("utf-8", "surrogatepass")
+
+
 class EditorTab:
     def __init__(self, text_widget, filepath=None, font_obj=None, wrap=False):
         self.text = text_widget
@@ -541,11 +1055,44 @@ class EditorTab:
         self._text_changed = False
         self.syntax = "python" if filepath and filepath.endswith(".py") else None
         self._highlight_after_id = None
+        self._scroll_after_id = None
+        # painted[i] == 1 — строка i+1 подсвечена и не менялась с тех пор
+        self._painted = bytearray(1)
+        self.lexer = LineStateCache()
+        # Номер версии текста (растёт на каждой правке) и версия фонового задания подсветки
+        self._version = 0
+        self._bg_version = None
+        # False — подсветка отключена из-за размера файла; id after() порционной загрузки
+        self.allow_highlight = True
+        self._loading = None
+        # Огромный файл: документ в PieceTable, в виджете — строки документа [win_start, win_end)
+        self.doc: PieceTable | None = None
+        self.win_start = 0
+        self.win_end = 0
+        self._win_dirty = False
+        self._swapping = False
+        # Кодировка и перевод строки, с которыми файл был прочитан и будет записан
+        self.encoding = "utf-8"
+        self.newline = "\n"
+        # Незавершённое фоновое сохранение (SaveJob)
+        self._saving: SaveJob | None = None
+        # Тема (CompiledTheme), которой оформлен виджет; отличается от текущей — вкладку перекрасят при выборе
+        self.theme: CompiledTheme | None = None
+        # Подписчики (без аргументов) на правки текста и на остановку прокрутки — например, окно поиска
+        self.edit_listeners: list = []
+        self.scroll_listeners: list = []
+        # Индекс строк; None — нужно перестроить по содержимому виджета
+        self.lines: LineIndex | None = LineIndex()
+        # Спящая вкладка: виджетов нет (text is None), состояние в frozen; last_used — для LRU
+        self.frozen: FrozenTab | None = None
+        self.last_used = time.monotonic()
 
 
 class TextEditor(tk.Tk):
-    def __init__(self):
+    def __init__(self, profile: StartupProfile | None = None):
+        self.profile = profile or StartupProfile()
         super().__init__()
+        self.profile.mark("Tk()")
         self.title(APP_NAME)
         self.geometry("1000x700")
         self.minsize(600, 320)
@@ -557,15 +1104,60 @@ class TextEditor(tk.Tk):
             self.style.theme_use("clam")
         except Exception:
             pass
-        self.default_font = font.Font(family="Consolas" if "Consolas" in font.families() else "Courier", size=12)
+        # Без перечисления всех семейств (font.families() медленный при большом наборе шрифтов):
+        # Tk сам подставит похожий шрифт, если Consolas нет
+        self.default_font = font.Font(family="Consolas", size=12)
+        if self.default_font.actual("family") != "Consolas":
+            self.default_font.configure(family="Courier")
+        self.profile.mark("шрифт")
+        self._bg_worker: HighlightWorker | None = None
+        self._bg_poll_id = None
+        self._find_dialog: FindReplaceDialog | None = None
+        self._find_files_dialog: FindInFilesDialog | None = None
+        self._hibernate_id = None
+        # Заголовок, статусбар и отложенная подсветка обновляются раз за тик; окно перенастраивается,
+        # только если текст заголовка или статусбара действительно изменился
+        self._ui = UiUpdates(self, {"highlight": self._schedule_highlight, "title": self._render_title,
+                                    "status": self._render_statusbar})
+        self._highlight_pending: set[EditorTab] = set()
+        self._shown_title = None
+        self._shown_status = None
         self._setup_ui()
+        self.profile.mark("интерфейс")
+        self.keys = KeyDispatcher(self)
         self._bind_shortcuts()
-        # Plugin manager integrated
+        self.profile.mark("сочетания клавиш")
+        # Plugin manager integrated; библиотеки загружаются после первой отрисовки окна
         self.plugins_menu = tk.Menu(self.menubar, tearoff=False)
         self.menubar.add_cascade(label="Библиотеки", menu=self.plugins_menu)
+        self.plugin_manager: PluginManager | None = None
+        # Тема сеанса из библиотеки — применяется, когда библиотеки загрузятся
+        self._pending_theme = None
+        # Вкладки прошлого сеанса; без него — одна пустая
+        if not self._restore_session():
+            self.new_tab()
+        self.profile.mark("вкладки")
+        self._map_bind = self.bind("<Map>", self._on_first_map, add="+")
+        self.after(STARTUP_DEFER_MAX_MS, self._deferred_startup)
+
+    def _on_first_map(self, event):
+        if event.widget is not self:
+            return
+        self.unbind("<Map>", self._map_bind)
+        self.after_idle(self._deferred_startup)
+
+    def _deferred_startup(self):
+        """Окно уже на экране и принимает ввод — загружаем то, без чего можно было начать работу."""
+        if self.plugin_manager is not None:
+            return
+        ready_ms = self.profile.elapsed_ms()
+        self.profile.mark("первая отрисовка")
         self.plugin_manager = PluginManager(self, self.plugins_menu, libs_dir=LIBS_DIR)
-        # create first tab
-        self.new_tab()
+        theme, self._pending_theme = self._pending_theme, None
+        if theme and theme in self.plugin_manager.theme_owners:
+            self.apply_theme(theme)
+        self.profile.mark("библиотеки")
+        self.profile.report(ready_ms)
 
     def _setup_ui(self):
         menubar = tk.Menu(self)
@@ -592,6 +1184,7 @@ class TextEditor(tk.Tk):
         edit_menu.add_command(label="Выделить всё", accelerator="Ctrl+A", command=self.select_all)
         edit_menu.add_separator()
         edit_menu.add_command(label="Найти/Заменить...", accelerator="Ctrl+F", command=self.open_find_replace)
+        edit_menu.add_command(label="Найти в файлах...", accelerator="Ctrl+Shift+F", command=self.open_find_in_files)
         menubar.add_cascade(label="Правка", menu=edit_menu)
 
         view_menu = tk.Menu(menubar, tearoff=False)
@@ -618,21 +1211,7 @@ class TextEditor(tk.Tk):
     # --- Вкладки / Текстовые поля ---
     def new_tab(self, filepath=None, content=None):
         frame = ttk.Frame(self.notebook)
-        v_scroll = ttk.Scrollbar(frame, orient=tk.VERTICAL)
-        h_scroll = ttk.Scrollbar(frame, orient=tk.HORIZONTAL)
-        text = tk.Text(frame, wrap="none", undo=True, yscrollcommand=v_scroll.set, xscrollcommand=h_scroll.set, padx=6, pady=6)
-        # Явно разрешаем редактирование (вдруг что-то поставило DISABLED раньше)
-        text.config(state="normal", takefocus=True)
-        v_scroll.config(command=text.yview); h_scroll.config(command=text.xview)
-        v_scroll.pack(side=tk.RIGHT, fill=tk.Y); h_scroll.pack(side=tk.BOTTOM, fill=tk.X)
-        text.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
-        text.configure(font=self.default_font)
-        for tag in ("keyword", "string", "comment", "number", "builtin"):
-            text.tag_configure(tag)
-        text.bind("<<Modified>>", lambda e, t=text: self._on_text_modified(t))
-        text.bind("<KeyRelease>", lambda e, t=text: self._on_key_release(t))
-        text.bind("<ButtonRelease-1>", lambda e, t=text: self._update_statusbar(t))
-        text.bind("<Control-a>", lambda e: self.select_all() or "break")
+        text = self._create_text(frame)
         if content:
             text.insert("1.0", content)
         title = os.path.basename(filepath) if filepath else "Безымянный"
@@ -641,6 +1220,9 @@ class TextEditor(tk.Tk):
         tab = EditorTab(text_widget=text, filepath=filepath, font_obj=self.default_font, wrap=False)
         if filepath and filepath.endswith(".py"):
             tab.syntax = "python"
+        tab._painted = bytearray(self._line_count(text))
+        tab.lexer.reset(len(tab._painted))
+        tab.lines = None
         self.tabs[frame] = tab
         # Применяем тему и затем явно даём фокус тексту (чтобы можно было печатать сразу)
         self._apply_theme_to_text(tab)
@@ -654,9 +1236,135 @@ class TextEditor(tk.Tk):
             text.config(state="normal")
         except Exception:
             pass
-        self._update_title(); self._update_statusbar(text)
+        self._ui.mark("title", "status")
         return frame
 
+    def _create_text(self, frame, font_obj=None):
+        """Полосы прокрутки и tk.Text вкладки внутри frame со всеми обработчиками."""
+        v_scroll = ttk.Scrollbar(frame, orient=tk.VERTICAL)
+        h_scroll = ttk.Scrollbar(frame, orient=tk.HORIZONTAL)
+        text = tk.Text(frame, wrap="none", undo=True, xscrollcommand=h_scroll.set, padx=6, pady=6)
+        text.bindtags((KEY_BINDTAG,) + text.bindtags())
+        text.configure(yscrollcommand=lambda first, last, f=frame, s=v_scroll: self._on_text_yscroll(f, s, first, last))
+        # Явно разрешаем редактирование (вдруг что-то поставило DISABLED раньше)
+        text.config(state="normal", takefocus=True)
+        v_scroll.config(command=lambda *args, f=frame, t=text: self._on_vscroll_command(f, t, *args))
+        h_scroll.config(command=text.xview)
+        v_scroll.pack(side=tk.RIGHT, fill=tk.Y); h_scroll.pack(side=tk.BOTTOM, fill=tk.X)
+        text.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
+        text.configure(font=font_obj or self.default_font)
+        for tag in HIGHLIGHT_TAGS:
+            text.tag_configure(tag)
+        text.redirector = TextRedirector(text, lambda first, old_last, new_last, f=frame: self._on_text_edit(f, first, old_last, new_last))
+        text.bind("<<Modified>>", lambda e, t=text: self._on_text_modified(t))
+        text.bind("<KeyRelease>", lambda e, t=text: self._on_key_release(t))
+        text.bind("<ButtonRelease-1>", lambda e: self._ui.mark("status"))
+        return text
+
+    # --- Спящие вкладки ---
+    def _can_hibernate(self, tab: EditorTab) -> bool:
+        # Огромный файл держит окно строк и PieceTable, загрузку и сохранение не прерываем
+        if tab.frozen or tab.doc or tab._loading or tab._saving:
+            return False
+        dlg = self._find_dialog
+        return not (dlg and dlg.winfo_exists() and dlg.tab is tab)
+
+    def _schedule_hibernate(self):
+        if self._hibernate_id is None:
+            self._hibernate_id = self.after_idle(self._hibernate_idle_tabs)
+
+    def _hibernate_idle_tabs(self):
+        """LRU: усыпляет давно не открывавшиеся вкладки, пока живых больше лимита по числу или объёму."""
+        self._hibernate_id = None
+        current = self._current_frame()
+        live = [(frame, tab) for frame, tab in self.tabs.items() if not tab.frozen]
+        chars = 0
+        for _, tab in live:
+            try: chars += int(tab.text.tk.call(tab.text._w, "count", "-chars", "1.0", "end"))
+            except (tk.TclError, ValueError): pass
+        candidates = sorted(((f, t) for f, t in live if f is not current and self._can_hibernate(t)),
+                            key=lambda item: item[1].last_used)
+        count = len(live)
+        for frame, tab in candidates:
+            if count <= HIBERNATE_MAX_TABS and chars <= HIBERNATE_MAX_CHARS:
+                break
+            try:
+                size = int(tab.text.tk.call(tab.text._w, "count", "-chars", "1.0", "end"))
+            except (tk.TclError, ValueError):
+                size = 0
+            self._hibernate(frame, tab)
+            count -= 1; chars -= size
+
+    def _hibernate(self, frame, tab: EditorTab):
+        """Сохраняет текст и позицию вкладки в FrozenTab и уничтожает её виджеты; стек отмены теряется."""
+        t = tab.text
+        tab.frozen = FrozenTab(t.get("1.0", "end-1c"), t.index(tk.INSERT), t.index("@0,0"), t.xview()[0])
+        for after_id in (tab._highlight_after_id, tab._scroll_after_id):
+            if after_id:
+                try: t.after_cancel(after_id)
+                except Exception: pass
+        tab._highlight_after_id = tab._scroll_after_id = None
+        # Результаты фоновой подсветки для старой версии будут выброшены
+        tab._version += 1; tab._bg_version = None
+        tab._painted = bytearray(1); tab.lexer.reset(1); tab.lines = None
+        tab.text = None; tab.theme = None
+        for child in frame.winfo_children():
+            child.destroy()
+
+    def _thaw(self, frame, tab: EditorTab):
+        """Восстанавливает виджеты спящей вкладки с прежним текстом, курсором, прокруткой и флагом изменений."""
+        frozen, tab.frozen = tab.frozen, None
+        dirty = tab._text_changed
+        text = self._create_text(frame, tab.font)
+        text.config(wrap="word" if tab.wrap else "none")
+        tab.text = text
+        text.insert("1.0", frozen.content())
+        tab._painted = bytearray(self._line_count(text))
+        tab.lexer.reset(len(tab._painted))
+        tab.lines = None
+        try:
+            text.edit_reset(); text.edit_modified(False)
+        except Exception:
+            pass
+        tab._text_changed = dirty
+        self._apply_theme_to_text(tab)
+        text.mark_set(tk.INSERT, frozen.insert)
+        text.yview(frozen.top); text.xview_moveto(frozen.xview)
+        self._apply_syntax_highlight(tab)
+
+    def _open_placeholder(self, frame, tab: EditorTab) -> EditorTab | None:
+        """Открывает файл заглушки сеанса и ставит получившуюся вкладку на её место."""
+        state, index = tab.frozen, self.notebook.index(frame)
+        del self.tabs[frame]
+        opened = self.open_path(tab.filepath)
+        self.notebook.forget(frame); frame.destroy()
+        if not opened:
+            if not self.notebook.tabs():
+                self.new_tab()
+            return self.current_editor_tab()
+        new_frame = next(f for f, t in self.tabs.items() if t is opened)
+        self.notebook.insert(index, new_frame); self.notebook.select(new_frame)
+        opened.wrap = tab.wrap
+        opened.text.config(wrap="word" if tab.wrap else "none")
+        if tab.font is not self.default_font:
+            opened.font = tab.font; opened.text.configure(font=tab.font)
+        try:
+            if opened.doc:
+                line, col = state.insert.split(".")
+                self._goto_line(opened, int(line), int(col))
+            elif not opened._loading:
+                opened.text.mark_set(tk.INSERT, state.insert)
+                opened.text.yview(state.top); opened.text.xview_moveto(state.xview)
+        except (tk.TclError, ValueError):
+            pass
+        return opened
+
+    def tab_content(self, tab: EditorTab) -> str:
+        """Текст вкладки; спящую не будит."""
+        if tab.frozen:
+            return tab.frozen.content()
+        return tab.text.get("1.0", "end-1c")
+
     def _current_frame(self):
         sel = self.notebook.select()
         if not sel:
@@ -667,86 +1375,328 @@ class TextEditor(tk.Tk):
         frame = self._current_frame()
         if not frame:
             return None
-        return self.tabs.get(frame)
+        tab = self.tabs.get(frame)
+        # Видимая вкладка всегда живая: спящую будим при первом обращении, заглушку сеанса читаем с диска
+        if tab and tab.frozen:
+            if tab.frozen.placeholder:
+                return self._open_placeholder(frame, tab)
+            self._thaw(frame, tab)
+        return tab
 
     def close_current_tab(self):
         frame = self._current_frame()
         if not frame:
             return
         tab = self.tabs.get(frame)
-        if tab and tab._text_changed:
+        if tab and tab._text_changed and not tab._loading:
             ans = messagebox.askyesnocancel("Несохранённые изменения", "Сохранить изменения вкладки?")
             if ans is None:
                 return
             if ans:
-                ok = self.save_file()
+                ok = self.save_file(wait=True)
                 if not ok:
                     return
+        self._forget_tab(frame)
+
+    def _forget_tab(self, frame):
+        tab = self.tabs.pop(frame, None)
+        if tab and tab._loading:
+            self.after_cancel(tab._loading); tab._loading = None
+        if tab:
+            self._join_save(tab)
+        if tab and tab.doc:
+            tab.doc.close()
         self.notebook.forget(frame)
-        del self.tabs[frame]
+        frame.destroy()
         if not self.notebook.tabs():
             self.new_tab()
         else:
-            self._update_title(); self._update_statusbar_for_current()
+            self._ui.mark("title", "status")
 
     # --- Файлы ---
     def open_file(self):
         path = filedialog.askopenfilename(filetypes=[("Все файлы", "*.*"), ("Текстовые", "*.txt;*.py;*.md;*.json;*.csv")])
         if not path:
             return
+        self.open_path(path)
+
+    def _tab_for_path(self, path: str):
+        key = os.path.normcase(os.path.abspath(path))
+        for frame, tab in self.tabs.items():
+            if tab.filepath and os.path.normcase(os.path.abspath(tab.filepath)) == key:
+                return frame
+        return None
+
+    def open_path(self, path: str) -> EditorTab | None:
+        """Открывает файл во вкладке (или выбирает уже открытую); возвращает вкладку."""
+        frame = self._tab_for_path(path)
+        if frame:
+            self.notebook.select(frame)
+            return self.current_editor_tab()
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = f.read()
-        except UnicodeDecodeError:
-            with open(path, "r", encoding="cp1251", errors="replace") as f:
-                data = f.read()
+            size = os.path.getsize(path)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{e}")
+            return None
+        if size >= HUGE_FILE_SIZE:
+            return self._open_huge_file(path)
+        if size >= LARGE_FILE_SIZE:
+            return self._open_large_file(path, size)
+        try:
+            # Одно чтение: кодировка определяется по байтам, которые затем и декодируются
+            with open(path, "rb") as f:
+                raw = f.read()
+            # Кодировка определяется по началу файла; если дальше в нём чужие байты — однобайтовая без потерь
+            data, encoding = decode_lossless(raw, detect_encoding(raw))
+            del raw
+            newline = detect_newline(data)
+            if "\r" in data:
+                data = data.replace("\r\n", "\n").replace("\r", "\n")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{e}")
-            return
+            return None
         frame = self.new_tab(filepath=path, content=data)
         self.notebook.tab(frame, text=os.path.basename(path))
         tab = self.tabs[frame]
+        tab.encoding, tab.newline = encoding, newline
         tab.filepath = path; tab.syntax = "python" if path.endswith(".py") else None
         tab.text.edit_reset(); tab._text_changed = False
         self._apply_syntax_highlight(tab)
+        return tab
+
+    def _goto_line(self, tab: EditorTab, line: int, col: int = 0):
+        """Ставит курсор на строку line (с 1) документа; у огромного файла при необходимости сдвигает окно."""
+        if tab.doc:
+            if not tab.win_start < line <= tab.win_start + self._line_count(tab.text):
+                self._load_window(tab, line - 1 - VIRTUAL_WINDOW_LINES // 2, line - 1)
+            line -= tab.win_start
+        index = f"{line}.{col}"
+        tab.text.mark_set(tk.INSERT, index); tab.text.see(index)
+        tab.text.focus_set()
+        self._ui.mark("status")
+
+    def _open_large_file(self, path: str, size: int):
+        """Порционная загрузка: вкладка открывается сразу, текст дописывается по LOAD_CHUNK_CHARS через after()."""
+        try:
+            with open(path, "rb") as f:
+                head = f.read(LOAD_SNIFF_BYTES)
+            # Без errors="replace": чужой байт за пределами выборки стал бы U+FFFD и записался бы при сохранении
+            f = open(path, "r", encoding=detect_encoding(head))
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{e}")
+            return None
+        frame = self.new_tab(filepath=path)
+        tab = self.tabs[frame]
+        tab.encoding = f.encoding
+        text = tab.text
+        tab.allow_highlight = size <= LARGE_FILE_HIGHLIGHT_LIMIT
+        tab.syntax = "python" if tab.allow_highlight and path.endswith(".py") else None
+        # Пока файл грузится, правка запрещена, а вставки не попадают в стек отмены
+        text.config(undo=False, state="disabled")
+        bar = ttk.Frame(frame)
+        bar.pack(side=tk.TOP, fill=tk.X, before=frame.pack_slaves()[0])
+        ttk.Label(bar, text=f"Загрузка {os.path.basename(path)}...").pack(side=tk.LEFT, padx=6)
+        progress = ttk.Progressbar(bar, maximum=max(size, 1), length=260)
+        progress.pack(side=tk.LEFT, padx=6, pady=2)
+        ttk.Button(bar, text="Отмена", command=lambda: cancel()).pack(side=tk.LEFT)
+
+        def step():
+            tab._loading = None
+            if self.tabs.get(frame) is not tab:
+                f.close(); return
+            try:
+                chunk = f.read(LOAD_CHUNK_CHARS)
+            except UnicodeDecodeError:
+                restart(); return
+            except Exception as e:
+                f.close(); self._forget_tab(frame)
+                messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{e}")
+                return
+            if not chunk:
+                finish(); return
+            text.config(state="normal"); text.insert("end-1c", chunk); text.config(state="disabled")
+            progress["value"] = f.buffer.tell()
+            tab._loading = self.after(1, step)
+
+        def restart():
+            # Начало файла подошло к кодировке, а дальше — нет: читаем заново в однобайтовой, без потерь
+            nonlocal f
+            pos = f.buffer.tell()
+            f.close()
+            try:
+                with open(path, "rb") as raw:
+                    raw.seek(max(pos - LOAD_SNIFF_BYTES, 0))
+                    sample = raw.read(LOAD_SNIFF_BYTES)
+                f = open(path, "r", encoding=fallback_encoding(sample, tab.encoding))
+            except Exception as e:
+                self._forget_tab(frame)
+                messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{e}")
+                return
+            tab.encoding = f.encoding
+            text.config(state="normal"); text.delete("1.0", tk.END); text.config(state="disabled")
+            progress["value"] = 0
+            tab._loading = self.after(1, step)
+
+        def finish():
+            tab.newline = newline_of(f.newlines)
+            f.close(); bar.destroy()
+            text.config(state="normal", undo=size <= LARGE_FILE_UNDO_LIMIT)
+            text.edit_reset(); text.edit_modified(False); tab._text_changed = False
+            text.mark_set(tk.INSERT, "1.0"); text.see("1.0")
+            self._ui.mark("title", "status")
+            self._apply_syntax_highlight(tab)
+
+        def cancel():
+            f.close()
+            if self.tabs.get(frame) is tab:
+                self._forget_tab(frame)
+
+        tab._loading = self.after(1, step)
+        return tab
 
-    def save_file(self):
+    def _open_huge_file(self, path: str):
+        """Файл остаётся на диске (mmap); во вкладке — только окно строк вокруг видимой области."""
+        try:
+            with open(path, "rb") as f:
+                head = f.read(LOAD_SNIFF_BYTES)
+            encoding = detect_encoding(head)
+            newline = detect_newline(head.decode("latin-1"))
+            if encoding in ("utf-16", "utf-32") or newline == "\r":
+                # PieceTable ищет переводы строк побайтно по '\n' — многобайтные кодировки и файлы с одним '\r'
+                # грузим порциями
+                return self._open_large_file(path, os.path.getsize(path))
+            # BOM PieceTable не показывает в тексте и записывает обратно при сохранении, как обычное открытие с utf-8-sig
+            doc = PieceTable(path, encoding, newline)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{e}")
+            return None
+        frame = self.new_tab(filepath=path)
+        tab = self.tabs[frame]
+        tab.doc = doc
+        tab.encoding, tab.newline = doc.encoding, doc.newline
+        tab.allow_highlight = False; tab.syntax = None
+        self._load_window(tab, 0, 0)
+        tab.text.mark_set(tk.INSERT, "1.0")
+        tab._text_changed = False
+        self._ui.mark("title", "status")
+        return tab
+
+    def save_file(self, wait=False):
         tab = self.current_editor_tab()
         if not tab:
             return False
         if tab.filepath:
-            return self._write(tab, tab.filepath)
+            return self._write(tab, tab.filepath, wait=wait)
         else:
-            return self.save_file_as()
+            return self.save_file_as(wait=wait)
 
-    def save_file_as(self):
+    def save_file_as(self, wait=False):
         tab = self.current_editor_tab()
         if not tab:
             return False
         path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files", "*.txt;*.py;*.md;*.json;*.csv"), ("All files", "*.*")])
         if not path:
             return False
-        ok = self._write(tab, path)
-        if ok:
-            frame = self._current_frame()
-            self.notebook.tab(frame, text=os.path.basename(path))
-            tab.filepath = path
-            tab.syntax = "python" if path.endswith(".py") else None
+
+        def saved():
+            tab.syntax = "python" if tab.allow_highlight and path.endswith(".py") else None
             self._apply_syntax_highlight(tab)
-        return ok
 
-    def _write(self, tab: EditorTab, path: str):
-        try:
-            text = tab.text.get("1.0", tk.END)
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(text.rstrip("\n"))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{e}")
+        return self._write(tab, path, wait=wait, on_done=saved)
+
+    def _write(self, tab: EditorTab, path: str, wait=False, on_done=None):
+        """Сохраняет вкладку в фоне: текст — SaveJob, огромный документ — DocSaveJob; с wait=True — дожидаемся записи
+        и возвращаем её успех, иначе True означает, что запись началась."""
+        if tab._loading:
+            messagebox.showwarning("Файл загружается", "Дождитесь окончания загрузки файла.")
             return False
-        tab.filepath = path; tab._text_changed = False
-        try: tab.text.edit_modified(False)
-        except Exception: pass
-        self._update_title(); self._update_statusbar_for_current()
+        self._join_save(tab)
+        version = tab._version
+        if tab.doc:
+            self._flush_window(tab)
+            if tab.doc.lossy:
+                messagebox.showerror("Ошибка", f"Изменённые строки содержали байты не в кодировке {tab.encoding}: "
+                                               "при сохранении они были бы испорчены. Файл не сохранён.")
+                return False
+            # PieceTable пишется в фоне потоком кусков; до подмены файла документ читается из прежнего
+            # mmap, поэтому правка вкладки на время записи запрещена (прокрутка работает)
+            job = DocSaveJob(tab.doc, path)
+            tab.text.config(state="disabled")
+        else:
+            job = SaveJob(path, self._snapshot(tab.text), tab.encoding, tab.newline)
+        tab._saving = job
+        job.start()
+        if wait:
+            job.join()
+            return self._finish_save(tab, job, version, on_done)
+        self._poll_save(tab, job, version, on_done)
+        return True
+
+    def _join_save(self, tab: EditorTab):
+        """Дожидается фоновой записи вкладки; запись огромного файла сразу и завершается подменой файла."""
+        job = tab._saving
+        if job:
+            job.join()
+            if isinstance(job, DocSaveJob):
+                job.commit()
+
+    def _editable(self, tab: EditorTab) -> bool:
+        return not tab._loading and not (tab.doc and tab._saving)
+
+    def _snapshot(self, text_widget) -> list[str]:
+        """Текст виджета кусками по SAVE_CHUNK_LINES строк; хвостовые переводы строки отбрасываются."""
+        last = self._line_count(text_widget)
+        chunks = [text_widget.get(f"{a}.0", f"{a + SAVE_CHUNK_LINES}.0") for a in range(1, last + 1, SAVE_CHUNK_LINES)]
+        while chunks:
+            chunks[-1] = chunks[-1].rstrip("\n")
+            if chunks[-1]:
+                break
+            chunks.pop()
+        return chunks
+
+    def _poll_save(self, tab: EditorTab, job: SaveJob | DocSaveJob, version: int, on_done):
+        if job.is_alive():
+            frame = self._frame_for_text(tab.text)
+            if frame:
+                percent = 100 * job.done // max(job.total, 1)
+                self.notebook.tab(frame, text=f"{os.path.basename(job.path)} — сохранение {percent}%")
+            self.after(SAVE_POLL_MS, lambda: self._poll_save(tab, job, version, on_done))
+            return
+        self._finish_save(tab, job, version, on_done)
+
+    def _finish_save(self, tab: EditorTab, job: SaveJob | DocSaveJob, version: int, on_done) -> bool:
+        doc_job = isinstance(job, DocSaveJob)
+        if doc_job:
+            job.commit()
+        if tab._saving is job:
+            tab._saving = None
+            if doc_job and tab.text:
+                tab.text.config(state="normal")
+        frame = self._frame_for_text(tab.text)
+        if job.error:
+            if frame:
+                self.notebook.tab(frame, text=os.path.basename(tab.filepath) if tab.filepath else "Безымянный")
+            messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{job.error}")
+            return False
+        tab.filepath = job.path
+        # Правки, сделанные во время записи, в файл не попали — вкладка остаётся изменённой
+        if tab._version == version:
+            tab._text_changed = False
+            try: tab.text.edit_modified(False)
+            except Exception: pass
+        if not frame:
+            return True
+        name = os.path.basename(job.path)
+        self.notebook.tab(frame, text=f"{name} ✓")
+
+        def unmark():
+            if frame in self.tabs and self.notebook.tab(frame, "text") == f"{name} ✓":
+                self.notebook.tab(frame, text=name)
+
+        self.after(1500, unmark)
+        self._ui.mark("title", "status")
+        if on_done:
+            on_done()
         return True
 
     # --- Редактирование ---
@@ -780,14 +1730,26 @@ class TextEditor(tk.Tk):
     def open_find_replace(self):
         tab = self.current_editor_tab()
         if not tab: return
-        FindReplaceDialog(self, tab.text)
+        dlg = self._find_dialog
+        if dlg and dlg.winfo_exists():
+            if dlg.tab is tab:
+                dlg.lift(); dlg.find_entry.focus_set(); return
+            dlg.close()
+        self._find_dialog = FindReplaceDialog(self, tab)
+
+    def open_find_in_files(self):
+        dlg = self._find_files_dialog
+        if dlg and dlg.winfo_exists():
+            dlg.lift(); dlg.find_entry.focus_set(); return
+        self._find_files_dialog = FindInFilesDialog(self)
 
     # --- Перенос слов и шрифт ---
     def _toggle_wrap_global(self):
         for f, tab in self.tabs.items():
             tab.wrap = self.wrap_var.get()
-            tab.text.config(wrap="word" if tab.wrap else "none")
-        self._update_statusbar_for_current()
+            if tab.text:
+                tab.text.config(wrap="word" if tab.wrap else "none")
+        self._ui.mark("status")
 
     def toggle_wrap(self):
         tab = self.current_editor_tab()
@@ -795,7 +1757,7 @@ class TextEditor(tk.Tk):
         tab.wrap = not tab.wrap
         tab.text.config(wrap="word" if tab.wrap else "none")
         self.wrap_var.set(tab.wrap)
-        self._update_statusbar_for_current()
+        self._ui.mark("status")
 
     def choose_font(self):
         tab = self.current_editor_tab()
@@ -809,59 +1771,57 @@ class TextEditor(tk.Tk):
 
     # --- Тема ---
     def apply_theme(self, theme_name):
-        if theme_name not in THEMES:
+        """Перекрашивает окно и видимую вкладку; остальные вкладки — при их выборе (_on_tab_changed)."""
+        plugins = getattr(self, "plugin_manager", None)
+        if theme_name not in THEMES and not (plugins and plugins.load_theme(theme_name)):
             messagebox.showwarning("Тема не найдена", f"Тема '{theme_name}' не зарегистрирована.")
             return
+        try:
+            theme = compiled_theme(theme_name)
+        except Exception as e:
+            messagebox.showwarning("Тема не найдена", f"Тема '{theme_name}' повреждена: {e}")
+            return
         self.current_theme = theme_name
-        theme = THEMES[theme_name]
         try:
-            self.style.configure("TFrame", background=theme["background"])
-            self.style.configure("TLabel", background=theme["background"], foreground=theme["foreground"])
-            self.style.configure("TNotebook", background=theme["background"])
-            self.style.configure("TNotebook.Tab", background=theme.get("tab_bg", theme["background"]), foreground=theme["foreground"])
+            # Фреймы вкладок — ttk.Frame со стилем TFrame, их перекрашивает сам стиль
+            self.style.configure("TFrame", background=theme.background)
+            self.style.configure("TLabel", background=theme.background, foreground=theme.foreground)
+            self.style.configure("TNotebook", background=theme.background)
+            self.style.configure("TNotebook.Tab", background=theme.tab_bg, foreground=theme.foreground)
             self.style.map("TNotebook.Tab",
-                           background=[("selected", theme.get("tab_bg", theme["background"]))],
-                           foreground=[("selected", theme["foreground"])])
+                           background=[("selected", theme.tab_bg)],
+                           foreground=[("selected", theme.foreground)])
         except Exception:
             pass
-        for frame, tab in self.tabs.items():
-            try:
-                frame.configure(style="TFrame")
-            except Exception:
-                try:
-                    frame.configure(background=theme["background"])
-                except Exception:
-                    pass
+        tab = self.current_editor_tab()
+        if tab:
             self._apply_theme_to_text(tab)
         try:
-            self.statusbar.config(background=theme.get("linenumber_bg", theme["background"]), foreground=theme["foreground"])
+            self.statusbar.config(background=theme.status_bg, foreground=theme.foreground)
         except Exception:
             pass
         try:
-            self.configure(background=theme["background"])
+            self.configure(background=theme.background)
         except Exception:
             pass
 
     def _apply_theme_to_text(self, tab: EditorTab):
-        theme = THEMES[self.current_theme]
+        theme = compiled_theme(self.current_theme)
+        if tab.theme is theme:
+            return
         t = tab.text
         # Явно ставим состояние normal перед применением цветов, чтобы не было "недоступного" текста
+        # (кроме вкладки, которая ещё загружается порциями или пишется на диск)
+        if self._editable(tab):
+            try:
+                t.config(state="normal")
+            except Exception:
+                pass
         try:
-            t.config(state="normal")
-        except Exception:
-            pass
-        t.config(background=theme["background"],
-                 foreground=theme["foreground"],
-                 insertbackground=theme["cursor"],
-                 selectbackground=theme["selectbackground"],
-                 selectforeground=theme.get("selectforeground", theme["foreground"]))
-        tags = theme.get("tag", {})
-        for tagname, attrs in tags.items():
-            t.tag_configure(tagname, **attrs)
-        try:
-            t.tag_configure("sel", background=theme["selectbackground"], foreground=theme.get("selectforeground", theme["foreground"]))
-        except Exception:
-            pass
+            theme.apply(t)
+        except tk.TclError:
+            traceback.print_exc()
+        tab.theme = theme
 
     # --- Подсветка Python ---
     def _on_key_release(self, text_widget):
@@ -869,34 +1829,264 @@ class TextEditor(tk.Tk):
         if not frame: return
         tab = self.tabs.get(frame)
         if not tab: return
-        if tab._highlight_after_id:
-            try: text_widget.after_cancel(tab._highlight_after_id)
-            except Exception: pass
-        tab._highlight_after_id = text_widget.after(180, lambda: self._apply_syntax_highlight(tab))
-        self._update_statusbar(text_widget)
+        self._highlight_pending.add(tab)
+        self._ui.mark("highlight", "status")
+
+    def _schedule_highlight(self):
+        """Переносит отложенную подсветку вкладок, где были нажатия за этот тик, на 180 мс от последнего."""
+        pending, self._highlight_pending = self._highlight_pending, set()
+        for tab in pending:
+            # Вкладку за это время закрыли или усыпили
+            if tab.text is None or tab not in self.tabs.values():
+                continue
+            if tab._highlight_after_id:
+                try: tab.text.after_cancel(tab._highlight_after_id)
+                except Exception: pass
+            tab._highlight_after_id = tab.text.after(180, lambda t=tab: self._apply_syntax_highlight(t))
 
     def _apply_syntax_highlight(self, tab: EditorTab):
+        """Подсвечивает изменённые строки и видимую область; остальное — лениво при прокрутке."""
         text = tab.text
         if tab.syntax != "python":
-            for tag in ("keyword", "string", "comment", "number", "builtin"):
-                text.tag_remove(tag, "1.0", tk.END)
+            if tab._painted.find(1) != -1:
+                for tag in HIGHLIGHT_TAGS:
+                    text.tag_remove(tag, "1.0", tk.END)
+                tab._painted = bytearray(len(tab._painted))
+            return
+        top, bottom = self._visible_lines(text)
+        top = max(1, top - HIGHLIGHT_MARGIN)
+        bottom = min(len(tab._painted), bottom + HIGHLIGHT_MARGIN)
+        dirty = tab.lexer.first_dirty(top)
+        if dirty == -1 or top - dirty <= HIGHLIGHT_SYNC_LINES:
+            self._highlight_lines(tab, top, bottom)
+        self._start_background_highlight(tab)
+
+    def _highlight_lines(self, tab: EditorTab, first: int, last: int):
+        """
+        Подсвечивает строки first..last. Строки выше, чьё состояние лексера устарело,
+        только перелексируются (без тегов) — до совпадения с сохранённым состоянием.
+        """
+        lexer, painted = tab.lexer, tab._painted
+        pending = [i for i in (lexer.first_dirty(last), painted.find(0, first - 1, last)) if i != -1]
+        if not pending:
             return
-        content = text.get("1.0", tk.END)
-        for tag in ("keyword", "string", "comment", "number", "builtin"):
-            text.tag_remove(tag, "1.0", tk.END)
-        for m in RE_COMMENT.finditer(content):
-            text.tag_add("comment", f"1.0+{m.start()}c", f"1.0+{m.end()}c")
-        for m in RE_STRING.finditer(content):
-            text.tag_add("string", f"1.0+{m.start()}c", f"1.0+{m.end()}c")
-        for m in RE_NUMBER.finditer(content):
-            text.tag_add("number", f"1.0+{m.start()}c", f"1.0+{m.end()}c")
-        for m in RE_WORD.finditer(content):
-            word = m.group(0)
-            start = f"1.0+{m.start()}c"; end = f"1.0+{m.end()}c"
-            if word in PY_KEYWORDS:
-                text.tag_add("keyword", start, end)
-            elif word in PY_BUILTINS:
-                text.tag_add("builtin", start, end)
+        start = min(pending)
+        lines = []
+        for i, line in enumerate(tab.text.get(f"{start + 1}.0", f"{last}.end").split("\n"), start):
+            visible = i >= first - 1
+            if not lexer.dirty[i] and (painted[i] or not visible):
+                continue
+            tokens, _ = lexer.relex(i, line)
+            if visible:
+                lines.append((i, tokens))
+            else:
+                painted[i] = 0
+        self._paint_lines(tab, lines)
+
+    def _paint_lines(self, tab: EditorTab, lines):
+        """lines — [(номер строки с нуля, токены)] по возрастанию; теги ставятся одним tag_add на тег."""
+        text = tab.text
+        spans = {tag: [] for tag in HIGHLIGHT_TAGS}
+        runs = []
+        for i, tokens in lines:
+            ln = i + 1
+            for tag, s, e in tokens:
+                spans[tag] += (f"{ln}.{s}", f"{ln}.{e}")
+            if runs and runs[-1][1] == ln - 1:
+                runs[-1][1] = ln
+            else:
+                runs.append([ln, ln])
+            tab._painted[i] = 1
+        for tag in HIGHLIGHT_TAGS:
+            for a, b in runs:
+                text.tag_remove(tag, f"{a}.0", f"{b}.end")
+            if spans[tag]:
+                text.tag_add(tag, *spans[tag])
+
+    # --- Фоновая подсветка ---
+    def _start_background_highlight(self, tab: EditorTab):
+        """Отдаёт фоновому потоку всё, что ещё не разобрано или не подсвечено, начиная с первой такой строки."""
+        if tab.syntax != "python" or tab._bg_version == tab._version:
+            return
+        pending = [i for i in (tab.lexer.first_dirty(), tab._painted.find(0)) if i != -1]
+        if not pending:
+            return
+        start = min(pending)
+        if self._bg_worker is None:
+            self._bg_worker = HighlightWorker()
+            self._bg_worker.start()
+        snapshot = tab.text.get(f"{start + 1}.0", "end-1c")
+        tab._bg_version = tab._version
+        self._bg_worker.submit(tab, tab._version, start, tab.lexer.start_state(start), snapshot,
+                               lambda version, t=tab: t._version == version)
+        if self._bg_poll_id is None:
+            self._bg_poll_id = self.after(HIGHLIGHT_POLL_MS, self._poll_background_highlight)
+
+    def _poll_background_highlight(self):
+        self._bg_poll_id = None
+        results = self._bg_worker.results
+        deadline = time.perf_counter() + HIGHLIGHT_APPLY_BUDGET_MS / 1000
+        while time.perf_counter() < deadline:
+            try:
+                tab, version, first, chunk = results.get_nowait()
+            except queue.Empty:
+                break
+            if chunk is None:
+                if tab._bg_version == version:
+                    tab._bg_version = None
+                continue
+            # Результат для старой версии текста или закрытой вкладки просто выбрасываем
+            if tab._version != version or tab.syntax != "python" or not any(t is tab for t in self.tabs.values()):
+                continue
+            try:
+                self._apply_background_chunk(tab, first, chunk)
+            except tk.TclError:
+                pass
+        if not results.empty() or any(t._bg_version is not None for t in self.tabs.values()):
+            self._bg_poll_id = self.after(HIGHLIGHT_POLL_MS, self._poll_background_highlight)
+
+    def _apply_background_chunk(self, tab: EditorTab, first: int, chunk):
+        lexer, painted = tab.lexer, tab._painted
+        lines = []
+        for i, (tokens, state) in enumerate(chunk, first):
+            if i >= len(painted):
+                break
+            restyle = lexer.dirty[i] or not painted[i]
+            # Как в LineStateCache.relex: смена состояния на конце строки делает следующую грязной
+            if state != lexer.states[i] and i + 1 < len(painted):
+                lexer.dirty[i + 1] = 1
+            lexer.states[i] = state
+            lexer.dirty[i] = 0
+            if restyle:
+                lines.append((i, tokens))
+        self._paint_lines(tab, lines)
+
+    def line_index(self, tab: EditorTab) -> LineIndex:
+        if tab.lines is None:
+            tab.lines = LineIndex(tab.text.get("1.0", "end-1c"))
+        return tab.lines
+
+    def _on_text_edit(self, frame, first, old_last, new_last):
+        tab = self.tabs.get(frame)
+        if not tab:
+            return
+        tab._version += 1
+        if tab.doc and not tab._swapping:
+            tab._win_dirty = True
+        for listener in tab.edit_listeners:
+            listener(first, old_last, new_last)
+        if first is None:
+            # undo/redo: неизвестно, какие строки изменились
+            tab._painted = bytearray(self._line_count(tab.text))
+            tab.lexer.reset(len(tab._painted))
+            tab.lines = None
+            for tag in HIGHLIGHT_TAGS:
+                tab.text.tag_remove(tag, "1.0", tk.END)
+            return
+        tab._painted[first - 1:old_last] = bytes(new_last - first + 1)
+        tab.lexer.splice(first, old_last, new_last)
+        if tab.lines is not None:
+            tab.lines.update(first, old_last, tab.text.get(f"{first}.0", f"{new_last}.end").split("\n"))
+
+    def _on_text_yscroll(self, frame, scrollbar, first, last):
+        tab = self.tabs.get(frame)
+        if tab and tab.doc:
+            self._on_virtual_yscroll(tab, scrollbar, float(first), float(last))
+            return
+        scrollbar.set(first, last)
+        if not tab or (tab.syntax != "python" and not tab.scroll_listeners):
+            return
+        if tab._scroll_after_id:
+            try: tab.text.after_cancel(tab._scroll_after_id)
+            except Exception: pass
+        tab._scroll_after_id = tab.text.after(30, lambda: self._on_scroll_idle(tab))
+
+    def _on_scroll_idle(self, tab: EditorTab):
+        tab._scroll_after_id = None
+        try:
+            self._apply_syntax_highlight(tab)
+            for listener in tab.scroll_listeners:
+                listener()
+        except tk.TclError:
+            pass
+
+    # --- Окно строк огромного файла ---
+    def _virtual_total(self, tab: EditorTab) -> int:
+        """Строк в документе с учётом ещё не сброшенных в PieceTable правок окна."""
+        return tab.doc.line_count() - (tab.win_end - tab.win_start) + self._line_count(tab.text)
+
+    def _on_virtual_yscroll(self, tab: EditorTab, scrollbar, first: float, last: float):
+        count = self._line_count(tab.text)
+        total = max(self._virtual_total(tab), 1)
+        scrollbar.set((tab.win_start + first * count) / total, (tab.win_start + last * count) / total)
+        if not tab._scroll_after_id:
+            tab._scroll_after_id = tab.text.after(30, lambda: self._check_virtual_window(tab))
+
+    def _on_vscroll_command(self, frame, text_widget, *args):
+        tab = self.tabs.get(frame)
+        if not tab or not tab.doc or not args or args[0] != "moveto":
+            text_widget.yview(*args)
+            return
+        target = int(float(args[1]) * self._virtual_total(tab))
+        if tab.win_start <= target < tab.win_start + self._line_count(tab.text):
+            text_widget.yview(f"{target - tab.win_start + 1}.0")
+        else:
+            self._load_window(tab, target - VIRTUAL_WINDOW_LINES // 2, target)
+
+    def _check_virtual_window(self, tab: EditorTab):
+        """Сдвигает окно, когда видимая область подходит к его краю ближе VIRTUAL_MARGIN строк."""
+        tab._scroll_after_id = None
+        if not tab.doc or not any(t is tab for t in self.tabs.values()):
+            return
+        top, bottom = self._visible_lines(tab.text)
+        count = self._line_count(tab.text)
+        near_top = top <= VIRTUAL_MARGIN and tab.win_start > 0
+        near_bottom = count - bottom <= VIRTUAL_MARGIN and tab.win_start + count < self._virtual_total(tab)
+        if near_top or near_bottom:
+            doc_top = tab.win_start + top - 1
+            self._load_window(tab, doc_top - VIRTUAL_WINDOW_LINES // 2, doc_top)
+
+    def _flush_window(self, tab: EditorTab):
+        if tab.doc and tab._win_dirty:
+            tab.doc.replace_lines(tab.win_start, tab.win_end, tab.text.get("1.0", "end-1c"))
+            tab.win_end = tab.win_start + self._line_count(tab.text)
+            tab._win_dirty = False
+
+    def _load_window(self, tab: EditorTab, start: int, top_line: int):
+        """Загружает в виджет строки документа начиная с start; top_line (с нуля) — строка вверху экрана."""
+        text = tab.text
+        self._flush_window(tab)
+        total = tab.doc.line_count()
+        start = max(0, min(start, total - VIRTUAL_WINDOW_LINES))
+        end = min(total, start + VIRTUAL_WINDOW_LINES)
+        ins_line, ins_col = map(int, text.index(tk.INSERT).split("."))
+        ins_doc = tab.win_start + ins_line - 1
+        tab._swapping = True
+        # Во время записи вкладка только для чтения, а окно строк всё равно подменяется
+        state = text.cget("state")
+        text.config(state="normal")
+        try:
+            text.delete("1.0", tk.END)
+            text.insert("1.0", tab.doc.get_lines(start, end))
+        finally:
+            text.config(state=state)
+            tab._swapping = False
+        tab.win_start, tab.win_end = start, end
+        # Стек отмены действует в пределах окна
+        text.edit_reset(); text.edit_modified(False)
+        if start <= ins_doc < end:
+            text.mark_set(tk.INSERT, f"{ins_doc - start + 1}.{ins_col}")
+        else:
+            text.mark_set(tk.INSERT, f"{max(top_line - start, 0) + 1}.0")
+        text.yview(f"{max(top_line - start, 0) + 1}.0")
+
+    def _line_count(self, text_widget) -> int:
+        return int(text_widget.index("end-1c").split(".")[0])
+
+    def _visible_lines(self, text_widget) -> tuple[int, int]:
+        top = int(text_widget.index("@0,0").split(".")[0])
+        bottom = int(text_widget.index(f"@0,{text_widget.winfo_height()}").split(".")[0])
+        return top, bottom
 
     # --- Изменение текста / статусбар ---
     def _on_text_modified(self, text_widget):
@@ -905,8 +2095,9 @@ class TextEditor(tk.Tk):
                 frame = self._frame_for_text(text_widget)
                 if not frame: return
                 tab = self.tabs.get(frame)
+                if tab and tab._swapping: return
                 if tab: tab._text_changed = True
-                self._update_title(); self._update_statusbar(text_widget)
+                self._ui.mark("title", "status")
                 text_widget.edit_modified(False)
         except Exception:
             pass
@@ -919,39 +2110,46 @@ class TextEditor(tk.Tk):
 
     def _on_tab_changed(self):
         # при переключении вкладки явно ставим фокус в текст, делаем state normal
-        frame = self._current_frame()
-        tab = self.tabs.get(frame) if frame else None
+        tab = self.current_editor_tab()
         if tab:
+            tab.last_used = time.monotonic()
+            self._schedule_hibernate()
+            # Тему меняли, пока вкладка была в фоне
+            self._apply_theme_to_text(tab)
             try:
-                tab.text.config(state="normal")
+                if self._editable(tab):
+                    tab.text.config(state="normal")
                 tab.text.focus_set()
             except Exception:
                 pass
-        self._update_title(); self._update_statusbar_for_current()
+        self._ui.mark("title", "status")
 
-    def _update_title(self):
+    def _render_title(self):
         tab = self.current_editor_tab()
         name = os.path.basename(tab.filepath) if tab and tab.filepath else "Безымянный"
         dirty = "*" if tab and tab._text_changed else ""
-        self.title(f"{name}{dirty} — {APP_NAME}")
-
-    def _update_statusbar(self, text_widget):
-        try:
-            idx = text_widget.index(tk.INSERT)
-            ln, col = idx.split("."); col = int(col) + 1; ln = int(ln)
-            tab = self.current_editor_tab()
-            filename = os.path.basename(tab.filepath) if tab and tab.filepath else "Безымянный"
-            dirty = "*" if tab and tab._text_changed else ""
-            wrap_state = "WRAP" if tab and tab.wrap else "NOWRAP"
-            self.statusbar.config(text=f"{filename}{dirty} | Ln {ln}, Col {col} | {wrap_state}")
-        except Exception:
-            pass
+        title = f"{name}{dirty} — {APP_NAME}"
+        if title != self._shown_title:
+            self._shown_title = title
+            self.title(title)
 
-    def _update_statusbar_for_current(self):
+    def _render_statusbar(self):
+        """Статусбар текущей вкладки: имя, позиция курсора, кодировка, перевод строки и перенос."""
         tab = self.current_editor_tab()
-        if not tab:
-            self.statusbar.config(text=""); return
-        self._update_statusbar(tab.text)
+        status = ""
+        if tab:
+            try:
+                ln, col = map(int, tab.text.index(tk.INSERT).split("."))
+            except (tk.TclError, AttributeError):
+                return
+            filename = os.path.basename(tab.filepath) if tab.filepath else "Безымянный"
+            dirty = "*" if tab._text_changed else ""
+            wrap_state = "WRAP" if tab.wrap else "NOWRAP"
+            status = (f"{filename}{dirty} | Ln {ln + tab.win_start}, Col {col + 1} | "
+                      f"{tab.encoding.upper()} {NEWLINE_NAMES.get(tab.newline, 'LF')} | {wrap_state}")
+        if status != self._shown_status:
+            self._shown_status = status
+            self.statusbar.config(text=status)
 
     def _about(self):
         messagebox.showinfo("О программе", f"{APP_NAME}\nРедактор с поддержкой .dl библиотек, Создатель-Никита Попов 9Е.")
@@ -966,30 +2164,115 @@ class TextEditor(tk.Tk):
         self.bind_all("<Control-z>", lambda e: self.edit_undo())
         self.bind_all("<Control-y>", lambda e: self.edit_redo())
         self.bind_all("<Control-f>", lambda e: self.open_find_replace())
-        self.bind_all("<Control-a>", lambda e: self.select_all() or "break")
-        self.bind_all("<Control-KeyPress>", self._control_keypress)
+        self.bind_all("<Control-F>", lambda e: self.open_find_in_files())
         self.protocol("WM_DELETE_WINDOW", self.on_close)
+        # Сочетания меню заняты — библиотеки получат сообщение о конфликте вместо тихой подмены
+        for name, combo in (("Новый", "Ctrl+N"), ("Открыть", "Ctrl+O"), ("Сохранить", "Ctrl+S"),
+                            ("Сохранить как", "Ctrl+Shift+S"), ("Закрыть вкладку", "Ctrl+W"),
+                            ("Отменить", "Ctrl+Z"), ("Повторить", "Ctrl+Y"), ("Найти/Заменить", "Ctrl+F"),
+                            ("Найти в файлах", "Ctrl+Shift+F")):
+            self.keys.reserve(name, parse_chord(combo))
+        # Ctrl+A — только через диспетчер; в русской раскладке stroke переводит Cyrillic_ef в "a"
+        self.keys.register("Выделить всё", parse_chord("Ctrl+A"), lambda e: self.select_all())
+
+    # --- Сеанс ---
+    def _session_entry(self, tab: EditorTab) -> dict:
+        if tab.frozen:
+            state = tab.frozen
+            insert, top, xview = state.insert, state.top, state.xview
+        else:
+            t = tab.text
+            insert, top, xview = t.index(tk.INSERT), t.index("@0,0"), t.xview()[0]
+            if tab.doc:
+                # Позиция в документе, а не в окне строк
+                line, col = insert.split(".")
+                insert = f"{int(line) + tab.win_start}.{col}"
+        entry = {"path": tab.filepath, "insert": insert, "top": top, "xview": xview, "wrap": tab.wrap}
+        if tab.font is not self.default_font:
+            entry["font"] = tab.font.actual()
+        return entry
+
+    def _save_session(self, current=None):
+        """Пишет SESSION_FILE: файлы вкладок в порядке notebook, активную вкладку (current), перенос и тему."""
+        tabs, active = [], 0
+        for name in self.notebook.tabs():
+            frame = self.nametowidget(name)
+            tab = self.tabs.get(frame)
+            if not tab or not tab.filepath:
+                continue
+            if frame is current:
+                active = len(tabs)
+            tabs.append(self._session_entry(tab))
+        data = {"version": SESSION_VERSION, "theme": self.current_theme, "wrap": self.wrap_var.get(),
+                "active": active, "tabs": tabs}
+        tmp = SESSION_FILE + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, SESSION_FILE)
+        except Exception:
+            traceback.print_exc()
 
-    def _control_keypress(self, event):
+    def _restore_session(self) -> bool:
+        """
+        Открывает вкладки из SESSION_FILE: активная читается сразу, остальные — заглушки
+        (FrozenTab без текста), файл которых читается при первом выборе вкладки.
+        """
         try:
-            ks = (event.keysym or "").lower()
-            if ks in ("a", "ф"):
-                self.select_all(); return "break"
+            with open(SESSION_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != SESSION_VERSION:
+                return False
         except Exception:
-            pass
-        return None
+            return False
+        theme = data.get("theme")
+        if theme in THEMES:
+            self.apply_theme(theme)
+        else:
+            self._pending_theme = theme
+        self.wrap_var.set(bool(data.get("wrap")))
+        frames = []
+        for entry in data.get("tabs", []):
+            path = entry.get("path") if isinstance(entry, dict) else None
+            if not path or not os.path.isfile(path) or self._tab_for_path(path):
+                continue
+            try:
+                font_obj = font.Font(**entry["font"]) if entry.get("font") else self.default_font
+                state = FrozenTab(None, entry.get("insert", "1.0"), entry.get("top", "1.0"), float(entry.get("xview", 0.0)))
+            except Exception:
+                continue
+            frame = ttk.Frame(self.notebook)
+            self.notebook.add(frame, text=os.path.basename(path))
+            tab = EditorTab(text_widget=None, filepath=path, font_obj=font_obj, wrap=bool(entry.get("wrap")))
+            tab.frozen = state
+            self.tabs[frame] = tab
+            frames.append(frame)
+        if not frames:
+            return False
+        active = data.get("active", 0)
+        self.notebook.select(frames[active if isinstance(active, int) and 0 <= active < len(frames) else 0])
+        self.current_editor_tab()
+        return True
 
     def on_close(self):
+        # Вопросы о несохранённых вкладках переключают вкладки — активную запоминаем заранее
+        current = self._current_frame()
         for frame, tab in list(self.tabs.items()):
-            if tab._text_changed:
+            if tab._text_changed and not tab._loading:
                 self.notebook.select(frame)
                 ans = messagebox.askyesnocancel("Несохранённые изменения", f"Вкладка '{os.path.basename(tab.filepath) if tab.filepath else 'Безымянный'}' содержит несохранённые изменения. Сохранить?")
                 if ans is None:
                     return
                 if ans:
-                    ok = self.save_file()
+                    ok = self.save_file(wait=True)
                     if not ok:
                         return
+        for tab in self.tabs.values():
+            self._join_save(tab)
+        self._save_session(current)
+        self._ui.cancel()
+        if self.plugin_manager:
+            self.plugin_manager.watcher.stop()
         self.destroy()
 
 
@@ -997,79 +2280,470 @@ class TextEditor(tk.Tk):
 # Find/Replace, FontDialog (минимальные)
 # -------------------------
 class FindReplaceDialog(tk.Toplevel):
-    def __init__(self, master, text_widget):
+    """
+    Немодальный поиск по мере ввода. Для текущего шаблона хранится отсортированный индекс
+    совпадений (смещения начал и концов); он строится заново при вводе шаблона, а после правок
+    текста перепроверяются только изменённые строки, смещения совпадений ниже них сдвигаются.
+    Переходы — bisect по индексу, подсвечиваются только совпадения рядом с видимой областью.
+    """
+    def __init__(self, master, tab: EditorTab):
         super().__init__(master)
         self.title("Найти / Заменить")
         self.transient(master)
         self.resizable(False, False)
-        self.text = text_widget
-        self._last_search = None
+        self.editor = master
+        self.tab = tab
+        self.text = tab.text
+        self._starts: list[int] = []
+        self._ends: list[int] = []
+        self._painted = bytearray()
+        self._current = -1
+        # Для чего построен индекс: (параметры поиска, версия текста); шаблон None — ошибка в выражении
+        self._key = None
+        self._compiled = None
+        self._rebuild_id = None
+        # Длина текста, для которой построен индекс, и изменённые с тех пор строки (lo, hi) в нумерации
+        # текущего текста; True — неизвестно какие (отмена/повтор)
+        self._size = 0
+        self._dirty: tuple[int, int] | bool | None = None
         self._build_ui()
-        self.grab_set()
+        self.text.tag_configure("find_match", background="#fff3a8")
+        self.text.tag_configure("find_highlight", background="yellow")
+        self.text.tag_raise("find_highlight")
+        tab.edit_listeners.append(self._on_edit)
+        tab.scroll_listeners.append(self._paint_visible)
+        self._destroy_bind = self.text.bind("<Destroy>", lambda e: self.close(), add="+")
         self.protocol("WM_DELETE_WINDOW", self.close)
 
     def _build_ui(self):
         frm = ttk.Frame(self, padding=10)
         frm.pack(fill=tk.BOTH, expand=True)
         ttk.Label(frm, text="Найти:").grid(column=0, row=0, sticky=tk.W)
-        self.find_entry = ttk.Entry(frm, width=30); self.find_entry.grid(column=1, row=0, columnspan=2, sticky=tk.W, pady=2)
+        self.find_var = tk.StringVar()
+        self.find_entry = ttk.Entry(frm, width=30, textvariable=self.find_var); self.find_entry.grid(column=1, row=0, columnspan=2, sticky=tk.W, pady=2)
+        self.counter = ttk.Label(frm, text="", width=14); self.counter.grid(column=3, row=0, sticky=tk.W, padx=4)
         ttk.Label(frm, text="Заменить:").grid(column=0, row=1, sticky=tk.W)
         self.replace_entry = ttk.Entry(frm, width=30); self.replace_entry.grid(column=1, row=1, columnspan=2, sticky=tk.W, pady=2)
         self.match_case = tk.BooleanVar(value=False)
-        ttk.Checkbutton(frm, text="Чувствительно к регистру", variable=self.match_case).grid(column=0, row=2, sticky=tk.W, pady=2)
+        self.use_regex = tk.BooleanVar(value=False)
+        self.whole_word = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frm, text="Чувствительно к регистру", variable=self.match_case, command=self._schedule_rebuild).grid(column=0, row=2, sticky=tk.W, pady=2)
+        ttk.Checkbutton(frm, text="Регулярное выражение", variable=self.use_regex, command=self._schedule_rebuild).grid(column=1, row=2, sticky=tk.W, pady=2)
+        ttk.Checkbutton(frm, text="Слово целиком", variable=self.whole_word, command=self._schedule_rebuild).grid(column=2, row=2, sticky=tk.W, pady=2)
         btn_find = ttk.Button(frm, text="Найти далее", command=self.find_next)
+        btn_prev = ttk.Button(frm, text="Найти ранее", command=self.find_prev)
         btn_replace = ttk.Button(frm, text="Заменить", command=self.replace_one)
         btn_replace_all = ttk.Button(frm, text="Заменить всё", command=self.replace_all)
         btn_close = ttk.Button(frm, text="Закрыть", command=self.close)
-        btn_find.grid(column=0, row=3, padx=3, pady=6); btn_replace.grid(column=1, row=3, padx=3, pady=6)
-        btn_replace_all.grid(column=2, row=3, padx=3, pady=6); btn_close.grid(column=3, row=3, padx=3, pady=6)
-        self.bind("<Return>", lambda e: self.find_next()); self.find_entry.focus_set()
+        btn_find.grid(column=0, row=3, padx=3, pady=6); btn_prev.grid(column=1, row=3, padx=3, pady=6)
+        btn_replace.grid(column=2, row=3, padx=3, pady=6); btn_replace_all.grid(column=3, row=3, padx=3, pady=6)
+        btn_close.grid(column=4, row=3, padx=3, pady=6)
+        self.find_var.trace_add("write", lambda *a: self._schedule_rebuild())
+        self.bind("<Return>", lambda e: self.find_next()); self.bind("<Shift-Return>", lambda e: self.find_prev())
+        self.find_entry.focus_set()
+
+    def _pattern(self, needle: str, report=True):
+        """Скомпилированный шаблон поиска или None, если регулярное выражение с ошибкой."""
+        try:
+            return compile_search(needle, self.match_case.get(), self.use_regex.get(), self.whole_word.get())
+        except re.error as e:
+            if report:
+                messagebox.showerror("Ошибка", f"Неверное регулярное выражение:\n{e}", parent=self)
+            return None
 
-    def find_next(self):
-        needle = self.find_entry.get(); 
-        if not needle: return
-        start = self.text.index(tk.INSERT)
-        opts = {} 
-        if not self.match_case.get(): opts["nocase"] = 1
-        pos = self.text.search(needle, start, tk.END, **opts)
-        if not pos:
-            pos = self.text.search(needle, "1.0", start, **opts)
-        if pos:
-            end = f"{pos}+{len(needle)}c"
+    def _replacer(self):
+        """Функция совпадение -> текст замены: в режиме regex поддерживаются \\1 и \\g<name>."""
+        replacement = self.replace_entry.get()
+        if self.use_regex.get():
+            return lambda m: m.expand(replacement)
+        return lambda m: replacement
+
+    # --- Индекс совпадений ---
+    def _options(self):
+        return (self.find_var.get(), self.match_case.get(), self.use_regex.get(), self.whole_word.get())
+
+    def _schedule_rebuild(self):
+        if self._rebuild_id:
+            self.after_cancel(self._rebuild_id)
+        self._rebuild_id = self.after(FIND_DEBOUNCE_MS, self._rebuild)
+
+    def _on_edit(self, first, old_last, new_last):
+        """Копит изменённые строки до пересборки: (lo, hi) переводятся в нумерацию текста после правки."""
+        if first is None or self._dirty is True:
+            self._dirty = True
+        elif self._dirty is None:
+            self._dirty = (first, new_last)
+        else:
+            lo, hi = self._dirty
+            hi = hi if hi < first else hi + new_last - old_last if hi > old_last else new_last
+            self._dirty = (min(lo, first), max(hi, new_last))
+        self._schedule_rebuild()
+
+    def _rebuild(self):
+        if self._rebuild_id:
+            self.after_cancel(self._rebuild_id); self._rebuild_id = None
+        options = self._options()
+        dirty, self._dirty = self._dirty, None
+        if self._compiled and self._key and self._key[0] == options and isinstance(dirty, tuple) \
+                and line_local(options[0], options[2]):
+            self._key = (options, self.tab._version)
+            self._update_lines(*dirty)
+        else:
+            self._key = (options, self.tab._version)
+            self.text.tag_remove("find_match", "1.0", tk.END)
             self.text.tag_remove("find_highlight", "1.0", tk.END)
-            self.text.tag_add("find_highlight", pos, end)
-            self.text.tag_configure("find_highlight", background="yellow")
-            self.text.mark_set(tk.INSERT, end); self.text.see(pos)
-            self._last_search = (needle, pos)
+            self._starts, self._ends, self._current = [], [], -1
+            self._compiled = self._pattern(options[0], report=False) if options[0] else None
+            if self._compiled:
+                spans = [m.span() for m in self._compiled.finditer(self.text.get("1.0", "end-1c"))]
+                self._starts = [s for s, _ in spans]
+                self._ends = [e for _, e in spans]
+            self._painted = bytearray(len(self._starts))
+            self._size = self.editor.line_index(self.tab).size()
+        self._paint_visible()
+        self._update_counter()
+
+    def _update_lines(self, lo: int, hi: int):
+        """
+        Ищет заново только в строках lo..hi (Tk, с 1) и сдвигает совпадения ниже на изменение длины.
+        Область расширяется, пока в неё не войдут целиком совпадения, задевающие её границы.
+        """
+        starts, ends = self._starts, self._ends
+        index = self.editor.line_index(self.tab)
+        last, size = len(index), index.size()
+        delta = size - self._size
+        lo, hi = min(lo, last), min(hi, last)
+        a = index.offset(lo)
+        # Совпадение, доходящее до изменённых строк сверху, ищется заново вместе с ними
+        k = bisect_left(starts, a)
+        if k and ends[k - 1] >= a:
+            lo = int(index.index(starts[k - 1]).split(".")[0])
+            a = index.offset(lo)
+        while True:
+            b = index.offset(hi + 1) if hi < last else size
+            seg = self.text.get(f"{lo}.0", f"{hi + 1}.0" if hi < last else "end-1c")
+            # Пустое совпадение в самом конце куска — это начало следующей строки, оно уже в индексе
+            spans = [(a + s, a + e) for s, e in (m.span() for m in self._compiled.finditer(seg)) if a + s < b or hi >= last]
+            j = bisect_left(starts, b - delta) if hi < last else len(starts)
+            crosses = (j and ends[j - 1] > b - delta) or (spans and spans[-1][1] >= b)
+            if hi >= last or not crosses:
+                break
+            hi = min(last, hi + (hi - lo + 1))
+        i = bisect_left(starts, a)
+        count = len(spans)
+        starts[i:j] = [s for s, _ in spans]
+        ends[i:j] = [e for _, e in spans]
+        self._painted[i:j] = bytes(count)
+        if delta:
+            tail = i + count
+            starts[tail:] = [s + delta for s in starts[tail:]]
+            ends[tail:] = [e + delta for e in ends[tail:]]
+        if self._current >= j:
+            self._current += count - (j - i)
+        elif self._current >= i:
+            self._current = -1
+            self.text.tag_remove("find_highlight", "1.0", tk.END)
+        self.text.tag_remove("find_match", f"{lo}.0", f"{hi + 1}.0" if hi < last else tk.END)
+        self._size = size
+
+    def _ensure_index(self, report=True) -> bool:
+        """Индекс актуален для текущего шаблона и текста; False — искать нечего."""
+        if self._rebuild_id or self._key != (self._options(), self.tab._version):
+            self._rebuild()
+        needle = self.find_var.get()
+        if needle and not self._compiled and report:
+            self._pattern(needle)
+        return self._compiled is not None
+
+    def _update_counter(self):
+        if not self.find_var.get():
+            text = ""
+        elif not self._compiled:
+            text = "ошибка в выражении"
         else:
-            messagebox.showinfo("Найти", "Не найдено")
+            text = f"{self._current + 1 if self._current >= 0 else 0} из {len(self._starts)}"
+        self.counter.config(text=text)
+
+    def _paint_visible(self):
+        """Подсвечивает ещё не подсвеченные совпадения в видимой области ± FIND_MARGIN_LINES строк."""
+        if not self._starts or self._key[1] != self.tab._version:
+            return
+        index = self.editor.line_index(self.tab)
+        top, bottom = self.editor._visible_lines(self.text)
+        lo = index.offset(max(top - FIND_MARGIN_LINES, 1))
+        last = bottom + FIND_MARGIN_LINES + 1
+        hi = index.offset(last) if last <= len(index) else float("inf")
+        todo = [i for i in range(bisect_left(self._ends, lo), bisect_right(self._starts, hi)) if not self._painted[i]]
+        if todo:
+            for i in todo:
+                self._painted[i] = 1
+            self.text.tag_add("find_match", *index.ranges([(self._starts[i], self._ends[i]) for i in todo]))
+
+    def _select(self, i: int):
+        self._current = i
+        pos, end = self.editor.line_index(self.tab).ranges([(self._starts[i], self._ends[i])])
+        self.text.tag_remove("find_highlight", "1.0", tk.END)
+        self.text.tag_add("find_highlight", pos, end)
+        self.text.mark_set(tk.INSERT, end); self.text.see(pos)
+        self._paint_visible()
+        self._update_counter()
+
+    def find_next(self):
+        if not self._ensure_index(): return
+        if not self._starts:
+            messagebox.showinfo("Найти", "Не найдено", parent=self); return
+        cursor = self.editor.line_index(self.tab).offset_of(self.text.index(tk.INSERT))
+        i = bisect_left(self._starts, cursor)
+        # Пустое совпадение под курсором — иначе поиск топчется на месте
+        if i == self._current and self._starts[i] == self._ends[i] == cursor:
+            i += 1
+        self._select(i if i < len(self._starts) else 0)
+
+    def find_prev(self):
+        if not self._ensure_index(): return
+        if not self._starts:
+            messagebox.showinfo("Найти", "Не найдено", parent=self); return
+        if self._current >= 0:
+            cursor = self._starts[self._current]
+        else:
+            cursor = self.editor.line_index(self.tab).offset_of(self.text.index(tk.INSERT))
+        i = bisect_left(self._starts, cursor) - 1
+        self._select(i if i >= 0 else len(self._starts) - 1)
 
     def replace_one(self):
-        if not self._last_search:
-            self.find_next(); return
-        needle, pos = self._last_search; current = self.find_entry.get()
-        if needle != current:
+        if not self._ensure_index(): return
+        if self._current < 0:
             self.find_next(); return
-        start = pos; end = f"{start}+{len(needle)}c"; replacement = self.replace_entry.get()
-        self.text.delete(start, end); self.text.insert(start, replacement)
-        self.text.tag_remove("find_highlight", "1.0", tk.END)
-        new_pos = f"{start}+{len(replacement)}c"; self.text.mark_set(tk.INSERT, new_pos)
-        self._last_search = None
+        start, end = self._starts[self._current], self._ends[self._current]
+        try:
+            if self.use_regex.get():
+                replacement = self._replacer()(self._compiled.match(self.text.get("1.0", "end-1c"), start))
+            else:
+                replacement = self.replace_entry.get()
+        except (re.error, IndexError) as e:
+            messagebox.showerror("Ошибка", f"Неверный шаблон замены:\n{e}", parent=self); return
+        pos, end = self.editor.line_index(self.tab).ranges([(start, end)])
+        self.text.replace(pos, end, replacement)
+        self.text.mark_set(tk.INSERT, f"{pos}+{len(replacement)}c")
+        self._ensure_index(report=False)
 
     def replace_all(self):
+        """Все замены за один проход по тексту; применяются блоками строк снизу вверх одним шагом отмены."""
         needle = self.find_entry.get(); 
         if not needle: return
-        replacement = self.replace_entry.get(); count = 0; idx = "1.0"; opts = {}
-        if not self.match_case.get(): opts["nocase"] = 1
-        while True:
-            pos = self.text.search(needle, idx, tk.END, **opts)
-            if not pos: break
-            end = f"{pos}+{len(needle)}c"; self.text.delete(pos, end); self.text.insert(pos, replacement)
-            idx = f"{pos}+{len(replacement)}c"; count += 1
-        messagebox.showinfo("Заменить всё", f"Заменено {count} вхождений."); self.text.tag_remove("find_highlight", "1.0", tk.END)
+        pattern = self._pattern(needle)
+        if not pattern: return
+        try:
+            blocks, count = plan_replacements(self.text.get("1.0", "end-1c"), pattern, self._replacer())
+        except (re.error, IndexError) as e:
+            messagebox.showerror("Ошибка", f"Неверный шаблон замены:\n{e}", parent=self); return
+        positions = self.editor.line_index(self.tab).ranges([(s, e) for s, e, _ in blocks])
+        autoseparators = self.text.cget("autoseparators")
+        self.text.config(autoseparators=False)
+        try:
+            self.text.edit_separator()
+            # С конца документа: индексы ещё не обработанных блоков не сдвигаются
+            for i in range(len(blocks) - 1, -1, -1):
+                self.text.replace(positions[2 * i], positions[2 * i + 1], blocks[i][2])
+            self.text.edit_separator()
+        finally:
+            self.text.config(autoseparators=autoseparators)
+        self._ensure_index(report=False)
+        messagebox.showinfo("Заменить всё", f"Заменено {count} вхождений.", parent=self)
+
+    def close(self):
+        if self._rebuild_id:
+            self.after_cancel(self._rebuild_id); self._rebuild_id = None
+        for listeners, cb in ((self.tab.edit_listeners, self._on_edit), (self.tab.scroll_listeners, self._paint_visible)):
+            if cb in listeners:
+                listeners.remove(cb)
+        try:
+            self.text.tag_remove("find_match", "1.0", tk.END); self.text.tag_remove("find_highlight", "1.0", tk.END)
+            # Убираем только свою привязку: unbind(seq, funcid) до Python 3.13 снимает все привязки события
+            script = self.text.bind("<Destroy>")
+            self.text.bind("<Destroy>", "\n".join(line for line in script.split("\n") if self._destroy_bind not in line))
+            self.text.deletecommand(self._destroy_bind)
+        except tk.TclError:
+            pass
+        if self.winfo_exists():
+            self.destroy()
+
+
+class FindInFilesDialog(tk.Toplevel):
+    """
+    Поиск по каталогу: файлы обходит FileSearch, содержимое проверяют процессы пула,
+    результаты дописываются в дерево по мере поступления. Открытые вкладки ищутся по тексту в памяти.
+    """
+    def __init__(self, master):
+        super().__init__(master)
+        self.title("Найти в файлах")
+        self.transient(master)
+        self.editor = master
+        self._pool = None
+        self._search: FileSearch | None = None
+        self._poll_id = None
+        # iid строки результата -> (путь или фрейм вкладки, строка, колонка)
+        self._targets: dict[str, tuple] = {}
+        self._hits = 0
+        self._build_ui()
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    def _build_ui(self):
+        frm = ttk.Frame(self, padding=10)
+        frm.pack(fill=tk.BOTH, expand=True)
+        frm.columnconfigure(1, weight=1); frm.rowconfigure(6, weight=1)
+        ttk.Label(frm, text="Найти:").grid(column=0, row=0, sticky=tk.W)
+        self.find_entry = ttk.Entry(frm, width=40); self.find_entry.grid(column=1, row=0, sticky=tk.EW, pady=2)
+        ttk.Label(frm, text="Папка:").grid(column=0, row=1, sticky=tk.W)
+        self.folder_var = tk.StringVar(value=self._default_folder())
+        ttk.Entry(frm, textvariable=self.folder_var).grid(column=1, row=1, sticky=tk.EW, pady=2)
+        ttk.Button(frm, text="Обзор...", command=self._browse).grid(column=2, row=1, padx=3)
+        ttk.Label(frm, text="Включить:").grid(column=0, row=2, sticky=tk.W)
+        self.include_var = tk.StringVar(value="")
+        ttk.Entry(frm, textvariable=self.include_var).grid(column=1, row=2, sticky=tk.EW, pady=2)
+        ttk.Label(frm, text="Исключить:").grid(column=0, row=3, sticky=tk.W)
+        self.exclude_var = tk.StringVar(value=FIND_FILES_EXCLUDE)
+        ttk.Entry(frm, textvariable=self.exclude_var).grid(column=1, row=3, sticky=tk.EW, pady=2)
+        opts = ttk.Frame(frm); opts.grid(column=0, row=4, columnspan=3, sticky=tk.W, pady=2)
+        self.match_case = tk.BooleanVar(value=False)
+        self.use_regex = tk.BooleanVar(value=False)
+        self.whole_word = tk.BooleanVar(value=False)
+        self.open_tabs = tk.BooleanVar(value=True)
+        ttk.Checkbutton(opts, text="Чувствительно к регистру", variable=self.match_case).pack(side=tk.LEFT)
+        ttk.Checkbutton(opts, text="Регулярное выражение", variable=self.use_regex).pack(side=tk.LEFT, padx=6)
+        ttk.Checkbutton(opts, text="Слово целиком", variable=self.whole_word).pack(side=tk.LEFT)
+        ttk.Checkbutton(opts, text="Открытые вкладки", variable=self.open_tabs).pack(side=tk.LEFT, padx=6)
+        btns = ttk.Frame(frm); btns.grid(column=0, row=5, columnspan=3, sticky=tk.EW, pady=4)
+        self.btn_search = ttk.Button(btns, text="Найти", command=self.start)
+        self.btn_stop = ttk.Button(btns, text="Стоп", command=self.stop, state="disabled")
+        self.btn_search.pack(side=tk.LEFT); self.btn_stop.pack(side=tk.LEFT, padx=4)
+        self.status = ttk.Label(btns, text=""); self.status.pack(side=tk.LEFT, padx=8)
+        tree_frame = ttk.Frame(frm); tree_frame.grid(column=0, row=6, columnspan=3, sticky=tk.NSEW)
+        self.tree = ttk.Treeview(tree_frame, columns=("line", "text"), height=16)
+        self.tree.heading("#0", text="Файл"); self.tree.heading("line", text="Строка"); self.tree.heading("text", text="Текст")
+        self.tree.column("#0", width=260); self.tree.column("line", width=60, anchor=tk.E); self.tree.column("text", width=420)
+        scroll = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scroll.set)
+        scroll.pack(side=tk.RIGHT, fill=tk.Y); self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.tree.bind("<<TreeviewSelect>>", lambda e: self._open_selected())
+        self.bind("<Return>", lambda e: self.start()); self.bind("<Escape>", lambda e: self.stop())
+        self.find_entry.focus_set()
+
+    def _default_folder(self) -> str:
+        tab = self.editor.current_editor_tab()
+        if tab and tab.filepath:
+            return os.path.dirname(os.path.abspath(tab.filepath))
+        return os.getcwd()
+
+    def _browse(self):
+        folder = filedialog.askdirectory(parent=self, initialdir=self.folder_var.get() or None)
+        if folder:
+            self.folder_var.set(folder)
+
+    @staticmethod
+    def _globs(value: str) -> list[str]:
+        return [p.strip() for p in value.replace(",", ";").split(";") if p.strip()]
+
+    def start(self):
+        needle = self.find_entry.get()
+        if not needle:
+            return
+        try:
+            pattern = compile_search(needle, self.match_case.get(), self.use_regex.get(), self.whole_word.get())
+        except re.error as e:
+            messagebox.showerror("Ошибка", f"Неверное регулярное выражение:\n{e}", parent=self); return
+        root = self.folder_var.get()
+        if not os.path.isdir(root):
+            messagebox.showerror("Ошибка", f"Папка не найдена:\n{root}", parent=self); return
+        self.stop()
+        self.tree.delete(*self.tree.get_children())
+        self._targets.clear(); self._hits = 0
+        # Открытые вкладки — по тексту в памяти, их файлы на диске уже не читаем
+        skip = set()
+        if self.open_tabs.get():
+            for frame, tab in self.editor.tabs.items():
+                # Файл заглушки сеанса ещё не читался — его ищем на диске как обычный
+                if tab._loading or tab.doc or (tab.frozen and tab.frozen.placeholder):
+                    continue
+                if tab.filepath:
+                    skip.add(os.path.normcase(os.path.abspath(tab.filepath)))
+                hits = search_text(self.editor.tab_content(tab), pattern)
+                if hits:
+                    label = self.editor.notebook.tab(frame, "text")
+                    self._add_results(f"[{label}]", tab.filepath or frame, hits)
+        if self._pool is None:
+            import concurrent.futures
+            from fpc_worker import spawn_context
+            self._pool = concurrent.futures.ProcessPoolExecutor(mp_context=spawn_context())
+        self._search = FileSearch(self._pool, root, pattern, self._globs(self.include_var.get()),
+                                  self._globs(self.exclude_var.get()), skip)
+        self._search.start()
+        self.btn_stop.config(state="normal")
+        self._poll()
+
+    def stop(self):
+        if self._search:
+            self._search.cancelled.set()
+
+    def _poll(self):
+        """Переносит готовые результаты из очереди в дерево, не дольше HIGHLIGHT_APPLY_BUDGET_MS за раз."""
+        self._poll_id = None
+        search = self._search
+        if not search:
+            return
+        root = search.root
+        deadline = time.perf_counter() + HIGHLIGHT_APPLY_BUDGET_MS / 1000
+        finished = False
+        while time.perf_counter() < deadline:
+            try:
+                batch = search.results.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                finished = True; break
+            for path, hits in batch:
+                self._add_results(os.path.relpath(path, root), path, hits)
+        if finished:
+            self._search = None
+            self.btn_stop.config(state="disabled")
+            if search.error:
+                messagebox.showerror("Ошибка", f"Поиск прерван:\n{search.error}", parent=self)
+            state = "остановлено" if search.cancelled.is_set() else "готово"
+        else:
+            state = "поиск..."
+            self._poll_id = self.after(SAVE_POLL_MS, self._poll)
+        self.status.config(text=f"{state} файлов: {search.scanned}, совпадений: {self._hits}")
+
+    def _add_results(self, label: str, target, hits):
+        parent = self.tree.insert("", tk.END, text=label, values=("", f"{len(hits)} совп."), open=True)
+        for line, col, text in hits:
+            iid = self.tree.insert(parent, tk.END, text="", values=(line, text))
+            self._targets[iid] = (target, line, col)
+        self._hits += len(hits)
+
+    def _open_selected(self):
+        sel = self.tree.selection()
+        if not sel or sel[0] not in self._targets:
+            return
+        target, line, col = self._targets[sel[0]]
+        if isinstance(target, str):
+            tab = self.editor.open_path(target)
+        else:
+            tab = self.editor.tabs.get(target)
+            if tab:
+                self.editor.notebook.select(target)
+        if tab:
+            self.editor._goto_line(tab, line, col)
 
     def close(self):
-        self.text.tag_remove("find_highlight", "1.0", tk.END); self.grab_release(); self.destroy()
+        self.stop()
+        if self._poll_id:
+            self.after_cancel(self._poll_id); self._poll_id = None
+        if self._pool:
+            # stop() уже выставил cancelled: FileSearch больше не отдаёт задачи, а поздний submit после shutdown
+            # считает остановкой, не ошибкой; невыполненные задачи он отменяет сам (cancel_futures — только с 3.9)
+            self._pool.shutdown(wait=False); self._pool = None
+        self.destroy()
 
 
 class FontDialog(tk.Toplevel):
@@ -1111,7 +2785,19 @@ class FontDialog(tk.Toplevel):
 # Запуск приложения
 # -------------------------
 def main():
-    app = TextEditor()
+    # Пул поиска в файлах запускает процессы методом spawn — нужно для собранного exe на Windows
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+        multiprocessing.freeze_support()
+    # Пакетный режим без окна: python FPC.py export --theme ИМЯ --jobs N файлы/папки
+    if sys.argv[1:2] == ["export"]:
+        sys.exit(export_main(sys.argv[2:], libs_dir=LIBS_DIR))
+    # Сборка пакета библиотек: python FPC.py pack -o team.dlpack --name ИМЯ --version В файлы/папки
+    if sys.argv[1:2] == ["pack"]:
+        sys.exit(pack_main(sys.argv[2:]))
+    profile = StartupProfile("--profile-startup" in sys.argv[1:])
+    profile.mark("импорт модуля")
+    app = TextEditor(profile)
     app.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,279 @@
+"""
+Бенчмарки горячих путей fpc_core на синтетических данных: подсветка, разбор текстового
+импорта .dl, загрузка libs/, «Заменить всё» и поиск. Результаты пишутся в JSON, чтобы
+сравнивать версии между собой.
+
+    python benchmarks/bench_core.py                      # все наборы
+    python benchmarks/bench_core.py --quick              # без корпусов на 1M строк
+    python benchmarks/bench_core.py --only highlight     # наборы, в имени которых есть подстрока
+    python benchmarks/bench_core.py --compare old.json   # сравнить с прошлым прогоном
+"""
+from __future__ import annotations
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fpc_core
+
+RESULTS_VERSION = 1
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Замедление больше чем на REGRESSION_RATIO при --compare помечается как регрессия
+REGRESSION_RATIO = 0.9
+LINE_SIZES = (1_000, 100_000, 1_000_000)
+QUICK_LINE_SIZES = (1_000, 100_000)
+LIBS_COUNT = 1000
+NESTING_DEPTHS = (100, 10_000)
+
+
+# -------------------------
+# Синтетические данные
+# -------------------------
+_PY_TEMPLATE = '''class Item{n}(object):
+    """Документация класса {n}:
+    в несколько строк, с 'кавычками' и # не комментарием."""
+    limit = {n} * 2 + 0.5  # комментарий с value
+    def value(self, key: str = "k{n}", *args) -> int:
+        if key in self.cache and not isinstance(key, bytes):
+            return len(str(self.cache[key])) + {n}
+        raise KeyError(f"нет {{key!r}}: value")
+
+'''
+
+
+def python_source(lines: int) -> str:
+    """Python-код ровно из lines строк: классы с докстрингами, строками, числами, встроенными."""
+    block = _PY_TEMPLATE.count("\n")
+    parts = [_PY_TEMPLATE.format(n=n) for n in range(lines // block + 1)]
+    return "\n".join("".join(parts).split("\n")[:lines])
+
+
+def nested_import_text(depth: int) -> str:
+    """Текст импорта с code из depth вложенных {...}, строками с экранированными кавычками и скобками."""
+    inner = '{"k": ' * depth + '"a\\"}{\\\\' + "}" * depth
+    return ("name:{Nested}\ncreator:{bench}\nvalue:{theme}\ntype:{theme}\n"
+            'code:{"deep": ' + inner + ', "s": "}{\'", "t": \'"{\'}')
+
+
+def unbalanced_import_text(depth: int) -> str:
+    """Худший случай: каждая открывающая скобка без пары — find_brace_block сканирует весь текст."""
+    return "name:{" + "{" * depth + "\ncode:{" + '"x": "' * depth
+
+
+def many_import_text(count: int) -> str:
+    """Текст импорта из count библиотек подряд, каждая со вложенным code."""
+    return "\n\n".join(f"name:{{lib{i}}}\ncreator:{{bench}}\ntype:{{theme}}\nvalue:{{theme}}\n"
+                       f'code:{{"Тема {i}": {{"background": "#ffffff", "tag": {{"keyword": {{"foreground": "#0000ff"}}}}}}}}'
+                       for i in range(count))
+
+
+def make_libs(folder: str, count: int):
+    """count библиотек: темы с двумя ветками, бинды и шаблоны вкладок поровну."""
+    for i in range(count):
+        kind = ("theme", "bind", "tabs")[i % 3]
+        if kind == "theme":
+            base = {"background": "#ffffff", "foreground": "#000000", "cursor": "#000000",
+                    "selectbackground": "#cce8ff", "tag": {"keyword": {"foreground": "#0000ff"}}}
+            code = {"Светлая": base, "Тёмная": dict(base, background="#1e1e1e", foreground="#d4d4d4")}
+        elif kind == "bind":
+            code = {"action": "insert", "combo": f"Ctrl+K Ctrl+{chr(97 + i % 26)}", "text": "print($0)\n"}
+        else:
+            code = {"tabs": [{"title": f"Шаблон {i}.{k}", "content": "x = 1\n" * 20} for k in range(3)]}
+        obj = {"type": kind, "name": f"lib{i:04d}", "creator": "bench", "value": kind, "code": code}
+        with open(os.path.join(folder, f"lib{i:04d}.dl"), "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+
+
+# -------------------------
+# Наборы: функция готовит данные и возвращает (запуск, объём, единица)
+# -------------------------
+def case_highlight(lines: int):
+    text = python_source(lines)
+    def run():
+        split = text.split("\n")
+        cache = fpc_core.LineStateCache(len(split))
+        for i, line in enumerate(split):
+            cache.relex(i, line)
+    return run, lines, "lines"
+
+
+def case_tokenize(lines: int):
+    text = python_source(lines)
+    def run():
+        for _ in fpc_core.tokenize_python(text):
+            pass
+    return run, len(text), "chars"
+
+
+def case_replace_all(lines: int):
+    text = python_source(lines)
+    pattern = fpc_core.compile_search("value", match_case=True, whole_word=True)
+    def run():
+        fpc_core.plan_replacements(text, pattern, lambda m: "amount")
+    return run, lines, "lines"
+
+
+def case_search(lines: int):
+    text = python_source(lines)
+    pattern = fpc_core.compile_search("cache", regex=False)
+    def run():
+        fpc_core.search_text(text, pattern, limit=lines)
+    return run, lines, "lines"
+
+
+def case_line_index(lines: int):
+    text = python_source(lines)
+    def run():
+        index = fpc_core.LineIndex(text)
+        for line in range(1, lines, max(1, lines // 1000)):
+            index.offset(line, 0)
+    return run, lines, "lines"
+
+
+def case_extract_fields(depth: int):
+    text = nested_import_text(depth)
+    def run():
+        fields = fpc_core.extract_fields_from_text(text)
+        assert fields.get("name") == "Nested"
+    return run, len(text), "chars"
+
+
+def case_extract_unbalanced(depth: int):
+    text = unbalanced_import_text(depth)
+    def run():
+        fpc_core.extract_fields_from_text(text)
+    return run, len(text), "chars"
+
+
+def case_brace_block(depth: int):
+    text = nested_import_text(depth)
+    start = text.index("code:{") + 5
+    def run():
+        fpc_core.find_brace_block(text, start)
+    return run, len(text) - start, "chars"
+
+
+def case_parse_many(count: int):
+    text = many_import_text(count)
+    def run():
+        records, errors = fpc_core.parse_import_text(text)
+        assert len(records) == count and not errors
+    return run, count, "libs"
+
+
+def case_scan_libs(count: int, warm: bool, folder: str):
+    libs = os.path.join(folder, f"libs-{count}")
+    if not os.path.isdir(libs):
+        os.makedirs(libs)
+        make_libs(libs, count)
+    cached = fpc_core.scan_libs(libs) if warm else None
+    def run():
+        fpc_core.scan_libs(libs, cached)
+    return run, count, "files"
+
+
+def cases(quick: bool, folder: str):
+    """(имя, фабрика) всех наборов; данные готовятся фабрикой, вне замера."""
+    out = []
+    for lines in QUICK_LINE_SIZES if quick else LINE_SIZES:
+        out += [(f"highlight.relex[{lines}]", lambda n=lines: case_highlight(n)),
+                (f"highlight.tokenize[{lines}]", lambda n=lines: case_tokenize(n)),
+                (f"replace_all[{lines}]", lambda n=lines: case_replace_all(n)),
+                (f"search_text[{lines}]", lambda n=lines: case_search(n)),
+                (f"line_index[{lines}]", lambda n=lines: case_line_index(n))]
+    for depth in NESTING_DEPTHS:
+        out += [(f"import.extract_fields[{depth}]", lambda d=depth: case_extract_fields(d)),
+                (f"import.extract_unbalanced[{depth}]", lambda d=depth: case_extract_unbalanced(d)),
+                (f"import.find_brace_block[{depth}]", lambda d=depth: case_brace_block(d))]
+    out.append((f"import.parse_many[{LIBS_COUNT}]", lambda: case_parse_many(LIBS_COUNT)))
+    out += [(f"libs.scan_cold[{LIBS_COUNT}]", lambda: case_scan_libs(LIBS_COUNT, False, folder)),
+            (f"libs.scan_warm[{LIBS_COUNT}]", lambda: case_scan_libs(LIBS_COUNT, True, folder))]
+    return out
+
+
+# -------------------------
+# Замер
+# -------------------------
+def measure(factory, repeat: int, memory: bool) -> dict:
+    """Лучшее время из repeat запусков (и не меньше одного), затем пик памяти отдельным запуском под tracemalloc."""
+    run, amount, unit = factory()
+    best = None
+    deadline = time.perf_counter() + 5
+    for _ in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+        if time.perf_counter() > deadline:
+            break
+    result = {"seconds": round(best, 6), "amount": amount, "unit": unit,
+              "throughput": round(amount / best, 1) if best else None}
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        run()
+        result["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    return result
+
+
+def compare(old: dict, new: dict) -> int:
+    """Печатает отношение пропускной способности new/old; возвращает число регрессий."""
+    regressions = 0
+    for name, res in new["results"].items():
+        prev = old.get("results", {}).get(name)
+        if not prev or not prev.get("throughput") or not res.get("throughput"):
+            continue
+        ratio = res["throughput"] / prev["throughput"]
+        mark = "  РЕГРЕССИЯ" if ratio < REGRESSION_RATIO else ""
+        regressions += bool(mark)
+        print(f"{name:<36}{prev['throughput']:>16,.0f}{res['throughput']:>16,.0f}{ratio:>8.2f}x{mark}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки fpc_core")
+    parser.add_argument("--quick", action="store_true", help="без корпусов на 1M строк")
+    parser.add_argument("--only", default="", help="только наборы, в имени которых есть эта подстрока")
+    parser.add_argument("--repeat", type=int, default=3, help="запусков на набор (берётся лучший)")
+    parser.add_argument("--no-memory", action="store_true", help="не замерять пик памяти (tracemalloc)")
+    parser.add_argument("-o", "--output", help="файл JSON с результатами (по умолчанию benchmarks/results/<время>.json)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    folder = tempfile.mkdtemp(prefix="fpc-bench-")
+    report = {"version": RESULTS_VERSION, "created": datetime.datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": platform.platform(), "results": {}}
+    try:
+        for name, factory in cases(args.quick, folder):
+            if args.only not in name:
+                continue
+            res = report["results"][name] = measure(factory, max(1, args.repeat), not args.no_memory)
+            peak = f"{res['peak_kib']:>12,.0f} KiB" if "peak_kib" in res else ""
+            print(f"{name:<36}{res['seconds'] * 1000:>10.1f} мс{res['throughput']:>16,.0f} {res['unit']}/s{peak}", flush=True)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        return 1 if compare(old, report) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
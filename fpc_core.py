@@ -0,0 +1,1575 @@
+"""
+Ядро Fly Create Pro без Tk: подсветка, разбор и поиск текста, документ огромного файла,
+сохранение, библиотеки .dl, экспорт в HTML. Импортируется редактором (FPC.py), процессами
+поиска в файлах и экспорта и бенчмарками (benchmarks/).
+"""
+from __future__ import annotations
+import builtins
+import codecs
+import fnmatch
+import json
+import keyword
+import mmap
+import os
+import queue
+import re
+import stat
+import sys
+import threading
+import traceback
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+
+# Базовые темы (можно расширять/замещать библиотеками .dl)
+THEMES = {
+    "Светлая": {
+        "background": "#ffffff",
+        "foreground": "#000000",
+        "cursor": "#000000",
+        "selectbackground": "#2f2f2f",
+        "selectforeground": "#ffffff",
+        "linenumber_bg": "#f0f0f0",
+        "tab_bg": "#f5f5f5",
+        "tag": {
+            "keyword": {"foreground": "#0000ff"},
+            "string": {"foreground": "#a31515"},
+            "comment": {"foreground": "#008000"},
+            "number": {"foreground": "#098658"},
+            "builtin": {"foreground": "#795e26"},
+        },
+    },
+    "Тёмная": {
+        "background": "#1e1e1e",
+        "foreground": "#d4d4d4",
+        "cursor": "#ffffff",
+        "selectbackground": "#dbeeff",
+        "selectforeground": "#000000",
+        "linenumber_bg": "#2b2b2b",
+        "tab_bg": "#2a2a2a",
+        "tag": {
+            "keyword": {"foreground": "#569cd6"},
+            "string": {"foreground": "#ce9178"},
+            "comment": {"foreground": "#6a9955"},
+            "number": {"foreground": "#b5cea8"},
+            "builtin": {"foreground": "#dcdcaa"},
+        },
+    },
+}
+
+
+# Файлы от LARGE_FILE_SIZE байт считаются большими; кодировка определяется по первым LOAD_SNIFF_BYTES байтам
+LARGE_FILE_SIZE = 4 * 1024 * 1024
+LOAD_SNIFF_BYTES = 64 * 1024
+# «Заменить всё»: больше REPLACE_MAX_BLOCKS изменённых блоков строк сливаются в одну замену
+REPLACE_MAX_BLOCKS = 500
+# Поиск в файлах: файлы больше FIND_FILES_MAX_SIZE пропускаются, в задание пулу уходит
+# FIND_FILES_BATCH путей, из одного файла берётся не больше FIND_FILES_MAX_HITS совпадений
+FIND_FILES_MAX_SIZE = LARGE_FILE_SIZE
+FIND_FILES_BATCH = 32
+FIND_FILES_MAX_HITS = 500
+FIND_FILES_EXCLUDE = ".git;.hg;.svn;__pycache__;node_modules;*.pyc;*.fpc-tmp"
+# Индекс библиотек в libs/: заголовки и данные регистрации, ключ — имя файла + (mtime, размер)
+PLUGIN_INDEX_FILE = ".fpc-index.json"
+PLUGIN_INDEX_VERSION = 3
+DL_FIELDS = ("type", "name", "creator", "value", "code")
+DL_HEADER_FIELDS = ("type", "name", "creator", "value")
+# Пакеты библиотек .dlpack: zip с манифестом DLPACK_MANIFEST (имя и версия пакета, по записи на файл .dl
+# с именем, типом, версией и sha256); установленные пакеты запоминаются в libs/DLPACK_STATE_FILE
+DLPACK_MANIFEST = "manifest.json"
+DLPACK_FORMAT = 1
+DLPACK_STATE_FILE = ".fpc-packs.json"
+# Модификаторы сочетаний клавиш: порядок в записи удара и биты в event.state (зависят от платформы)
+MOD_BITS = (("Control", 0x4), ("Alt", 0x20000 if sys.platform == "win32" else 0x10 if sys.platform == "darwin" else 0x8),
+            ("Shift", 0x1), ("Mod4", 0x40))
+MOD_NAMES = {"ctrl": "Control", "control": "Control", "alt": "Alt", "shift": "Shift",
+             "win": "Mod4", "meta": "Mod4", "super": "Mod4"}
+# Знаки препинания в записи сочетания -> keysym, который Tk сообщает для этой клавиши
+KEY_NAMES = {",": "comma", ".": "period", ";": "semicolon", "'": "apostrophe", "/": "slash",
+             "\\": "backslash", "[": "bracketleft", "]": "bracketright", "-": "minus", "=": "equal",
+             "`": "grave", "+": "plus"}
+
+
+PY_KEYWORDS = set(keyword.kwlist)
+PY_BUILTINS = set(dir(builtins))
+
+def _words_pattern(words) -> str:
+    """Альтернатива слов в виде префиксного дерева: re проверяет её за один проход по символам."""
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    def build(node):
+        branches = [re.escape(ch) + build(sub) for ch, sub in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + body + ")?" if "" in node else body
+    return build(trie)
+
+
+_KW = _words_pattern(PY_KEYWORDS)
+_BI = _words_pattern(PY_BUILTINS - PY_KEYWORDS)
+
+# Один регэксп для подсветки: сначала внутри одного совпадения пропускается «неинтересный»
+# текст — пунктуация и обычные идентификаторы, затем берётся ровно один токен. Пропуск
+# останавливается только перед кавычкой, '#', числом, ключевым словом, встроенным именем
+# или концом текста — а с них токен всегда совпадает, поэтому откатов в пропуск не бывает
+# и possessive-квантификаторы (только с Python 3.11) не нужны. Строки поглощают '#' и слова внутри себя.
+RE_TOKEN = re.compile(r"""
+    (?: [^'"\#\w]+
+      | (?!(?:%(kw)s|%(bi)s)\b)[A-Za-z_]\w*
+      | (?![A-Za-z_])(?!\d+(?:\.\d+)?\b)\w+
+    )*
+    (?: (?P<string>'''.*?(?:'''|\Z)|\"\"\".*?(?:\"\"\"|\Z)|'(?:\\.|[^'\\\n])*'?|"(?:\\.|[^"\\\n])*"?)
+      | (?P<comment>\#[^\n]*)
+      | (?P<number>\d+(?:\.\d+)?\b)
+      | (?P<keyword>(?:%(kw)s)\b)
+      | (?P<builtin>(?:%(bi)s)\b)
+      | \Z
+    )""" % {"kw": _KW, "bi": _BI}, re.DOTALL | re.VERBOSE)
+
+
+def tokenize_python(text: str):
+    """Один проход по тексту: упорядоченный поток (тег, начало, конец) для подсветки."""
+    for m in RE_TOKEN.finditer(text):
+        tag = m.lastgroup
+        if tag:
+            yield tag, m.start(tag), m.end(tag)
+
+
+def tokenize_line(line: str, state: str | None = None):
+    """
+    Токены одной строки (без перевода строки) и состояние на её конце:
+    None или открытая тройная кавычка, если строка заканчивается внутри '''...'''.
+    """
+    tokens = []
+    pos = 0
+    if state:
+        end = line.find(state)
+        if end == -1:
+            if line:
+                tokens.append(("string", 0, len(line)))
+            return tokens, state
+        pos = end + 3
+        tokens.append(("string", 0, pos))
+        state = None
+    scanned = len(tokens)
+    for m in RE_TOKEN.finditer(line, pos):
+        tag = m.lastgroup
+        if tag:
+            tokens.append((tag, m.start(tag), m.end(tag)))
+    if len(tokens) > scanned and tokens[-1][0] == "string":
+        _, s, e = tokens[-1]
+        quote = line[s:s + 3]
+        if quote in ("'''", '"""') and (e - s < 6 or not line.endswith(quote, s, e)):
+            state = quote
+    return tokens, state
+
+
+class LineStateCache:
+    """
+    Состояние лексера на конец каждой строки: None или открытая тройная кавычка.
+    После правки строки перелексируются с первой изменённой и только до тех пор,
+    пока состояние на конце строки не совпадёт с сохранённым.
+    """
+    def __init__(self, lines: int = 1):
+        self.reset(lines)
+
+    def reset(self, lines: int):
+        self.states: list[str | None] = [None] * lines
+        # dirty[i] == 1 — строку i (с нуля) нужно перелексировать
+        self.dirty = bytearray(b"\x01") * lines
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def splice(self, first: int, old_last: int, new_last: int):
+        """Строки first..old_last (нумерация Tk) заменены строками first..new_last."""
+        added = new_last - first + 1
+        # Конец правленого блока наследует старое состояние: с ним и сравниваем при сходимости
+        self.states[first - 1:old_last] = [None] * (added - 1) + [self.states[old_last - 1]]
+        self.dirty[first - 1:old_last] = b"\x01" * added
+
+    def first_dirty(self, stop: int | None = None) -> int:
+        return self.dirty.find(1, 0, len(self.dirty) if stop is None else stop)
+
+    def start_state(self, i: int) -> str | None:
+        return self.states[i - 1] if i else None
+
+    def relex(self, i: int, line: str) -> tuple[list, bool]:
+        """Перелексирует строку i (с нуля). Возвращает токены и признак смены состояния."""
+        tokens, state = tokenize_line(line, self.start_state(i))
+        changed = state != self.states[i]
+        self.states[i] = state
+        self.dirty[i] = 0
+        if changed and i + 1 < len(self.dirty):
+            self.dirty[i + 1] = 1
+        return tokens, changed
+
+
+HIGHLIGHT_TAGS = ("keyword", "string", "comment", "number", "builtin")
+# Запас строк сверху/снизу видимой области, которые подсвечиваются заранее
+HIGHLIGHT_MARGIN = 40
+# Если до видимой области больше стольких неразобранных строк, её подсветит фоновый поток
+HIGHLIGHT_SYNC_LINES = 3000
+# Фоновая подсветка: строк в порции и сколько миллисекунд за тик можно тратить на теги
+HIGHLIGHT_CHUNK_LINES = 200
+HIGHLIGHT_APPLY_BUDGET_MS = 12
+HIGHLIGHT_POLL_MS = 15
+
+
+class HighlightWorker(threading.Thread):
+    """
+    Фоновый лексер. Задание — снимок текста с номером версии вкладки; результат
+    уходит в очередь results порциями (ключ, версия, первая строка, [(токены, состояние)]).
+    Устаревшее задание (версия изменилась) бросается; в конце всегда кладётся
+    маркер (ключ, версия, None, None).
+    """
+    def __init__(self, chunk_lines: int = HIGHLIGHT_CHUNK_LINES):
+        super().__init__(name="highlight", daemon=True)
+        self.chunk_lines = chunk_lines
+        self.jobs: queue.Queue = queue.Queue()
+        self.results: queue.Queue = queue.Queue()
+
+    def submit(self, key, version: int, first: int, state: str | None, text: str, is_current):
+        """is_current(version) вызывается из потока: можно ли ещё продолжать это задание."""
+        self.jobs.put((key, version, first, state, text, is_current))
+
+    def run(self):
+        while True:
+            key, version, first, state, text, is_current = self.jobs.get()
+            try:
+                lines = text.split("\n")
+                del text
+                for k in range(0, len(lines), self.chunk_lines):
+                    if not is_current(version):
+                        break
+                    chunk = []
+                    for line in lines[k:k + self.chunk_lines]:
+                        tokens, state = tokenize_line(line, state)
+                        chunk.append((tokens, state))
+                    self.results.put((key, version, first + k, chunk))
+            except Exception:
+                traceback.print_exc()
+            self.results.put((key, version, None, None))
+
+
+# Текстовый формат импорта: поля вида имя:{значение}, несколько библиотек подряд в одном файле;
+# повтор поля начинает следующую библиотеку. Внутри {...} учитываются кавычки и экранирование \
+IMPORT_FIELDS = ("type", "name", "creator", "value", "code")
+_RE_IMPORT_KEY = re.compile(r"([A-Za-z_]\w*)\s*:\s*\{")
+_RE_IMPORT_SKIP = re.compile(r"(?:\s+|#[^\n]*|[,;])*")
+_RE_BLOCK_SPECIAL = re.compile(r"""[{}"'\\]""")
+_RE_STRING_SPECIAL = {"'": re.compile(r"['\\]"), '"': re.compile(r'["\\]')}
+
+
+class TextImportError(ValueError):
+    """Ошибка разбора текста импорта; line и col — с 1."""
+    def __init__(self, line: int, col: int, message: str):
+        super().__init__(f"строка {line}, столбец {col}: {message}")
+        self.line = line
+        self.col = col
+        self.message = message
+
+
+def block_end(text: str, start: int) -> int:
+    """Позиция за скобкой, закрывающей блок {...} с text[start] == "{", или -1, если блок не закрыт."""
+    depth = 0
+    pos = start
+    quote = None
+    while True:
+        # Регэксп перескакивает к следующему значимому символу: скобке, кавычке или \
+        m = (_RE_STRING_SPECIAL[quote] if quote else _RE_BLOCK_SPECIAL).search(text, pos)
+        if not m:
+            return -1
+        ch = m.group()
+        pos = m.end()
+        if ch == "\\":
+            pos += 1
+        elif quote:
+            quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+
+def find_brace_block(text: str, start_index: int) -> tuple[int, int]:
+    if start_index >= len(text) or text[start_index] != "{":
+        return -1, -1
+    end = block_end(text, start_index)
+    return (start_index, end) if end != -1 else (-1, -1)
+
+
+def _import_value(key: str, text: str, start: int, end: int, error):
+    """Значение поля из блока text[start:end] ("{...}"); code разбирается как JSON, затем как литерал Python."""
+    raw = text[start + 1:end - 1]
+    inner = raw.strip()
+    if key != "code":
+        if len(inner) >= 2 and inner[0] == inner[-1] and inner[0] in "'\"":
+            inner = inner[1:-1]
+        return inner
+    if not inner.startswith('"') and ":" not in inner:
+        return inner
+    try:
+        return json.loads("{" + inner + "}")
+    except json.JSONDecodeError as exc:
+        json_error = exc
+    try:
+        import ast
+        return ast.literal_eval("{" + inner + "}")
+    except Exception:
+        pass
+    # Позиция ошибки JSON внутри "{" + inner + "}" -> позиция в исходном тексте
+    lead = len(raw) - len(raw.lstrip())
+    pos = start + lead + json_error.pos if json_error.pos else start
+    error(min(pos, end - 1), f"code не разобран как JSON: {json_error.msg}")
+    return inner
+
+
+def parse_import_text(text: str) -> tuple[list[dict], list[TextImportError]]:
+    """
+    Один проход по тексту импорта: список библиотек (словари полей) и ошибки с позициями.
+    Посторонний текст между полями и неизвестные поля — ошибки, после которых разбор продолжается.
+    """
+    records: list[dict] = []
+    errors: list[TextImportError] = []
+    fields: dict = {}
+    newlines = None
+
+    def error(pos: int, message: str):
+        nonlocal newlines
+        if newlines is None:
+            newlines = [m.start() for m in re.finditer("\n", text)]
+        line = bisect_left(newlines, pos)
+        col = pos - (newlines[line - 1] + 1 if line else 0)
+        errors.append(TextImportError(line + 1, col + 1, message))
+
+    pos, n = 0, len(text)
+    while True:
+        pos = _RE_IMPORT_SKIP.match(text, pos).end()
+        if pos >= n:
+            break
+        m = _RE_IMPORT_KEY.match(text, pos)
+        if not m:
+            error(pos, "ожидалось поле вида имя:{...}")
+            m = _RE_IMPORT_KEY.search(text, pos + 1)
+            if not m:
+                break
+        key = m.group(1).lower()
+        brace = m.end() - 1
+        end = block_end(text, brace)
+        if end < 0:
+            error(brace, f"не закрыта скобка поля {m.group(1)}")
+            break
+        pos = end
+        if key not in IMPORT_FIELDS:
+            error(m.start(), f"неизвестное поле {m.group(1)}")
+            continue
+        if key in fields:
+            records.append(fields)
+            fields = {}
+        fields[key] = _import_value(key, text, brace, end, error)
+    if fields:
+        records.append(fields)
+    return records, errors
+
+
+def extract_fields_from_text(raw: str) -> dict:
+    """Поля первой библиотеки в тексте импорта."""
+    records, _ = parse_import_text(raw)
+    return records[0] if records else {}
+
+
+def library_from_fields(fields: dict) -> dict:
+    """Объект .dl из полей импорта; недостающие поля заполняются как при импорте одной библиотеки."""
+    kind = fields.get("type") or fields.get("value") or "theme"
+    return {"type": kind, "name": fields.get("name") or "ImportedLib", "creator": fields.get("creator") or "unknown",
+            "value": fields.get("value") or kind, "code": fields.get("code") or {}}
+
+
+def dl_filename(name: str, taken=()) -> str:
+    """Имя файла .dl для библиотеки name, не совпадающее с именами из taken."""
+    base = re.sub(r"[^\w\-. ]", "_", name).strip(" .") or "imported"
+    fname, n = base + ".dl", 1
+    while fname.lower() in taken:
+        n += 1
+        fname = f"{base}_{n}.dl"
+    return fname
+
+
+# UTF-32 проверяется раньше UTF-16: BOM UTF-32 LE начинается с BOM UTF-16 LE
+_BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"),
+         (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+# Буквы cp1251 (А-я, Ё, ё); в русском тексте они идут подряд, в latin-1 — поодиночке внутри ASCII-слов
+_RE_CP1251_RUN = re.compile(rb"[\xa8\xb8\xc0-\xff]{2,}")
+NEWLINE_NAMES = {"\n": "LF", "\r\n": "CRLF", "\r": "CR"}
+
+
+def detect_encoding(data: bytes) -> str:
+    """Кодировка по BOM, иначе по первым LOAD_SNIFF_BYTES байтам: UTF-8, если выборка валидна,
+    затем cp1251 или latin-1 по доле не-ASCII байтов, стоящих в буквенных сериях."""
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return encoding
+    sample = data[:LOAD_SNIFF_BYTES]
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    return fallback_encoding(sample)
+
+
+def fallback_encoding(sample: bytes, failed: str | None = None) -> str:
+    """Однобайтовая кодировка для байтов, не декодируемых как failed: cp1251 или latin-1 по выборке.
+    latin-1 декодирует любые байты и при сохранении возвращает их байт в байт."""
+    if failed in ("cp1251", "latin-1"):
+        return "latin-1"
+    high = len(sample) - len(sample.translate(None, bytes(range(128, 256))))
+    in_runs = sum(len(m) for m in _RE_CP1251_RUN.findall(sample))
+    return "cp1251" if in_runs * 2 >= high else "latin-1"
+
+
+def decode_lossless(raw: bytes, encoding: str) -> tuple[str, str]:
+    """(текст, кодировка): raw в encoding, а если дальше выборки в нём есть чужие байты — в fallback_encoding."""
+    while True:
+        try:
+            return raw.decode(encoding), encoding
+        except UnicodeDecodeError as e:
+            encoding = fallback_encoding(raw[e.start:e.start + LOAD_SNIFF_BYTES], encoding)
+
+
+def detect_newline(text: str) -> str:
+    """Перевод строки по первому встреченному в тексте."""
+    i = text.find("\n")
+    if i < 0:
+        return "\r" if "\r" in text else "\n"
+    return "\r\n" if i and text[i - 1] == "\r" else "\n"
+
+
+def newline_of(newlines) -> str:
+    """Перевод строки файла по TextIOWrapper.newlines (None, строка или кортеж при смешанных)."""
+    if isinstance(newlines, tuple):
+        return "\r\n" if "\r\n" in newlines else newlines[0]
+    return newlines or "\n"
+
+
+def smart_save_dl(obj: dict, dest_path: str) -> bool:
+    try:
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        with open(dest_path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+        return True
+    except Exception:
+        return False
+
+
+# -------------------------
+# Индекс начала строк (смещение в символах <-> индекс Tk "строка.столбец")
+# -------------------------
+class LineIndex:
+    """
+    Хранит длины строк документа (вместе с переводом строки). Начала строк —
+    префиксные суммы, они пересчитываются лениво, только с первой изменённой строки.
+    """
+    def __init__(self, text: str = ""):
+        self.reset(text)
+
+    def reset(self, text: str):
+        self._lengths = [len(line) + 1 for line in text.split("\n")]
+        self._starts = [0] * len(self._lengths)
+        self._valid = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def size(self) -> int:
+        """Длина документа в символах."""
+        self._ensure()
+        return self._starts[-1] + self._lengths[-1] - 1
+
+    def update(self, first: int, old_last: int, new_lines: list[str]):
+        """Строки first..old_last (нумерация Tk, с 1) заменены строками new_lines."""
+        self._lengths[first - 1:old_last] = [len(line) + 1 for line in new_lines]
+        self._valid = min(self._valid, first - 1)
+        if len(self._starts) != len(self._lengths):
+            del self._starts[self._valid:]
+            self._starts.extend([0] * (len(self._lengths) - len(self._starts)))
+
+    def _ensure(self):
+        if self._valid >= len(self._lengths):
+            return
+        v = max(self._valid, 1)
+        self._starts[v - 1:] = accumulate(self._lengths[v - 1:-1], initial=self._starts[v - 1])
+        self._valid = len(self._lengths)
+
+    def offset(self, line: int, col: int = 0) -> int:
+        self._ensure()
+        return self._starts[line - 1] + col
+
+    def offset_of(self, index: str) -> int:
+        line, col = index.split(".")
+        return self.offset(int(line), int(col))
+
+    def index(self, offset: int) -> str:
+        self._ensure()
+        i = bisect_right(self._starts, offset) - 1
+        return f"{i + 1}.{offset - self._starts[i]}"
+
+    def ranges(self, spans) -> list[str]:
+        """Плоский список индексов [start1, end1, start2, end2, ...] для одного tag_add."""
+        self._ensure()
+        starts = self._starts
+        out = []
+        for s, e in spans:
+            i = bisect_right(starts, s) - 1
+            out.append(f"{i + 1}.{s - starts[i]}")
+            i = bisect_right(starts, e, i) - 1
+            out.append(f"{i + 1}.{e - starts[i]}")
+        return out
+
+
+def compile_search(needle: str, match_case=False, regex=False, whole_word=False):
+    """Шаблон поиска по параметрам диалога; при ошибке в выражении — re.error."""
+    source = needle if regex else re.escape(needle)
+    if whole_word:
+        source = rf"(?<!\w)(?:{source})(?!\w)"
+    return re.compile(source, (0 if match_case else re.IGNORECASE) | re.MULTILINE)
+
+
+# Построчный поиск: экранирования, которые не совпадают с переводом строки и не привязаны к началу
+# или концу всего текста (\A, \Z), — \w, \d, \b, \B и экранированная пунктуация
+_RE_NONLOCAL = re.compile(r"\\[^wdbB\W]|\[\^|\(\?[a-zA-Z-]|[\x00-\x1f]")
+
+
+def line_local(needle: str, regex=False) -> bool:
+    """Совпадение не выходит за пределы строки и не зависит от текста вне её: индекс можно обновлять построчно."""
+    if not regex:
+        return "\n" not in needle and "\r" not in needle
+    return not _RE_NONLOCAL.search(needle)
+
+
+def search_text(text: str, pattern, limit: int = FIND_FILES_MAX_HITS) -> list[tuple[int, int, str]]:
+    """Совпадения как (строка с 1, колонка, текст строки); номера строк считаются по ходу прохода."""
+    hits = []
+    line, last = 1, 0
+    for m in pattern.finditer(text):
+        s = m.start()
+        line += text.count("\n", last, s); last = s
+        ls = text.rfind("\n", 0, s) + 1
+        le = text.find("\n", s)
+        hits.append((line, s - ls, text[ls:le if le >= 0 else len(text)].strip()[:200]))
+        if len(hits) >= limit:
+            break
+    return hits
+
+
+def search_files(paths: list[str], pattern, max_size: int = FIND_FILES_MAX_SIZE) -> list[tuple[str, list]]:
+    """Выполняется в процессе пула: ищет pattern в файлах, пропуская двоичные и слишком большие."""
+    out = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read(max_size + 1)
+        except OSError:
+            continue
+        if len(raw) > max_size:
+            continue
+        encoding = detect_encoding(raw)
+        if b"\0" in raw[:8192] and encoding not in ("utf-16", "utf-32"):
+            continue
+        hits = search_text(raw.decode(encoding, errors="replace"), pattern)
+        if hits:
+            out.append((path, hits))
+    return out
+
+
+def iter_search_paths(root: str, include: list[str], exclude: list[str], max_size: int = FIND_FILES_MAX_SIZE):
+    """Файлы под root, подходящие под include (пусто — все) и не попавшие в exclude; каталоги из exclude не обходятся."""
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not any(fnmatch.fnmatch(d, p) for p in exclude)]
+        for name in files:
+            if include and not any(fnmatch.fnmatch(name, p) for p in include):
+                continue
+            if any(fnmatch.fnmatch(name, p) for p in exclude):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                if os.path.getsize(path) > max_size:
+                    continue
+            except OSError:
+                continue
+            yield path
+
+
+class FileSearch(threading.Thread):
+    """
+    Обходит каталог и раздаёт пакеты по FIND_FILES_BATCH путей пулу процессов.
+    Готовые результаты [(path, hits), ...] складываются в results по мере поступления; None — конец.
+    """
+    def __init__(self, pool, root: str, pattern, include: list[str], exclude: list[str], skip: set[str]):
+        super().__init__(daemon=True)
+        self.pool = pool
+        self.root = root
+        self.pattern = pattern
+        self.include = include
+        self.exclude = exclude
+        self.skip = skip
+        self.results: queue.Queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.scanned = 0
+        self.error: Exception | None = None
+
+    def _collect(self, futures: set, block: bool) -> set:
+        import concurrent.futures
+        done, pending = concurrent.futures.wait(futures, timeout=None if block else 0,
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+        for fut in done:
+            if not fut.cancelled():
+                self.results.put(fut.result())
+        return pending
+
+    def _submit(self, futures: set, batch: list[str]) -> bool:
+        """Отдаёт пакет пулу; False — поиск остановлен (диалог мог уже закрыть пул, submit тогда бросает RuntimeError)."""
+        if self.cancelled.is_set():
+            return False
+        try:
+            futures.add(self.pool.submit(search_files, batch, self.pattern))
+        except RuntimeError:
+            if self.cancelled.is_set():
+                return False
+            raise
+        return True
+
+    def run(self):
+        futures = set()
+        # Не держим в пуле больше заданий, чем нужно для загрузки всех процессов
+        limit = 4 * (os.cpu_count() or 2)
+        try:
+            batch = []
+            for path in iter_search_paths(self.root, self.include, self.exclude):
+                if self.cancelled.is_set():
+                    break
+                if os.path.normcase(os.path.abspath(path)) in self.skip:
+                    continue
+                batch.append(path); self.scanned += 1
+                if len(batch) >= FIND_FILES_BATCH:
+                    if not self._submit(futures, batch):
+                        break
+                    batch = []
+                    futures = self._collect(futures, block=len(futures) >= limit)
+            if batch:
+                self._submit(futures, batch)
+            while futures and not self.cancelled.is_set():
+                futures = self._collect(futures, block=True)
+        except Exception as e:
+            self.error = e
+        finally:
+            for fut in futures:
+                fut.cancel()
+            self.results.put(None)
+
+
+def plan_replacements(content: str, pattern, repl, max_blocks: int = REPLACE_MAX_BLOCKS):
+    """
+    Один проход pattern.finditer по content. Совпадения группируются в блоки целых строк:
+    возвращает ([(start, end, new_text), ...], число совпадений), блоки по возрастанию смещений.
+    repl(m) — строка замены для совпадения. Если блоков больше max_blocks, они сливаются в один.
+    """
+    blocks = []
+    start = end = cursor = 0
+    parts = None
+    count = 0
+    for m in pattern.finditer(content):
+        s, e = m.span()
+        if parts is None or s > end:
+            if parts is not None:
+                parts.append(content[cursor:end]); blocks.append((start, end, "".join(parts)))
+            start = cursor = content.rfind("\n", 0, s) + 1
+            parts = []
+        parts.append(content[cursor:s]); parts.append(repl(m))
+        cursor = e
+        end = content.find("\n", e)
+        if end < 0:
+            end = len(content)
+        count += 1
+    if parts is not None:
+        parts.append(content[cursor:end]); blocks.append((start, end, "".join(parts)))
+    if len(blocks) > max_blocks:
+        merged = [blocks[0][2]]
+        for (_, prev_end, _), (s, _, text) in zip(blocks, blocks[1:]):
+            merged.append(content[prev_end:s]); merged.append(text)
+        blocks = [(blocks[0][0], blocks[-1][1], "".join(merged))]
+    return blocks, count
+
+
+# -------------------------
+# Документ огромного файла: таблица кусков поверх mmap
+# -------------------------
+class PieceTable:
+    """
+    Исходный файл отображается в память (mmap) и не копируется; правки дописываются
+    в буфер добавлений. Документ — последовательность кусков [буфер, начало, конец,
+    число переводов строк] в байтах исходной кодировки (ASCII-совместимой: '\\n' — один байт).
+    Наружу отдаются и принимаются целые строки, уже декодированные и с '\\n'.
+    BOM (encoding "utf-8-sig") в документ не входит: куски начинаются после него, запись добавляет его снова.
+    """
+    ORIG, ADD = 0, 1
+    BLOCK = 1 << 16
+
+    def __init__(self, path: str, encoding: str = "utf-8", newline: str = "\n"):
+        self.encoding = encoding
+        self.newline = newline
+        # Куски кодируются без BOM: "utf-8-sig" добавлял бы его к каждой строке
+        self._codec = "utf-8" if encoding == "utf-8-sig" else encoding
+        self._bom = codecs.BOM_UTF8 if encoding == "utf-8-sig" else b""
+        self._nl = newline.encode(self._codec)
+        # Заменённые строки содержали байты не в encoding: сохранение записало бы вместо них U+FFFD
+        self.lossy = False
+        self._open(path)
+
+    def _open(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._orig = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._add = bytearray()
+        # Число '\n' в исходнике до начала каждого блока BLOCK байт
+        self._block_nl = array("q", [0])
+        for p in range(0, size, self.BLOCK):
+            self._block_nl.append(self._block_nl[-1] + self._orig[p:p + self.BLOCK].count(b"\n"))
+        head = len(self._bom) if self._bom and self._orig[:len(self._bom)] == self._bom else 0
+        self._pieces = [[self.ORIG, head, size, self._block_nl[-1]]] if size > head else []
+
+    def close(self):
+        if isinstance(self._orig, mmap.mmap):
+            self._orig.close()
+        self._file.close()
+
+    def _buf(self, which: int):
+        return self._orig if which == self.ORIG else self._add
+
+    def _count_nl(self, which: int, start: int, end: int) -> int:
+        if which == self.ADD:
+            return self._add.count(b"\n", start, end)
+        return self._orig_nl_before(end) - self._orig_nl_before(start)
+
+    def _orig_nl_before(self, pos: int) -> int:
+        block = pos // self.BLOCK
+        return self._block_nl[block] + self._orig[block * self.BLOCK:pos].count(b"\n")
+
+    def _after_nth_nl(self, which: int, start: int, n: int) -> int:
+        """Позиция сразу после n-го (с 1) перевода строки, считая от start."""
+        buf = self._buf(which)
+        pos = start
+        if which == self.ORIG:
+            target = self._orig_nl_before(start) + n
+            block = bisect_left(self._block_nl, target) - 1
+            if block * self.BLOCK > start:
+                pos = block * self.BLOCK
+                n = target - self._block_nl[block]
+        for _ in range(n):
+            pos = buf.find(b"\n", pos) + 1
+        return pos
+
+    def __len__(self) -> int:
+        return sum(p[2] - p[1] for p in self._pieces)
+
+    def line_count(self) -> int:
+        return sum(p[3] for p in self._pieces) + 1
+
+    def line_start(self, line: int) -> int:
+        """Байтовое смещение начала строки line (с нуля); для line == line_count() — конец документа."""
+        if line <= 0:
+            return 0
+        pos = 0
+        for which, start, end, nl in self._pieces:
+            if line <= nl:
+                return pos + self._after_nth_nl(which, start, line) - start
+            line -= nl
+            pos += end - start
+        return pos
+
+    def _split(self, pos: int) -> int:
+        """Разрезает кусок на позиции pos; возвращает индекс куска, который начинается в pos."""
+        at = 0
+        for i, (which, start, end, nl) in enumerate(self._pieces):
+            if pos == at:
+                return i
+            if pos < at + end - start:
+                mid = start + pos - at
+                left = self._count_nl(which, start, mid)
+                self._pieces[i:i + 1] = [[which, start, mid, left], [which, mid, end, nl - left]]
+                return i + 1
+            at += end - start
+        return len(self._pieces)
+
+    def _read(self, a: int, b: int) -> bytes:
+        out = []
+        at = 0
+        for which, start, end, _ in self._pieces:
+            n = end - start
+            if at + n > a and at < b:
+                s = start + max(a - at, 0)
+                e = start + min(b - at, n)
+                out.append(self._buf(which)[s:e])
+            at += n
+            if at >= b:
+                break
+        return b"".join(out)
+
+    def _line_span(self, first: int, last: int) -> tuple[int, int, bool]:
+        """Байты строк first..last-1; третий элемент — входит ли в диапазон перевод строки после last-1."""
+        total = self.line_count()
+        a = self.line_start(first)
+        if last < total:
+            return a, self.line_start(last), True
+        return a, len(self), False
+
+    def get_lines(self, first: int, last: int) -> str:
+        """Текст строк first..last-1 через '\\n', без завершающего перевода строки."""
+        a, b, with_nl = self._line_span(first, last)
+        data = self._read(a, b)
+        if with_nl:
+            data = data[:-len(self._nl)]
+        text = data.decode(self._codec, errors="replace")
+        return text.replace(self.newline, "\n") if self.newline != "\n" else text
+
+    def replace_lines(self, first: int, last: int, text: str):
+        """Заменяет строки first..last-1 строками из text (через '\\n')."""
+        a, b, with_nl = self._line_span(first, last)
+        if not self.lossy:
+            try:
+                self._read(a, b).decode(self._codec)
+            except UnicodeDecodeError:
+                self.lossy = True
+        if self.newline != "\n":
+            text = text.replace("\n", self.newline)
+        data = text.encode(self._codec, errors="replace") + (self._nl if with_nl else b"")
+        i = self._split(a)
+        j = self._split(b)
+        del self._pieces[i:j]
+        if data:
+            start = len(self._add)
+            self._add += data
+            self._pieces.insert(i, [self.ADD, start, len(self._add), data.count(b"\n")])
+
+    def pieces(self) -> list[tuple]:
+        """Снимок документа для записи в другом потоке: куски не меняются, буфер добавлений только растёт."""
+        return [tuple(p) for p in self._pieces]
+
+    def iter_chunks(self, size: int = 1 << 20, pieces: list | None = None):
+        """Байты документа (или снимка pieces) порциями — для записи на диск без сборки всего текста в памяти."""
+        for which, start, end, _ in pieces if pieces is not None else list(self._pieces):
+            buf = self._buf(which)
+            for p in range(start, end, size):
+                yield buf[p:min(p + size, end)]
+
+    def write_to(self, tmp: str, pieces: list | None = None, progress=None):
+        """Пишет документ в tmp с fsync (с BOM, если он был в файле); progress(n) вызывается после каждой порции в n байт."""
+        try:
+            with open(tmp, "wb") as out:
+                out.write(self._bom)
+                for chunk in self.iter_chunks(pieces=pieces):
+                    out.write(chunk)
+                    if progress:
+                        progress(len(chunk))
+                out.flush()
+                os.fsync(out.fileno())
+        except Exception:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+
+    def save(self, path: str):
+        """Пишет документ во временный файл рядом и подменяет им path; затем открывает path заново."""
+        tmp = os.path.realpath(path) + ".fpc-tmp"
+        self.write_to(tmp)
+        self.replace_with(tmp, path)
+
+    def replace_with(self, tmp: str, path: str):
+        """Подменяет path записанным tmp и открывает документ заново из path.
+        Если path — символическая ссылка, подменяется файл, на который она указывает, а ссылка остаётся."""
+        # На Windows нельзя заменить файл, пока он отображён в память
+        self.close()
+        try:
+            os.replace(tmp, os.path.realpath(path))
+        except Exception:
+            # Текст с правками уже целиком во временном файле — продолжаем работать с ним
+            self._open(tmp)
+            raise
+        self._open(path)
+
+
+class SaveJob(threading.Thread):
+    """Атомарная запись снимка текста: временный файл рядом с path, fsync, затем os.replace.
+    Символическая ссылка не подменяется: запись идёт в файл, на который она указывает.
+
+    chunks снимаются в потоке Tk; здесь они только кодируются и пишутся."""
+
+    def __init__(self, path: str, chunks: list[str], encoding: str = "utf-8", newline: str = "\n"):
+        super().__init__(daemon=True)
+        self.path = path
+        self.chunks = chunks
+        self.encoding = encoding
+        self.newline = newline
+        self.total = len(chunks)
+        self.done = 0
+        self.error: Exception | None = None
+
+    def run(self):
+        import tempfile
+        tmp = None
+        target = os.path.realpath(self.path)
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".fpc-", suffix=".tmp", dir=os.path.dirname(target))
+            with open(fd, "w", encoding=self.encoding, newline=self.newline) as f:
+                for chunk in self.chunks:
+                    f.write(chunk)
+                    self.done += 1
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp создаёт файл с правами 0600 — сохраняем права исходного файла
+            try: mode = stat.S_IMODE(os.stat(target).st_mode)
+            except OSError: mode = 0o644
+            os.chmod(tmp, mode)
+            os.replace(tmp, target)
+        except Exception as e:
+            self.error = e
+            if tmp:
+                try: os.remove(tmp)
+                except OSError: pass
+        finally:
+            self.chunks = None
+
+
+class DocSaveJob(threading.Thread):
+    """Фоновая запись огромного документа (PieceTable): снимок кусков пишется во временный файл рядом с path.
+
+    Подмена файла и новое отображение в память — commit() в потоке Tk после завершения потока;
+    до этого документ читается из прежнего mmap и не должен меняться."""
+
+    def __init__(self, doc: PieceTable, path: str):
+        super().__init__(daemon=True)
+        self.doc = doc
+        self.path = path
+        # Временный файл — рядом с целью ссылки: os.replace работает только в пределах одного тома
+        self.tmp = os.path.realpath(path) + ".fpc-tmp"
+        self.pieces = doc.pieces()
+        self.total = sum(end - start for _, start, end, _ in self.pieces)
+        self.done = 0
+        self.error: Exception | None = None
+        self.committed = False
+
+    def run(self):
+        try:
+            self.doc.write_to(self.tmp, self.pieces, self._progress)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.pieces = None
+
+    def _progress(self, n: int):
+        self.done += n
+
+    def commit(self):
+        """Подменяет файл записанным; повторный вызов и вызов после ошибки ничего не делают."""
+        if self.committed or self.error:
+            return
+        self.committed = True
+        try:
+            self.doc.replace_with(self.tmp, self.path)
+        except Exception as e:
+            self.error = e
+
+
+# -------------------------
+# Библиотеки .dl
+# -------------------------
+def read_dl(path: str) -> dict | None:
+    """Содержимое .dl или None, если в нём нет обязательных полей."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    if not isinstance(raw, dict) or not all(k in raw for k in DL_FIELDS):
+        return None
+    return raw
+
+
+def parse_chord(combo: str) -> tuple[str, ...] | None:
+    """"Ctrl+K Ctrl+C" -> ("Control-k", "Control-c"); удары разделяются пробелами, "Ctrl+," и "Ctrl++" — один удар."""
+    if not combo:
+        return None
+    strokes = []
+    for part in re.sub(r"\s*\+\s*", "+", combo.strip()).split():
+        mods, key = set(), None
+        if part == "+" or part.endswith("++"):
+            part, key = part[:-1], "plus"
+        for p in (p for p in part.split("+") if p):
+            if p.lower() in MOD_NAMES:
+                mods.add(MOD_NAMES[p.lower()])
+            else:
+                key = KEY_NAMES.get(p, p.lower())
+        if not key:
+            return None
+        strokes.append("-".join([m for m, _ in MOD_BITS if m in mods] + [key]))
+    return tuple(strokes) or None
+
+
+def dl_themes(name: str, code) -> dict:
+    """Темы, которые библиотека-тема добавляет в THEMES: одна тема или по ветке на каждый вариант."""
+    if isinstance(code, dict) and not {"background", "foreground", "cursor"}.issubset(code.keys()):
+        return {f"{name} - {branch}": val for branch, val in code.items()}
+    return {name: code}
+
+
+def dl_registration(raw: dict) -> dict:
+    """
+    То, что нужно для регистрации библиотеки без разбора тела code:
+    theme — {"themes": [имена]}, bind — {"combo", "keys": [удары]}, tabs — {"titles": [...]}.
+    """
+    code = raw.get("code")
+    kind = raw.get("type")
+    if kind == "theme":
+        return {"themes": list(dl_themes(raw.get("name"), code))}
+    if kind == "bind":
+        code = code or {}
+        if not isinstance(code, dict) or code.get("action") != "insert":
+            return {}
+        keys = parse_chord(code.get("combo"))
+        if not keys:
+            return {}
+        return {"combo": code.get("combo"), "keys": list(keys)}
+    if kind == "tabs":
+        tabs = code.get("tabs") if isinstance(code, dict) else None
+        if isinstance(tabs, list):
+            return {"titles": [t.get("title", "Без названия") if isinstance(t, dict) else "Без названия" for t in tabs]}
+    return {}
+
+
+class DataLibrary:
+    """
+    Библиотека из индекса: в памяти только заголовок и данные регистрации.
+    Тело code читается из файла при каждом обращении и не хранится.
+    """
+    def __init__(self, path: str, header: dict, reg: dict | None = None):
+        self.path = path
+        self.type = header.get("type")
+        self.name = header.get("name")
+        self.creator = header.get("creator")
+        self.value = header.get("value")
+        self.reg = reg or {}
+
+    @property
+    def code(self):
+        raw = read_dl(self.path) or {}
+        return raw.get("code")
+
+
+def dl_index_entry(path: str, cached: dict | None = None) -> dict | None:
+    """Запись индекса для файла .dl; файл разбирается, только если mtime или размер не совпали с cached."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = [st.st_mtime_ns, st.st_size]
+    if cached and cached.get("key") == key:
+        return cached
+    try:
+        raw = read_dl(path)
+    except Exception:
+        traceback.print_exc()
+        raw = None
+    # Неподходящие файлы тоже запоминаем, чтобы не разбирать их при каждом запуске
+    if raw is None:
+        return {"key": key, "header": None, "reg": {}}
+    return {"key": key, "header": {k: raw[k] for k in DL_HEADER_FIELDS}, "reg": dl_registration(raw)}
+
+
+def scan_libs(libs_dir: str, cached: dict | None = None) -> dict[str, dict]:
+    """Индекс папки библиотек в порядке имён файлов: имя файла -> запись dl_index_entry."""
+    cached = cached or {}
+    index = {}
+    for fname in sorted(os.listdir(libs_dir)):
+        if not fname.lower().endswith(".dl"):
+            continue
+        entry = dl_index_entry(os.path.join(libs_dir, fname), cached.get(fname))
+        if entry is not None:
+            index[fname] = entry
+    return index
+
+
+def read_libs_index(libs_dir: str) -> dict:
+    try:
+        with open(os.path.join(libs_dir, PLUGIN_INDEX_FILE), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == PLUGIN_INDEX_VERSION and isinstance(data.get("entries"), dict):
+            return data["entries"]
+    except Exception:
+        pass
+    return {}
+
+
+def write_libs_index(libs_dir: str, index: dict):
+    path = os.path.join(libs_dir, PLUGIN_INDEX_FILE)
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": PLUGIN_INDEX_VERSION, "entries": index}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception:
+        traceback.print_exc()
+
+
+# -------------------------
+# Пакеты библиотек .dlpack
+# -------------------------
+# Файлы пакета лежат в корне архива: без папок, только имена .dl
+_RE_DLPACK_FILE = re.compile(r"[\w\-. ]+\.dl", re.IGNORECASE)
+_RE_SHA256 = re.compile(r"[0-9a-f]{64}")
+
+
+class DlPackError(ValueError):
+    """Пакет .dlpack повреждён или не соответствует своему манифесту."""
+
+
+def _sha256(data: bytes) -> str:
+    import hashlib
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_sha256(path: str) -> str | None:
+    try:
+        with open(path, "rb") as f:
+            return _sha256(f.read())
+    except OSError:
+        return None
+
+
+def _dl_from_bytes(data: bytes, where: str) -> dict:
+    try:
+        raw = json.loads(data.decode("utf-8"))
+    except ValueError as e:
+        raise DlPackError(f"{where}: не разобран как JSON ({e})") from None
+    if not isinstance(raw, dict) or not all(k in raw for k in DL_FIELDS):
+        raise DlPackError(f"{where}: нет обязательных полей {', '.join(DL_FIELDS)}")
+    return raw
+
+
+def check_dlpack_manifest(manifest, members) -> dict:
+    """Проверяет манифест: формат, имя пакета, допустимые и не повторяющиеся имена файлов, их наличие в архиве, sha256."""
+    if not isinstance(manifest, dict) or manifest.get("format") != DLPACK_FORMAT:
+        raise DlPackError(f"неподдерживаемый формат пакета (ожидается format: {DLPACK_FORMAT})")
+    if not isinstance(manifest.get("name"), str) or not manifest["name"]:
+        raise DlPackError("в манифесте нет имени пакета")
+    libraries = manifest.get("libraries")
+    if not isinstance(libraries, list) or not libraries:
+        raise DlPackError("в манифесте нет списка libraries")
+    members, seen = set(members), set()
+    for i, entry in enumerate(libraries):
+        fname = entry.get("file") if isinstance(entry, dict) else None
+        if not isinstance(fname, str) or not _RE_DLPACK_FILE.fullmatch(fname):
+            raise DlPackError(f"libraries[{i}]: недопустимое имя файла {fname!r}")
+        if fname.lower() in seen:
+            raise DlPackError(f"libraries[{i}]: файл {fname} указан дважды")
+        if fname not in members:
+            raise DlPackError(f"libraries[{i}]: файла {fname} нет в архиве")
+        if not _RE_SHA256.fullmatch(str(entry.get("sha256", "")).lower()):
+            raise DlPackError(f"libraries[{i}]: нет sha256 файла {fname}")
+        seen.add(fname.lower())
+    return manifest
+
+
+class DlPack:
+    """
+    Пакет .dlpack, открытый на чтение. Манифест проверяется при открытии; библиотеки читаются
+    прямо из архива по запросу, с проверкой sha256 и заголовка, без распаковки на диск.
+    """
+    def __init__(self, path: str):
+        import zipfile
+        self.path = path
+        try:
+            self._zip = zipfile.ZipFile(path)
+        except (OSError, zipfile.BadZipFile) as e:
+            raise DlPackError(f"не удалось открыть архив: {e}") from None
+        try:
+            try:
+                manifest = json.loads(self._zip.read(DLPACK_MANIFEST).decode("utf-8"))
+            except KeyError:
+                raise DlPackError(f"в архиве нет {DLPACK_MANIFEST}") from None
+            except ValueError as e:
+                raise DlPackError(f"{DLPACK_MANIFEST}: {e}") from None
+            self.manifest = check_dlpack_manifest(manifest, self._zip.namelist())
+        except BaseException:
+            self._zip.close()
+            raise
+        self.name = manifest["name"]
+        self.version = str(manifest.get("version", ""))
+        self.entries: list[dict] = manifest["libraries"]
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def entry(self, fname: str) -> dict | None:
+        return next((e for e in self.entries if e["file"] == fname), None)
+
+    def read(self, entry: dict) -> bytes:
+        """Байты файла entry из архива; DlPackError, если они не совпадают с манифестом."""
+        fname = entry["file"]
+        try:
+            data = self._zip.read(fname)
+        except Exception as e:
+            raise DlPackError(f"{fname}: {e}") from None
+        if _sha256(data) != entry["sha256"].lower():
+            raise DlPackError(f"{fname}: контрольная сумма не совпадает с манифестом")
+        raw = _dl_from_bytes(data, fname)
+        for key in ("name", "type"):
+            if key in entry and entry[key] != raw[key]:
+                raise DlPackError(f"{fname}: {key} в манифесте ({entry[key]}) не совпадает с файлом ({raw[key]})")
+        return data
+
+    def library(self, fname: str) -> dict:
+        """Содержимое .dl из пакета, как read_dl для файла в libs/."""
+        entry = self.entry(fname)
+        if entry is None:
+            raise DlPackError(f"в пакете нет {fname}")
+        return json.loads(self.read(entry).decode("utf-8"))
+
+
+def read_dlpack_state(libs_dir: str) -> dict:
+    """Установленные пакеты: имя пакета -> {"version", "files": {имя файла: {"name", "version", "sha256"}}}."""
+    try:
+        with open(os.path.join(libs_dir, DLPACK_STATE_FILE), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return data
+    except Exception:
+        pass
+    return {}
+
+
+def write_dlpack_state(libs_dir: str, state: dict):
+    path = os.path.join(libs_dir, DLPACK_STATE_FILE)
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+    except Exception:
+        traceback.print_exc()
+
+
+def plan_dlpack_install(pack: DlPack, libs_dir: str) -> list[dict]:
+    """
+    Шаги установки пакета в libs_dir: new, update или same (файл уже совпадает по sha256) для каждого
+    файла пакета и remove для файлов прошлой установленной версии, которых в новой нет.
+    Такой файл, изменённый после установки (sha256 на диске не совпадает с записанным), не удаляется — шаг keep.
+    """
+    installed = read_dlpack_state(libs_dir).get(pack.name, {}).get("files", {})
+    plan = []
+    for entry in pack.entries:
+        fname = entry["file"]
+        current = _file_sha256(os.path.join(libs_dir, fname))
+        action = "new" if current is None else "same" if current == entry["sha256"].lower() else "update"
+        plan.append({"action": action, "file": fname, "name": entry.get("name", fname),
+                     "version": str(entry.get("version", pack.version)), "installed": installed.get(fname, {}).get("version")})
+    keep = {e["file"].lower() for e in pack.entries}
+    for fname, info in installed.items():
+        if fname.lower() in keep:
+            continue
+        current = _file_sha256(os.path.join(libs_dir, fname))
+        if current is None:
+            continue
+        action = "remove" if current == str(info.get("sha256", "")).lower() else "keep"
+        plan.append({"action": action, "file": fname, "name": info.get("name", fname),
+                     "version": None, "installed": info.get("version")})
+    return plan
+
+
+def install_dlpack(pack: DlPack, libs_dir: str, plan: list[dict]) -> tuple[list[str], list[str]]:
+    """
+    Устанавливает пакет по плану целиком или никак: файлы читаются из архива, проверяются и пишутся
+    рядом как *.fpc-tmp, затем подменяются переименованием; при ошибке прежние файлы возвращаются.
+    Возвращает (пути новых и обновлённых файлов, имена удалённых).
+    """
+    staged = []
+    try:
+        for step in plan:
+            if step["action"] in ("new", "update"):
+                path = os.path.join(libs_dir, step["file"])
+                data = pack.read(pack.entry(step["file"]))
+                with open(path + ".fpc-tmp", "wb") as f:
+                    f.write(data)
+                staged.append(path)
+    except BaseException:
+        for path in staged:
+            try: os.remove(path + ".fpc-tmp")
+            except OSError: pass
+        raise
+    removed = [step["file"] for step in plan if step["action"] == "remove"]
+    # (путь, копия прежнего файла или None) — для отката
+    moved = []
+    try:
+        for path in staged + [os.path.join(libs_dir, fname) for fname in removed]:
+            backup = None
+            if os.path.exists(path):
+                backup = path + ".fpc-bak"
+                os.replace(path, backup)
+            moved.append((path, backup))
+            if os.path.exists(path + ".fpc-tmp"):
+                os.replace(path + ".fpc-tmp", path)
+    except BaseException:
+        for path, backup in reversed(moved):
+            try:
+                if backup:
+                    os.replace(backup, path)
+                else:
+                    os.remove(path)
+            except OSError:
+                traceback.print_exc()
+        for path in staged:
+            try: os.remove(path + ".fpc-tmp")
+            except OSError: pass
+        raise
+    for _, backup in moved:
+        if backup:
+            try: os.remove(backup)
+            except OSError: pass
+    state = read_dlpack_state(libs_dir)
+    state[pack.name] = {"version": pack.version, "source": os.path.basename(pack.path),
+                        "files": {e["file"]: {"name": e.get("name", e["file"]), "version": str(e.get("version", pack.version)),
+                                              "sha256": e["sha256"].lower()} for e in pack.entries}}
+    write_dlpack_state(libs_dir, state)
+    return staged, removed
+
+
+def write_dlpack(dst: str, paths: list[str], name: str, version: str = "1") -> dict:
+    """Собирает пакет dst из файлов .dl: проверяет их, считает sha256 и пишет манифест. Возвращает манифест."""
+    import zipfile
+    libraries, files = [], []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        fname = os.path.basename(path)
+        raw = _dl_from_bytes(data, fname)
+        libraries.append({"file": fname, "name": raw["name"], "type": raw["type"],
+                          "version": str(raw.get("version", version)), "sha256": _sha256(data)})
+        files.append((fname, data))
+    manifest = check_dlpack_manifest({"format": DLPACK_FORMAT, "name": name, "version": version, "libraries": libraries},
+                                     [fname for fname, _ in files])
+    tmp = dst + ".fpc-tmp"
+    try:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(DLPACK_MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2))
+            for fname, data in files:
+                zf.writestr(fname, data)
+        os.replace(tmp, dst)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+    return manifest
+
+
+def pack_main(argv: list[str]) -> int:
+    """python FPC.py pack -o ПАКЕТ.dlpack --name ИМЯ [--version В] файлы.dl/папки..."""
+    import argparse
+    parser = argparse.ArgumentParser(prog="FPC.py pack", description="Сборка пакета библиотек .dlpack с манифестом")
+    parser.add_argument("paths", nargs="+", help="файлы .dl и папки с ними")
+    parser.add_argument("-o", "--output", required=True, help="файл пакета (.dlpack)")
+    parser.add_argument("--name", required=True, help="имя пакета: по нему находится прошлая версия при обновлении")
+    parser.add_argument("--version", default="1", help="версия пакета (и библиотек без своего поля version)")
+    args = parser.parse_args(argv)
+
+    paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            paths += [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.lower().endswith(".dl")]
+        else:
+            paths.append(path)
+    try:
+        manifest = write_dlpack(args.output, paths, args.name, args.version)
+    except (OSError, DlPackError) as e:
+        print(f"Пакет не собран: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.output}: {args.name} {args.version}, библиотек: {len(manifest['libraries'])}", file=sys.stderr)
+    return 0
+
+
+# -------------------------
+# Экспорт в HTML (python FPC.py export ...)
+# -------------------------
+# Экспорт пишет HTML порциями по EXPORT_FLUSH_CHARS символов; в папках берёт файлы по маскам EXPORT_INCLUDE
+EXPORT_FLUSH_CHARS = 64 * 1024
+EXPORT_INCLUDE = "*.py"
+_CSS_PROPS = {"foreground": "color", "background": "background-color"}
+
+
+def find_theme(name: str, libs_dir: str | None = None) -> dict | None:
+    """Тема по имени: из THEMES или из библиотеки-темы в libs_dir (через индекс, без разбора остальных)."""
+    if name in THEMES:
+        return THEMES[name]
+    if not libs_dir or not os.path.isdir(libs_dir):
+        return None
+    for fname, entry in scan_libs(libs_dir, read_libs_index(libs_dir)).items():
+        header = entry["header"]
+        if header and header.get("type") == "theme" and name in entry["reg"].get("themes", []):
+            raw = read_dl(os.path.join(libs_dir, fname)) or {}
+            return dl_themes(header.get("name"), raw.get("code")).get(name)
+    return None
+
+
+def theme_names(libs_dir: str | None = None) -> list[str]:
+    names = list(THEMES)
+    if libs_dir and os.path.isdir(libs_dir):
+        for entry in scan_libs(libs_dir, read_libs_index(libs_dir)).values():
+            if entry["header"] and entry["header"].get("type") == "theme":
+                names += [n for n in entry["reg"].get("themes", []) if n not in names]
+    return names
+
+
+def theme_css(theme: dict) -> str:
+    """CSS страницы экспорта: фон и цвет текста темы, по классу на тег подсветки."""
+    rules = [f"body{{margin:0;background:{theme.get('background', '#ffffff')};color:{theme.get('foreground', '#000000')}}}",
+             "pre{margin:0;padding:8px;font-family:Consolas,'Courier New',monospace;font-size:12pt}"]
+    for tag, attrs in (theme.get("tag") or {}).items():
+        props = ";".join(f"{_CSS_PROPS[k]}:{v}" for k, v in attrs.items() if k in _CSS_PROPS)
+        if props:
+            rules.append(f".{tag}{{{props}}}")
+    return "\n".join(rules)
+
+
+def highlight_html_lines(lines, syntax: str | None = "python"):
+    """Поток строк HTML: каждая входная строка (без перевода строки) — с <span class="тег"> вокруг токенов."""
+    import html
+    escape = html.escape
+    state = None
+    for line in lines:
+        if syntax != "python":
+            yield escape(line, quote=False)
+            continue
+        tokens, state = tokenize_line(line, state)
+        parts, pos = [], 0
+        for tag, s, e in tokens:
+            if s > pos:
+                parts.append(escape(line[pos:s], quote=False))
+            parts.append(f'<span class="{tag}">{escape(line[s:e], quote=False)}</span>')
+            pos = e
+        parts.append(escape(line[pos:], quote=False))
+        yield "".join(parts)
+
+
+def export_html(src: str, dst: str, theme: dict) -> int:
+    """
+    Пишет подсвеченный src в dst построчно: ни исходный текст, ни HTML целиком в памяти не держатся.
+    Запись идёт во временный файл рядом с dst и заменяет его в конце. Возвращает число строк.
+    """
+    import html
+    with open(src, "rb") as f:
+        encoding = detect_encoding(f.read(LOAD_SNIFF_BYTES))
+    syntax = "python" if src.endswith(".py") else None
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    tmp = dst + ".fpc-tmp"
+    count = 0
+    try:
+        with open(src, "r", encoding=encoding, errors="replace") as inp, \
+                open(tmp, "w", encoding="utf-8", newline="\n") as out:
+            out.write(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(os.path.basename(src))}</title>\n'
+                      f"<style>\n{theme_css(theme)}\n</style></head><body><pre>")
+            buf, size = [], 0
+            for line in highlight_html_lines((line.rstrip("\n") for line in inp), syntax):
+                buf.append(line); size += len(line) + 1
+                count += 1
+                if size >= EXPORT_FLUSH_CHARS:
+                    out.write("\n".join(buf) + "\n"); buf, size = [], 0
+            out.write("\n".join(buf))
+            out.write("</pre></body></html>\n")
+        os.replace(tmp, dst)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+    return count
+
+
+def export_task(task) -> tuple[str, int | None, str | None]:
+    """Задание пула: (src, dst, theme) -> (src, число строк или None, текст ошибки)."""
+    src, dst, theme = task
+    try:
+        return src, export_html(src, dst, theme), None
+    except Exception as e:
+        return src, None, f"{type(e).__name__}: {e}"
+
+
+def export_targets(paths: list[str], output: str | None, include: list[str]):
+    """(src, dst) для всех файлов: файлы как есть, каталоги — рекурсивно по include без FIND_FILES_EXCLUDE.
+    Несуществующие пути пропускаются — export_main сообщает о них и считает ошибками заранее."""
+    exclude = [p for p in FIND_FILES_EXCLUDE.split(";") if p]
+    for path in paths:
+        if os.path.isdir(path):
+            for src in iter_search_paths(path, include, exclude, max_size=sys.maxsize):
+                rel = os.path.relpath(src, path)
+                yield src, os.path.join(output, os.path.basename(os.path.abspath(path)), rel) + ".html" if output else src + ".html"
+        elif os.path.isfile(path):
+            yield path, os.path.join(output, os.path.basename(path)) + ".html" if output else path + ".html"
+
+
+def export_main(argv: list[str], libs_dir: str | None = None) -> int:
+    """python FPC.py export [--theme ИМЯ] [--jobs N] [-o ПАПКА] файлы/папки..."""
+    import argparse
+    parser = argparse.ArgumentParser(prog="FPC.py export", description="Экспорт файлов в HTML с подсветкой без окна редактора")
+    parser.add_argument("paths", nargs="+", help="файлы и папки (папки обходятся рекурсивно)")
+    parser.add_argument("--theme", default=next(iter(THEMES)), help="тема из THEMES или из библиотек .dl")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1, help="процессов (1 — без пула)")
+    parser.add_argument("-o", "--output", help="папка для HTML (по умолчанию рядом с исходником, имя + .html)")
+    parser.add_argument("--include", default=EXPORT_INCLUDE, help="маски файлов в папках через ';' (пусто — все)")
+    parser.add_argument("--libs", default=libs_dir, help="папка библиотек .dl с темами")
+    args = parser.parse_args(argv)
+
+    theme = find_theme(args.theme, args.libs)
+    if not isinstance(theme, dict):
+        print(f"Тема '{args.theme}' не найдена. Доступны: {', '.join(theme_names(args.libs))}", file=sys.stderr)
+        return 2
+    include = [p for p in args.include.split(";") if p]
+    done = failed = 0
+    for path in args.paths:
+        if not os.path.isdir(path) and not os.path.isfile(path):
+            failed += 1
+            print(f"Нет такого файла или папки: {path}", file=sys.stderr)
+    tasks = ((src, dst, theme) for src, dst in export_targets(args.paths, args.output, include))
+    if args.jobs <= 1:
+        results = map(export_task, tasks)
+        pool = None
+    else:
+        import concurrent.futures
+        from fpc_worker import spawn_context
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, mp_context=spawn_context())
+        results = pool.map(export_task, tasks, chunksize=4)
+    try:
+        for src, lines, error in results:
+            if error:
+                failed += 1
+                print(f"{src}: {error}", file=sys.stderr)
+            else:
+                done += 1
+    finally:
+        if pool:
+            # Закрытый итератор map отменяет ещё не начатые задачи (cancel_futures есть только с Python 3.9)
+            results.close()
+            pool.shutdown()
+    print(f"Экспортировано файлов: {done}, с ошибками: {failed}", file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,42 @@
+"""
+Процессы пулов поиска в файлах и экспорта. Метод spawn заново выполняет в каждом процессе главный
+модуль, а главный модуль редактора — FPC.py с tkinter. Процессы из spawn_context() вместо него
+выполняют этот модуль: ему нужно только fpc_core, задачи пула (search_files, export_task) — оттуда же.
+"""
+from __future__ import annotations
+import importlib.util
+import multiprocessing.context
+import sys
+import threading
+
+from fpc_core import search_files, export_task  # noqa: F401  точки входа задач пула
+
+_main_lock = threading.Lock()
+
+
+class WorkerProcess(multiprocessing.context.SpawnProcess):
+    """
+    Процесс spawn с главным модулем fpc_worker. multiprocessing берёт имя главного модуля для нового
+    процесса из __main__.__spec__ в момент start(); спек подменяется только на время запуска.
+    """
+    def start(self):
+        main = sys.modules["__main__"]
+        # Собранный exe главный модуль заново не выполняет
+        if getattr(sys, "frozen", False) or main is sys.modules.get(__name__):
+            return super().start()
+        with _main_lock:
+            spec = main.__spec__
+            main.__spec__ = importlib.util.find_spec(__name__)
+            try:
+                super().start()
+            finally:
+                main.__spec__ = spec
+
+
+class WorkerContext(multiprocessing.context.SpawnContext):
+    Process = WorkerProcess
+
+
+def spawn_context() -> WorkerContext:
+    """mp_context для ProcessPoolExecutor: процессы spawn без импорта FPC.py и tkinter."""
+    return WorkerContext()